@@ -0,0 +1,260 @@
+"""
+Offline feature extraction over recorded sessions.
+
+Computes Welch PSD band powers over sliding windows, the same features as `PSDFeatureExtractor`, for every EEG channel
+of every given recording. Files and channels are spread across a process pool, and each session's features are saved
+to a compressed .npz file as soon as all of its channels are done, e.g.
+
+    python batch_analysis.py ../data/*.bin --out-dir ../data/features
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+from nptyping import NDArray
+
+import board_reader
+import feature_extraction
+import recording
+
+DEFAULT_BANDS = {
+    "10-12 Hz": (10, 12),
+    "Delta": (0.5, 4),
+    "Theta": (4, 7),
+    "Alpha": (8, 15),
+    "Beta": (16, 31),
+}
+# sliding windows transformed at once, bounds the memory of each worker
+WINDOWS_PER_BATCH = 256
+
+
+@dataclass
+class AnalysisParams:
+    data_len_s: float = 3
+    step_s: float = 0.1
+    window_size: int = 256
+    overlap_percentage: float = 0.75
+    bands: Dict[str, Tuple[float, float]] = field(
+        default_factory=lambda: dict(DEFAULT_BANDS)
+    )
+    save_psd: bool = False
+
+
+@dataclass
+class ChannelFeatures:
+    file_name: str
+    rows: List[int]
+    # board timestamp of the last sample of every window
+    window_end_times: NDArray[float]
+    band_powers: NDArray[float]  # shape (windows, channels, bands)
+    # shape (windows, channels, frequencies), if requested
+    psd: Union[NDArray[float], None]
+    freqs: NDArray[float]
+
+
+class RecordingTooShortError(ValueError):
+    """
+    Raised for a recording holding less than one analysis window.
+    """
+
+
+def analyze_channels(
+    file_name: str, rows: List[int], params: AnalysisParams
+) -> ChannelFeatures:
+    """
+    Calculate the band powers of the given rows of a recording over sliding windows. Runs in a worker process, binary
+    recordings are memory-mapped so only the requested rows are read.
+    """
+    rec = recording.read_recording(file_name)
+    fs = rec.header.sample_rate
+    data_len = int(params.data_len_s * fs)
+    step = max(1, int(params.step_s * fs))
+    extractor = feature_extraction.MultichannelPSDFeatureExtractor(
+        fs,
+        window_size=params.window_size,
+        overlap_percentage=params.overlap_percentage,
+        bands=params.bands,
+    )
+    num_samples = rec.data.shape[1]
+    if num_samples < data_len:
+        raise RecordingTooShortError(
+            f"{num_samples / fs:.1f} s of samples, shorter than one {params.data_len_s} s window"
+        )
+    window_ends = np.arange(data_len, num_samples + 1, step)
+    timestamp_row = BoardShim.get_timestamp_channel(rec.header.board_id)
+    band_powers = np.empty(
+        (len(window_ends), len(rows), len(params.bands)), dtype=np.float32
+    )
+    psd = (
+        np.empty((len(window_ends), len(rows), len(extractor.freqs)), dtype=np.float32)
+        if params.save_psd
+        else None
+    )
+    for channel_index, row in enumerate(rows):
+        channel = np.asarray(rec.data[row], dtype=float)
+        # windows of every row share one view of the channel, copied batch by batch
+        windows = np.lib.stride_tricks.sliding_window_view(channel, data_len)[::step]
+        for first in range(0, len(windows), WINDOWS_PER_BATCH):
+            batch = windows[first : first + WINDOWS_PER_BATCH]
+            extractor.process_data(batch)
+            band_powers[
+                first : first + len(batch), channel_index
+            ] = extractor.band_powers
+            if psd is not None:
+                psd[first : first + len(batch), channel_index] = extractor.psd[0]
+    return ChannelFeatures(
+        file_name=file_name,
+        rows=rows,
+        window_end_times=np.asarray(rec.data[timestamp_row])[window_ends - 1],
+        band_powers=band_powers,
+        psd=psd,
+        freqs=extractor.freqs,
+    )
+
+
+def _tasks(file_name: str) -> List[List[int]]:
+    """
+    :return: groups of rows analyzed together, one group per task
+    """
+    recording_format, header = recording.read_header(file_name)
+    eeg_rows = BoardShim.get_eeg_channels(header.board_id)
+    if recording_format != recording.RecordingFormat.BINARY:
+        # only binary recordings can be read a row at a time, others are parsed or decompressed in full by every task
+        return [eeg_rows]
+    return [[row] for row in eeg_rows]
+
+
+def _save_session(out_file: str, parts: List[ChannelFeatures], params: AnalysisParams):
+    parts = sorted(parts, key=lambda part: part.rows[0])
+    arrays = {
+        "rows": np.concatenate([part.rows for part in parts]),
+        "window_end_times": parts[0].window_end_times,
+        "band_powers": np.concatenate([part.band_powers for part in parts], axis=1),
+        "band_names": np.array(list(params.bands)),
+        "band_edges": np.array(list(params.bands.values())),
+        "freqs": parts[0].freqs,
+        "data_len_s": params.data_len_s,
+        "step_s": params.step_s,
+        "window_size": params.window_size,
+        "overlap_percentage": params.overlap_percentage,
+    }
+    if params.save_psd:
+        arrays["psd"] = np.concatenate([part.psd for part in parts], axis=1)
+    np.savez_compressed(out_file, **arrays)
+
+
+def analyze_sessions(
+    file_names: List[str],
+    out_dir: str,
+    params: AnalysisParams,
+    max_workers: Union[int, None] = None,
+    skip_existing: bool = False,
+) -> List[str]:
+    """
+    :return: names of the feature files written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out_files = {
+        file_name: os.path.join(
+            out_dir, os.path.splitext(os.path.basename(file_name))[0] + ".npz"
+        )
+        for file_name in file_names
+    }
+    if len(set(out_files.values())) < len(out_files):
+        raise ValueError("recordings with the same name would share a feature file")
+    if skip_existing:
+        file_names = [
+            name for name in file_names if not os.path.exists(out_files[name])
+        ]
+
+    written = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        remaining: Dict[str, int] = {}
+        parts: Dict[str, List[ChannelFeatures]] = {}
+        # session of every task, a failing task only skips its own session
+        futures: Dict[Future, str] = {}
+        for file_name in file_names:
+            tasks = _tasks(file_name)
+            remaining[file_name] = len(tasks)
+            parts[file_name] = []
+            for rows in tasks:
+                future = executor.submit(analyze_channels, file_name, rows, params)
+                futures[future] = file_name
+        for future in as_completed(futures):
+            file_name = futures[future]
+            if file_name not in parts:
+                continue  # another task of the session failed
+            try:
+                part = future.result()
+            except RecordingTooShortError as e:
+                logging.warning(f"Skipping {file_name}: {e}")
+                del parts[file_name]
+                continue
+            except Exception:
+                logging.exception(f"Skipping {file_name}, analyzing it failed")
+                del parts[file_name]
+                continue
+            parts[part.file_name].append(part)
+            remaining[part.file_name] -= 1
+            if remaining[part.file_name] == 0:
+                # save and release each session as soon as it's complete
+                _save_session(
+                    out_files[part.file_name], parts.pop(part.file_name), params
+                )
+                written.append(out_files[part.file_name])
+                logging.info(f"Saved features of {part.file_name}")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="+", help="recordings written by FileWriter")
+    parser.add_argument(
+        "--out-dir",
+        default=os.path.join(board_reader.FILE_DIR, "..", "data", "features"),
+    )
+    parser.add_argument("--data-len-s", type=float, default=3)
+    parser.add_argument("--step-s", type=float, default=0.1)
+    parser.add_argument("--window-size", type=int, default=256)
+    parser.add_argument("--overlap", type=float, default=0.75)
+    parser.add_argument(
+        "--save-psd", action="store_true", help="also save the full PSD of every window"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes, all cores by default",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="skip sessions whose feature file already exists",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    params = AnalysisParams(
+        data_len_s=args.data_len_s,
+        step_s=args.step_s,
+        window_size=args.window_size,
+        overlap_percentage=args.overlap,
+        save_psd=args.save_psd,
+    )
+    start = time.monotonic()
+    written = analyze_sessions(
+        args.files, args.out_dir, params, args.workers, args.skip_existing
+    )
+    print(f"Analyzed {len(written)} sessions in {time.monotonic() - start:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
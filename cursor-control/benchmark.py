@@ -0,0 +1,539 @@
+"""
+Headless benchmarks of the signal path: PSD extraction, band powers, the recording write path, the plot updates and
+streaming to local subscribers.
+
+Runs on BrainFlow's synthetic board, or on a recording, and saves the results as JSON so runs can be compared. The
+optimized computations are first checked against the BrainFlow calls they replace, a mismatch fails the run like a
+regression does, e.g.
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple, Union
+
+import brainflow
+import matplotlib
+import numpy as np
+from brainflow.board_shim import BoardIds, BoardShim
+from brainflow.data_filter import DataFilter, DetrendOperations
+from nptyping import NDArray
+
+matplotlib.use("Agg")
+
+import board_reader
+import expirement_gui.tk_plots as tk_plots
+import feature_extraction
+import recording
+import streaming
+
+WINDOW_SIZES = [128, 256, 512]
+OVERLAPS = [0.5, 0.75, 0.9]
+DATA_LENGTHS_S = [1, 3, 5]
+FEATURE_INTERVAL_S = 0.1  # new data per streaming update, as in the main loop
+BAND = (10, 12)
+CHANNEL = 2  # c3 on the Cyton and the first EEG rows on the synthetic board
+ACQUISITION_INTERVAL_S = 0.02  # new data per board poll, as in the acquisition stage
+SUBSCRIBER_COUNTS = [1, 4, 8]
+# relative deviation tolerated between an optimized computation and its reference
+EQUIVALENCE_TOLERANCE = 1e-9
+# the standard bands, so that every part of the spectrum is compared
+EQUIVALENCE_BANDS = {
+    "delta": (0.5, 4),
+    "theta": (4, 7),
+    "alpha": (8, 15),
+    "beta": (16, 31),
+    "gamma": (31, 45),
+}
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    params: Dict[str, Union[int, float, str]]
+    calls: int
+    mean_s: float
+    p50_s: float
+    p95_s: float
+    p99_s: float
+    max_s: float
+    # input throughput, for calls that consume samples
+    samples_per_s: Union[float, None] = None
+
+    @property
+    def key(self) -> str:
+        """
+        Identifies the same benchmark across runs.
+        """
+        params = ",".join(f"{name}={value}" for name, value in self.params.items())
+        return f"{self.name}[{params}]"
+
+
+@dataclass
+class BenchmarkData:
+    source: str
+    sample_rate: int
+    eeg_channels: List[int]
+    data: NDArray[float]  # board data of shape (rows, samples)
+    results: List[BenchmarkResult] = field(default_factory=list)
+
+
+def time_calls(
+    func: Callable[[], object],
+    repeats: int,
+    samples_per_call: Union[int, None] = None,
+    warmup: int = 3,
+) -> Dict[str, float]:
+    for _ in range(warmup):
+        func()
+    durations = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        durations[i] = time.perf_counter() - start
+    mean_s = float(durations.mean())
+    return {
+        "calls": repeats,
+        "mean_s": mean_s,
+        "p50_s": float(np.percentile(durations, 50)),
+        "p95_s": float(np.percentile(durations, 95)),
+        "p99_s": float(np.percentile(durations, 99)),
+        "max_s": float(durations.max()),
+        "samples_per_s": samples_per_call / mean_s if samples_per_call else None,
+    }
+
+
+def record_synthetic_data(duration_s: float) -> BenchmarkData:
+    board = board_reader.BoardReader(
+        board_id=BoardIds.SYNTHETIC_BOARD,
+        enable_dev_logger=False,
+        buffer_capacity=int(250 * (duration_s + 5)),
+    )
+    sample_rate = board.get_sampling_rate()
+    logging.info(f"Recording {duration_s} seconds from the synthetic board")
+    with board:
+        time.sleep(duration_s)
+        data = board.get_board_data(int(duration_s * sample_rate))
+    return BenchmarkData(
+        source="synthetic",
+        sample_rate=sample_rate,
+        eeg_channels=board.get_eeg_channels(),
+        data=data,
+    )
+
+
+def load_recording(file_name: str) -> BenchmarkData:
+    rec = recording.read_recording(file_name)
+    eeg_channels = BoardShim.get_eeg_channels(rec.header.board_id)
+    return BenchmarkData(
+        source=os.path.basename(file_name),
+        sample_rate=rec.header.sample_rate,
+        eeg_channels=eeg_channels,
+        data=np.array(rec.data),
+    )
+
+
+def benchmark_psd(bench: BenchmarkData, repeats: int):
+    fs = bench.sample_rate
+    channel = bench.data[CHANNEL]
+    eeg = bench.data[bench.eeg_channels]
+    for window_size, overlap, data_len_s in itertools.product(
+        WINDOW_SIZES, OVERLAPS, DATA_LENGTHS_S
+    ):
+        data_len = int(data_len_s * fs)
+        if data_len < window_size or data_len > bench.data.shape[1]:
+            continue
+        params = {
+            "window_size": window_size,
+            "overlap": overlap,
+            "data_len_s": data_len_s,
+        }
+        window = channel[-data_len:]
+
+        extractor = feature_extraction.PSDFeatureExtractor(
+            fs, window_size, overlap, bands={"band": BAND}
+        )
+        _add(
+            bench,
+            "psd",
+            params,
+            time_calls(lambda: extractor.process_data(window), repeats, data_len),
+        )
+
+        multichannel = feature_extraction.MultichannelPSDFeatureExtractor(
+            fs, window_size=window_size, overlap_percentage=overlap
+        )
+        multichannel_window = eeg[:, -data_len:]
+        _add(
+            bench,
+            "psd_multichannel",
+            dict(params, channels=len(bench.eeg_channels)),
+            time_calls(
+                lambda: multichannel.process_data(multichannel_window),
+                repeats,
+                data_len * len(bench.eeg_channels),
+            ),
+        )
+
+        streaming_extractor = feature_extraction.StreamingPSDFeatureExtractor(
+            fs, data_len_s, window_size, overlap, bands={"band": BAND}
+        )
+        tick = int(FEATURE_INTERVAL_S * fs)
+        ticks = itertools.cycle(
+            [channel[i : i + tick] for i in range(0, len(channel) - tick + 1, tick)]
+        )
+        _add(
+            bench,
+            "psd_streaming_update",
+            dict(params, new_samples=tick),
+            time_calls(
+                lambda: streaming_extractor.process_new_data(next(ticks)),
+                repeats,
+                tick,
+            ),
+        )
+
+
+def benchmark_band_powers(bench: BenchmarkData, repeats: int):
+    extractor = feature_extraction.PSDFeatureExtractor(
+        bench.sample_rate,
+        bands={f"band{i}": (low, low + 4) for i, low in enumerate(range(1, 30, 4))},
+    )
+    extractor.process_data(bench.data[CHANNEL][-3 * bench.sample_rate :])
+    num_bands = len(extractor.bands)
+    _add(
+        bench,
+        "band_power_brainflow",
+        {"bands": num_bands},
+        time_calls(
+            lambda: [
+                extractor.get_band_power(*band) for band in extractor.bands.values()
+            ],
+            repeats,
+        ),
+    )
+    _add(
+        bench,
+        "band_power_weights",
+        {"bands": num_bands},
+        time_calls(extractor._process_band_powers, repeats),
+    )
+
+
+def benchmark_write_path(bench: BenchmarkData, repeats: int):
+    for recording_format in recording.RecordingFormat:
+        # as many samples per write as FileWriter writes at once
+        block_s = (
+            board_reader.FileWriter.COMPRESSED_CHUNK_S
+            if recording_format == recording.RecordingFormat.COMPRESSED
+            else board_reader.FileWriter.WRITE_INTERVAL_S
+        )
+        block_len = max(1, int(block_s * bench.sample_rate))
+        block = bench.data[:, -block_len:]
+        file = (
+            io.StringIO()
+            if recording_format == recording.RecordingFormat.TEXT
+            else io.BytesIO()
+        )
+
+        def write():
+            file.seek(0)
+            recording.write_data(file, recording_format, block)
+
+        _add(
+            bench,
+            "recording_write",
+            {"format": recording_format.name, "block_samples": block_len},
+            time_calls(write, repeats, block_len),
+        )
+
+
+def benchmark_plots(bench: BenchmarkData, repeats: int):
+    extractor = feature_extraction.PSDFeatureExtractor(bench.sample_rate)
+    extractor.process_data(bench.data[CHANNEL][-3 * bench.sample_rate :])
+    psd_plot = tk_plots.PSDPlot(None, max_refresh_hz=math.inf)
+    _add(
+        bench,
+        "plot_psd",
+        {},
+        time_calls(lambda: psd_plot.plot_psd(extractor.psd), repeats),
+    )
+    band_labels = ["Delta", "Theta", "Alpha", "Beta", "Gamma"]
+    band_chart = tk_plots.BandPowerChart(
+        None, 0, 10, band_labels, max_refresh_hz=math.inf
+    )
+    values = np.random.default_rng(0).uniform(0, 10, (16, len(band_labels)))
+    rows = itertools.cycle(values)
+    _add(
+        bench,
+        "plot_band_powers",
+        {"bands": len(band_labels)},
+        time_calls(lambda: band_chart.bar(next(rows)), repeats),
+    )
+
+
+def benchmark_streaming(bench: BenchmarkData, repeats: int):
+    """
+    Publish sample blocks to subscribers on the loopback interface and time until every subscriber received each one.
+    """
+    block_len = max(1, int(ACQUISITION_INTERVAL_S * bench.sample_rate))
+    block = bench.data[:, -block_len:]
+    for num_subscribers in SUBSCRIBER_COUNTS:
+        with streaming.StreamServer(port=0) as server:
+            clients = [
+                streaming.StreamClient(port=server.address[1])
+                for _ in range(num_subscribers)
+            ]
+            received = threading.Semaphore(0)
+
+            def receive(client: streaming.StreamClient):
+                for message in client:
+                    if message.type == streaming.MessageType.SAMPLES:
+                        received.release()
+
+            for client in clients:
+                threading.Thread(target=receive, args=(client,), daemon=True).start()
+            while len(server.metrics()) < num_subscribers:
+                time.sleep(0.01)
+
+            def publish():
+                server.publish_samples(block)
+                for _ in range(num_subscribers):
+                    received.acquire()
+
+            _add(
+                bench,
+                "stream_delivery",
+                {"subscribers": num_subscribers, "block_samples": block_len},
+                time_calls(publish, repeats, block_len),
+            )
+        for client in clients:
+            client.close()
+
+
+def check_equivalence(bench: BenchmarkData) -> int:
+    """
+    Compare the optimized computations against the BrainFlow calls they replace, on the benchmark data.
+
+    :return: number of computations deviating from their reference by more than EQUIVALENCE_TOLERANCE
+    """
+    mismatches = 0
+    eeg = bench.data[bench.eeg_channels]
+    for detrend_operation, data_len_s in itertools.product(
+        DetrendOperations, DATA_LENGTHS_S
+    ):
+        data_len = int(data_len_s * bench.sample_rate)
+        if data_len > eeg.shape[1]:
+            continue
+        window = eeg[:, -data_len:]
+        expected = np.array(window, order="C")
+        for row in expected:
+            DataFilter.detrend(row, detrend_operation)
+        detrended = feature_extraction._brainflow_detrend(window, detrend_operation)
+        mismatches += _check(
+            f"detrend[operation={detrend_operation.name},data_len_s={data_len_s}]",
+            detrended,
+            expected,
+        )
+
+    channel = bench.data[CHANNEL]
+    for detrend_operation, window_size, overlap, data_len_s in itertools.product(
+        DetrendOperations, WINDOW_SIZES, OVERLAPS, DATA_LENGTHS_S
+    ):
+        data_len = int(data_len_s * bench.sample_rate)
+        if data_len < window_size or data_len > len(channel):
+            continue
+        name = (
+            f"psd_streaming[operation={detrend_operation.name},window_size={window_size},"
+            f"overlap={overlap},data_len_s={data_len_s}]"
+        )
+        expected, band_powers = _streaming_band_powers(
+            bench, channel, detrend_operation, window_size, overlap, data_len_s
+        )
+        # relative to each band, the low bands would otherwise hide deviations of the high ones
+        band_scale = expected.max(axis=0)
+        mismatches += _check(name, band_powers / band_scale, expected / band_scale)
+    return mismatches
+
+
+def _streaming_band_powers(
+    bench: BenchmarkData,
+    channel: NDArray[float],
+    detrend_operation: DetrendOperations,
+    window_size: int,
+    overlap: float,
+    data_len_s: float,
+) -> Tuple[NDArray[float], NDArray[float]]:
+    """
+    Stream `channel` through `StreamingPSDFeatureExtractor` and compute the band powers of `PSDFeatureExtractor` on
+    every analysis window that starts at a segment boundary, where the two estimates use the same segments.
+
+    :return: band powers of `PSDFeatureExtractor` and of the streaming extractor, shape (windows, bands)
+    """
+    reference = feature_extraction.PSDFeatureExtractor(
+        bench.sample_rate,
+        window_size,
+        overlap,
+        detrend_operation=detrend_operation,
+        bands=EQUIVALENCE_BANDS,
+    )
+    streaming = feature_extraction.StreamingPSDFeatureExtractor(
+        bench.sample_rate,
+        data_len_s,
+        window_size,
+        overlap,
+        detrend_operation=detrend_operation,
+        bands=EQUIVALENCE_BANDS,
+    )
+    data_len = int(data_len_s * bench.sample_rate)
+    hop_size = streaming.hop_size
+    expected = []
+    band_powers = []
+    # after the first chunk every hop ends a window starting at a segment boundary, the hops are fed in two parts
+    # so that the updates not completing a segment are covered as well
+    end = data_len % hop_size
+    streaming.process_new_data(channel[:end])
+    while end + hop_size <= len(channel):
+        streaming.process_new_data(channel[end : end + hop_size // 2])
+        streaming.process_new_data(channel[end + hop_size // 2 : end + hop_size])
+        end += hop_size
+        if end >= data_len:
+            reference.process_data(channel[end - data_len : end])
+            expected.append(reference.band_powers)
+            band_powers.append(streaming.band_powers)
+    return np.array(expected), np.array(band_powers)
+
+
+def _check(name: str, actual: NDArray[float], expected: NDArray[float]) -> bool:
+    """
+    :return: whether `actual` deviates from `expected` by more than EQUIVALENCE_TOLERANCE of its largest value
+    """
+    deviation = np.abs(actual - expected).max() / max(np.abs(expected).max(), 1e-300)
+    mismatch = deviation > EQUIVALENCE_TOLERANCE
+    logging.log(
+        logging.ERROR if mismatch else logging.INFO,
+        f"{'MISMATCH ' if mismatch else ''}{name}: relative deviation {deviation:.2e}",
+    )
+    return mismatch
+
+
+def _add(bench: BenchmarkData, name: str, params: Dict, timings: Dict[str, float]):
+    result = BenchmarkResult(name, params, **timings)
+    bench.results.append(result)
+    logging.info(
+        f"{result.key}: p50 {result.p50_s * 1e3:.3f} ms, p99 {result.p99_s * 1e3:.3f} ms"
+    )
+
+
+def compare(results: List[BenchmarkResult], baseline_file: str, tolerance: float):
+    """
+    Print the p50 ratio of every benchmark to a previous run.
+
+    :return: number of benchmarks slower than the baseline by more than `tolerance`
+    """
+    with open(baseline_file) as file:
+        baseline = {
+            BenchmarkResult(**result).key: BenchmarkResult(**result)
+            for result in json.load(file)["results"]
+        }
+    regressions = 0
+    for result in results:
+        previous = baseline.get(result.key)
+        if previous is None:
+            continue
+        ratio = result.p50_s / previous.p50_s
+        regressed = ratio > 1 + tolerance
+        regressions += regressed
+        print(f"{'REGRESSION ' if regressed else ''}{result.key}: {ratio:.2f}x")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--recording",
+        metavar="FILE",
+        help="benchmark on a recording instead of the synthetic board",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=8,
+        help="seconds of synthetic board data to record, at least the longest analysis window",
+    )
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            board_reader.FILE_DIR,
+            "..",
+            "data",
+            f"benchmark-{datetime.now().isoformat()}.json",
+        ),
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="previous results to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="slowdown of the median call tolerated by --compare before failing",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.recording is not None:
+        bench = load_recording(args.recording)
+    else:
+        bench = record_synthetic_data(args.duration)
+    mismatches = check_equivalence(bench)
+    benchmark_psd(bench, args.repeats)
+    benchmark_band_powers(bench, args.repeats)
+    benchmark_write_path(bench, args.repeats)
+    benchmark_plots(bench, args.repeats)
+    benchmark_streaming(bench, args.repeats)
+
+    # the default data directory doesn't exist in a fresh checkout
+    out_dir = os.path.dirname(args.output)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "time": datetime.now().isoformat(),
+                "source": bench.source,
+                "sample_rate": bench.sample_rate,
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "brainflow": getattr(brainflow, "__version__", "unknown"),
+                "machine": platform.platform(),
+                "results": [asdict(result) for result in bench.results],
+            },
+            file,
+            indent=2,
+        )
+    print(f"Saved {len(bench.results)} results to {args.output}")
+
+    regressions = 0
+    if args.compare is not None:
+        regressions = compare(bench.results, args.compare, args.tolerance)
+    sys.exit(1 if mismatches or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
+from __future__ import annotations
+
 import logging
 import os
 import threading
 import time
 from datetime import datetime as datetime
-from typing import List
+from typing import Callable, List, Union
 
 import numpy
 from brainflow.board_shim import (
@@ -12,17 +14,36 @@ from brainflow.board_shim import (
     BrainFlowInputParams,
     BrainFlowError,
 )
+from brainflow.exit_codes import BrainflowExitCodes
 from nptyping import NDArray
-from nptyping.array import Array
+
+import recording
+import shared_ring
 
 DEFAULT_CYTON_SERIAL_PORT = "/dev/ttyUSB0"
-DEFAULT_CYTON_PARAMS = BrainFlowInputParams()
-DEFAULT_CYTON_PARAMS.serial_port = DEFAULT_CYTON_SERIAL_PORT
+
+
+def cyton_params(serial_port: str = DEFAULT_CYTON_SERIAL_PORT) -> BrainFlowInputParams:
+    """
+    :param serial_port: port of the Cyton's USB dongle, e.g. /dev/ttyUSB1 for a second board
+    """
+    params = BrainFlowInputParams()
+    params.serial_port = serial_port
+    return params
+
+
+DEFAULT_CYTON_PARAMS = cyton_params()
 
 FILE_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
 class BoardReader:
+    """
+    Owns the board session. Samples are moved out of BrainFlow's buffer into a ring of `buffer_capacity` samples,
+    numbered by a running sequence counter, so that consumers can read only the samples they haven't seen yet while
+    `get_board_data` keeps serving the newest window.
+    """
+
     def __init__(
         self,
         board_id: BoardIds = BoardIds.CYTON_BOARD,
@@ -34,21 +55,185 @@ class BoardReader:
             BoardShim.enable_dev_board_logger()
         self.board = BoardShim(board_id, board_params)
         self.buffer_capacity = buffer_capacity
+        self.buffer = numpy.zeros(
+            (BoardShim.get_num_rows(self.board.board_id), self.buffer_capacity)
+        )
+        self.samples_received = 0  # sequence number of the next sample to arrive
+        self.buffer_lock = threading.Lock()
+        self.listeners: List[Callable[[NDArray[float]], None]] = []
 
     def __enter__(self):
         self.board.prepare_session()
         self.board.start_stream(num_samples=self.buffer_capacity)
 
-    def pop_board_data(self) -> NDArray[float]:
+    def poll(self) -> int:
+        """
+        Move new samples out of BrainFlow's buffer without reading them. Reads poll as well, polling on a schedule
+        keeps BrainFlow's buffer from overflowing between infrequent reads.
+
+        :return: number of new samples
+        """
+        with self.buffer_lock:
+            samples_before = self.samples_received
+            self._poll()
+            return self.samples_received - samples_before
+
+    def _poll(self):
+        """
+        Move all samples BrainFlow has collected since the last poll into the ring buffer. Must hold `buffer_lock`.
+        """
+        new_data = self._pop_new_data()
+        num_new = new_data.shape[1]
+        kept = new_data[:, -self.buffer_capacity :]
+        first_kept = self.samples_received + num_new - kept.shape[1]
+        positions = numpy.arange(first_kept, first_kept + kept.shape[1])
+        self.buffer[:, positions % self.buffer_capacity] = kept
+        self.samples_received += num_new
+        if num_new == 0:
+            return
+        for listener in self.listeners:
+            try:
+                listener(new_data)
+            except Exception:
+                # a broken listener mustn't stop the board's own consumers
+                logging.exception(f"Board data listener {listener} failed")
+
+    def _pop_new_data(self) -> NDArray[float]:
         """
-        Removes and returns all available data in the buffer, up to a max defined by `buffer_capacity`
-        :return: list of channels, channels are a list of samples which are floats
+        :return: all samples the board produced since the previous call
         """
-        assert False
         return self.board.get_board_data()
 
+    def _copy_samples(self, first_sample: int, end_sample: int) -> NDArray[float]:
+        """
+        :return: copy of the samples with sequence numbers first_sample up to end_sample, which must still be in the
+            ring buffer
+        """
+        start = first_sample % self.buffer_capacity
+        end = start + end_sample - first_sample
+        if end <= self.buffer_capacity:
+            return self.buffer[:, start:end].copy()
+        return numpy.concatenate(
+            (self.buffer[:, start:], self.buffer[:, : end - self.buffer_capacity]),
+            axis=1,
+        )
+
+    def _take_samples(
+        self,
+        rows: NDArray[int],
+        first_sample: int,
+        end_sample: int,
+        out: NDArray[float],
+    ):
+        """
+        Copy the given rows of the samples with sequence numbers first_sample up to end_sample, which must still be in
+        the ring buffer, into the first columns of `out`.
+        """
+        start = first_sample % self.buffer_capacity
+        end = start + end_sample - first_sample
+        first_part = min(end, self.buffer_capacity) - start
+        num_samples = end_sample - first_sample
+        # row by row, each row of the ring buffer is contiguous, so nothing but the requested samples is copied
+        for index, row in enumerate(rows):
+            numpy.copyto(
+                out[index, :first_part], self.buffer[row, start : start + first_part]
+            )
+            if end > self.buffer_capacity:
+                numpy.copyto(
+                    out[index, first_part:num_samples],
+                    self.buffer[row, : end - self.buffer_capacity],
+                )
+
     def get_board_data(self, num_samples: int) -> NDArray[float]:
-        return self.board.get_current_board_data(num_samples)
+        """
+        :return: the newest samples, up to `num_samples`, oldest first
+        """
+        with self.buffer_lock:
+            self._poll()
+            num_samples = min(num_samples, self.samples_received, self.buffer_capacity)
+            return self._copy_samples(
+                self.samples_received - num_samples, self.samples_received
+            )
+
+    def select_rows(self, rows: List[int]) -> NDArray[int]:
+        """
+        Check board rows once, e.g. at startup, for the reads taking rows.
+
+        :return: the rows as an index array
+        """
+        num_rows = self.buffer.shape[0]
+        for row in rows:
+            if not 0 <= row < num_rows:
+                raise ValueError(
+                    f"Board {self.board.board_id} has no row {row}, it has {num_rows} rows"
+                )
+        return numpy.array(rows, dtype=numpy.intp)
+
+    def get_board_data_into(self, rows: NDArray[int], out: NDArray[float]) -> int:
+        """
+        Copy only the requested rows of the newest samples into a buffer the caller reuses, instead of a new array of
+        every row like `get_board_data`.
+
+        :param rows: board rows as returned by `select_rows`
+        :param out: array of shape (len(rows), samples), filled with the newest samples, oldest first
+        :return: number of samples copied into the first columns of `out`, fewer than it holds until enough arrived
+        """
+        with self.buffer_lock:
+            self._poll()
+            num_samples = min(out.shape[1], self.samples_received, self.buffer_capacity)
+            self._take_samples(
+                rows, self.samples_received - num_samples, self.samples_received, out
+            )
+        return num_samples
+
+    def create_consumer(self, from_oldest: bool = False) -> "BoardDataConsumer":
+        """
+        :param from_oldest: start with the oldest samples still buffered instead of with samples arriving from now on
+        """
+        with self.buffer_lock:
+            if from_oldest:
+                next_sample = max(0, self.samples_received - self.buffer_capacity)
+            else:
+                next_sample = self.samples_received
+        return BoardDataConsumer(self, next_sample)
+
+    def add_listener(self, listener: Callable[[NDArray[float]], None]):
+        """
+        :param listener: called with every block of new samples, shape (rows, samples), on the thread that polls the
+            board. It holds `buffer_lock` meanwhile, so it must be quick and must not read from the board reader.
+        """
+        with self.buffer_lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[NDArray[float]], None]):
+        with self.buffer_lock:
+            self.listeners.remove(listener)
+
+    def publish_shared_memory(
+        self, name: Union[str, None] = None, capacity_s: float = 10
+    ) -> shared_ring.SharedRingPublisher:
+        """
+        Publish every new sample to a shared-memory ring that other processes can attach to with
+        `shared_ring.SharedRingReader`, until `stop_publishing` is called.
+
+        :param name: name of the shared memory block, random if None
+        :param capacity_s: seconds of samples the ring holds
+        """
+        publisher = shared_ring.SharedRingPublisher(
+            name,
+            board_id=self.board.board_id,
+            sample_rate=self.get_sampling_rate(),
+            num_rows=self.buffer.shape[0],
+            capacity=int(capacity_s * self.get_sampling_rate()),
+            eeg_rows=self.get_eeg_channels(),
+            timestamp_row=self.get_timestamp_channel(),
+        )
+        self.add_listener(publisher.publish)
+        return publisher
+
+    def stop_publishing(self, publisher: shared_ring.SharedRingPublisher):
+        self.remove_listener(publisher.publish)
+        publisher.close()
 
     def get_eeg_channels(self) -> List[int]:
         return self.board.get_eeg_channels(self.board.board_id)
@@ -56,102 +241,289 @@ class BoardReader:
     def get_sampling_rate(self) -> int:
         return self.board.get_sampling_rate(self.board.board_id)
 
+    def get_timestamp_channel(self) -> int:
+        return self.board.get_timestamp_channel(self.board.board_id)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.board.stop_stream()
         self.board.release_session()
 
 
+class ReplayBoardReader(BoardReader):
+    """
+    Plays back a recording written by `FileWriter` through the `BoardReader` API, without any hardware.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        speed: Union[float, None] = 1.0,
+        samples_per_poll: Union[int, None] = None,
+        buffer_capacity: int = 250 * 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param file_name: recording in any `recording.RecordingFormat`
+        :param speed: playback rate relative to `clock`, e.g. 50 for 50x. None plays back as fast as possible,
+            releasing `samples_per_poll` samples each time the board data is read.
+        :param samples_per_poll: defaults to a tenth of a second of samples
+        :param clock: time in seconds the samples are released by, e.g. a simulated clock the rest of the session
+            follows as well
+        """
+        self.recording = recording.read_recording(file_name)
+        super(ReplayBoardReader, self).__init__(
+            board_id=BoardIds(self.recording.header.board_id),
+            board_params=BrainFlowInputParams(),
+            enable_dev_logger=False,
+            buffer_capacity=buffer_capacity,
+        )
+        self.speed = speed
+        self.clock = clock
+        self.samples_per_poll = (
+            samples_per_poll
+            if samples_per_poll is not None
+            else max(1, self.recording.header.sample_rate // 10)
+        )
+        self.replay_position = 0  # index of the next recorded sample to release
+        self.replay_start_s: Union[float, None] = None
+
+    def __enter__(self):
+        self.replay_start_s = self.clock() - self._position_to_seconds(
+            self.replay_position
+        )
+
+    def _position_to_seconds(self, position: int) -> float:
+        if self.speed is None:
+            return 0
+        return position / (self.recording.header.sample_rate * self.speed)
+
+    def _pop_new_data(self) -> NDArray[float]:
+        if self.replay_start_s is None:
+            raise BrainFlowError(
+                "Replay is not running", BrainflowExitCodes.BOARD_NOT_READY_ERROR
+            )
+        num_recorded = self.recording.data.shape[1]
+        if self.speed is None:
+            due = self.replay_position + self.samples_per_poll
+        else:
+            elapsed_s = self.clock() - self.replay_start_s
+            due = int(elapsed_s * self.speed * self.recording.header.sample_rate)
+        end = min(due, num_recorded)
+        new_data = numpy.asarray(self.recording.data[:, self.replay_position : end])
+        self.replay_position = max(self.replay_position, end)
+        return new_data
+
+    @property
+    def finished(self) -> bool:
+        return self.replay_position >= self.recording.data.shape[1]
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.replay_start_s = None
+
+
+class BoardDataConsumer:
+    """
+    Reads every sample from a `BoardReader` exactly once, in order. Samples that are overwritten in the ring buffer
+    before the consumer reads them are counted in `samples_lost` and reported.
+    """
+
+    def __init__(self, board_reader: BoardReader, next_sample: int):
+        self.board_reader = board_reader
+        self.next_sample = next_sample  # sequence number of the next sample to read
+        self.samples_lost = 0
+
+    def read(self) -> NDArray[float]:
+        """
+        :return: all samples that arrived since the previous read, oldest first
+        """
+        board_reader = self.board_reader
+        with board_reader.buffer_lock:
+            board_reader._poll()
+            self._skip_lost()
+            data = board_reader._copy_samples(
+                self.next_sample, board_reader.samples_received
+            )
+            self.next_sample = board_reader.samples_received
+        return data
+
+    def _skip_lost(self):
+        """
+        Move past samples that were overwritten before they were read. Must hold the board reader's `buffer_lock`.
+        """
+        board_reader = self.board_reader
+        oldest_buffered = board_reader.samples_received - board_reader.buffer_capacity
+        if self.next_sample < oldest_buffered:
+            num_lost = oldest_buffered - self.next_sample
+            logging.warning(
+                f"Consumer fell behind, samples {self.next_sample} to {oldest_buffered - 1} "
+                f"({num_lost} samples) were lost"
+            )
+            self.samples_lost += num_lost
+            self.next_sample = oldest_buffered
+
+    def read_rows(self, rows: NDArray[int]) -> NDArray[float]:
+        """
+        Like `read`, copying only the requested rows.
+
+        :param rows: board rows as returned by `BoardReader.select_rows`
+        """
+        board_reader = self.board_reader
+        with board_reader.buffer_lock:
+            board_reader._poll()
+            self._skip_lost()
+            data = numpy.empty(
+                (len(rows), board_reader.samples_received - self.next_sample)
+            )
+            board_reader._take_samples(
+                rows, self.next_sample, board_reader.samples_received, data
+            )
+            self.next_sample = board_reader.samples_received
+        return data
+
+    def read_into(self, rows: NDArray[int], out: NDArray[float]) -> int:
+        """
+        Like `read_rows`, into a buffer the caller reuses. Samples that don't fit are left for the next call.
+
+        :param out: array of shape (len(rows), samples)
+        :return: number of samples copied into the first columns of `out`, 0 once every sample has been read
+        """
+        board_reader = self.board_reader
+        with board_reader.buffer_lock:
+            # only poll once caught up, so a loop reading until 0 ends even while samples keep arriving
+            if self.next_sample == board_reader.samples_received:
+                board_reader._poll()
+            self._skip_lost()
+            end_sample = min(
+                board_reader.samples_received, self.next_sample + out.shape[1]
+            )
+            num_samples = end_sample - self.next_sample
+            board_reader._take_samples(rows, self.next_sample, end_sample, out)
+            self.next_sample = end_sample
+        return num_samples
+
+
 class FileWriter:
     """
     Responsible for writing data from the board reader to a file.
-    Operates within a thread, no interaction necessary after construction.
+    Operates within a thread, only `close` has to be called at the end of the recording, while the board session is
+    still open, or the last samples are lost. Without the thread, the owner opens the file and calls `write_new_data`
+    on its own schedule instead.
     """
 
     WRITE_INTERVAL_S = 0.1
+    # compressed recordings are written in chunks of about this length, shorter chunks compress worse
+    COMPRESSED_CHUNK_S = 1.0
 
     def __init__(
         self,
         board_reader: BoardReader,
         out_dir: str = os.path.join(FILE_DIR, "..", "data"),
+        recording_format: recording.RecordingFormat = recording.RecordingFormat.BINARY,
+        start_thread: bool = True,
+        file_prefix: Union[str, None] = None,
     ):
+        """
+        :param start_thread: write from a thread of our own every WRITE_INTERVAL_S
+        :param file_prefix: start of the file name, defaults to the board id
+        """
         self.board_reader = board_reader
+        self.recording_format = recording_format
         self.thread = threading.Thread(target=self._run, daemon=True)
-        file_prefix = f"board-{self.board_reader.board.get_board_id()}"
+        self.stop_event = threading.Event()
+        if file_prefix is None:
+            file_prefix = f"board-{self.board_reader.board.get_board_id()}"
         iso_time = datetime.now().isoformat()
-        self.file_name = os.path.join(out_dir, f"{file_prefix}-{iso_time}.txt")
-        self.wrote_header = False
-        self.latest_timestamp = None
-        self.timestamp_channel = BoardShim.get_timestamp_channel(
-            self.board_reader.board.get_board_id()
-        )
+        extension = recording.FILE_EXTENSIONS[self.recording_format]
+        self.file_name = os.path.join(out_dir, f"{file_prefix}-{iso_time}{extension}")
+        self.file = None
+        self.consumer = self.board_reader.create_consumer(from_oldest=True)
+        self.pending: List[
+            NDArray[float]
+        ] = []  # samples waiting for a full compressed chunk
+        self.num_pending = 0
 
-        self.thread.start()
+        if start_thread:
+            self.thread.start()
 
     def _write_header(self):
         logging.debug("Writing header to file")
-        header = [
-            "%CursorControl board reader raw EEG data",
-            f"%Number of channels = {len(self.board_reader.get_eeg_channels())}",
-            f"%Sample rate = {self.board_reader.get_sampling_rate()}",
-            f"%Board = {BoardIds(self.board_reader.board.get_board_id()).name}",
-        ]
-        self.file.write("\n".join(header))
-        self.file.write("\n")
-
-    def _get_index_for_timestamp(self, data: Array, timestamp: float) -> int:
-        """
-        :return: index of the timestamp in the array, -1 if does not exist in array
-        """
-        last_data_where: Array = numpy.where(
-            data[self.timestamp_channel] == self.latest_timestamp
-        )[0]
-        last_data_index: int = -1 if len(last_data_where) == 0 else last_data_where[0]
-        return last_data_index
-
-    def _write_new_data(self):
+        board_id = self.board_reader.board.get_board_id()
+        header = recording.RecordingHeader(
+            num_channels=len(self.board_reader.get_eeg_channels()),
+            sample_rate=self.board_reader.get_sampling_rate(),
+            board_id=board_id,
+            num_rows=BoardShim.get_num_rows(board_id),
+        )
+        recording.write_header(self.file, self.recording_format, header)
+
+    def open(self):
+        """
+        Create the file and write the header.
+        """
+        mode = "w" if self.recording_format == recording.RecordingFormat.TEXT else "wb"
+        self.file = open(self.file_name, mode)
+        self._write_header()
+
+    def write_new_data(self):
+        """
+        Append the samples that arrived since the previous write, the file must be open.
+        """
         logging.debug("Acquiring new data to write to file")
         try:
-            data = self.board_reader.get_board_data(self.board_reader.buffer_capacity)
-            if len(data) == 0:
+            data = self.consumer.read()
+            if data.shape[1] == 0:
                 return
-            if self.latest_timestamp is not None:
-                last_data_index = self._get_index_for_timestamp(
-                    data, self.latest_timestamp
-                )
-                if last_data_index == -1:
-                    logging.warning(
-                        "Last data no longer in buffer - FileWriter is getting behind and may have lost data"
-                    )
-                    last_data_index = 0
-                new_data_start = last_data_index + 1
-                data = data[:, new_data_start:]
-            self.latest_timestamp = data[self.timestamp_channel][-1]
-            for idx in range(len(data[0])):
-                data_for_line = []
-                for channel in data:
-                    data_for_line.append(str(channel[idx]))
-                assert len(data_for_line) > 0
-                self.file.write(",".join(data_for_line))
-                self.file.write("\n")
         except BrainFlowError as e:
             logging.debug(f"Quietly handling BrainFlowError: {e}")
             return
+        if self.recording_format == recording.RecordingFormat.COMPRESSED:
+            self.pending.append(data)
+            self.num_pending += data.shape[1]
+            chunk_len = self.COMPRESSED_CHUNK_S * self.board_reader.get_sampling_rate()
+            if self.num_pending < chunk_len:
+                return
+            data = self._take_pending()
+        recording.write_data(self.file, self.recording_format, data)
+        self.file.flush()
 
-    def _run(self):
+    def _take_pending(self) -> NDArray[float]:
+        data = numpy.concatenate(self.pending, axis=1)
+        self.pending = []
+        self.num_pending = 0
+        return data
+
+    def close(self):
         """
-        Entry-point for the thread.
+        Write the samples that arrived since the last write, including a partial compressed chunk, and close the file.
+        Stops and joins the thread if it was started.
         """
-        time.sleep(3)
-        with open(self.file_name, "w") as self.file:
-            while True:
-                if not self.wrote_header:
-                    self._write_header()
-                    self.wrote_header = True
+        if self.thread.ident is not None:
+            self.stop_event.set()
+            self.thread.join()
+            return
+        self._close_file()
 
-                self._write_new_data()
+    def _close_file(self):
+        if self.file is not None:
+            if self.pending:
+                recording.write_data(
+                    self.file, self.recording_format, self._take_pending()
+                )
+            self.file.close()
+            self.file = None
 
-                self.file.flush()
-                time.sleep(self.WRITE_INTERVAL_S)
+    def _run(self):
+        """
+        Entry-point for the thread.
+        """
+        self.stop_event.wait(3)
+        self.open()
+        try:
+            while not self.stop_event.wait(self.WRITE_INTERVAL_S):
+                self.write_new_data()
+            self.write_new_data()
+        finally:
+            self._close_file()
 
 
 if __name__ == "__main__":
@@ -174,4 +546,4 @@ if __name__ == "__main__":
         print(len(data[0]) / 250)
         print(data)
 
-    file_write.thread.join()
+        file_write.close()
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+from typing import Dict, Hashable, List, Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+
+class RunningStats:
+    """
+    Running mean and variance by Welford's method, updated in O(1) per value. Values can be scalars or arrays, the
+    latter giving element-wise statistics. With a half-life, older values are forgotten exponentially so the
+    statistics follow slow drifts in the signal.
+    """
+
+    def __init__(self, half_life: Union[float, None] = None):
+        """
+        :param half_life: number of updates after which a value's weight has halved, None to weigh all values equally
+        """
+        self.decay = 1.0 if half_life is None else 0.5 ** (1 / half_life)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.weight = 0.0  # sum of the weights of all values
+        self.mean = 0.0
+        self.sum_squares = 0.0  # weighted sum of squared differences from the mean
+
+    def update(self, value: Union[float, NDArray[float]]):
+        self.count += 1
+        self.weight = self.decay * self.weight + 1
+        delta = value - self.mean
+        self.mean += delta / self.weight
+        self.sum_squares = self.decay * self.sum_squares + delta * (value - self.mean)
+
+    @property
+    def variance(self) -> Union[float, NDArray[float]]:
+        if self.count < 2:
+            return np.full(np.shape(self.mean), np.nan)[()]
+        return self.sum_squares / self.weight
+
+    @property
+    def std(self) -> Union[float, NDArray[float]]:
+        return np.sqrt(self.variance)
+
+
+class AdaptiveLinearDecoder:
+    """
+    Linear mapping from features to cursor velocity with an adaptive intercept and gain, after the Wadsworth BCI.
+
+    Every feature is normalized by its own running mean and standard deviation, and the control signal is a weighted
+    sum of the normalized features. The signal's running statistics are also kept per target, and the intercept is the
+    average of the per-target means, so that over time the cursor moves up as much as down whatever the mix of targets.
+    The gain scales one standard deviation of the signal to `velocity_per_std`. Statistics build up from live data, the
+    cursor stays still until `min_updates` values have been seen.
+    """
+
+    def __init__(
+        self,
+        weights: NDArray[float],
+        velocity_per_std: float = 150,
+        max_velocity: float = 400,
+        min_updates: int = 20,
+        half_life: Union[float, None] = 600,
+    ):
+        """
+        :param weights: weight of each normalized feature in the control signal, positive weights move the cursor down
+        :param velocity_per_std: cursor speed in pixels per second for a signal one standard deviation from the intercept
+        :param max_velocity: limit on the cursor speed in pixels per second
+        :param min_updates: number of feature updates needed before the cursor moves
+        :param half_life: number of updates over which old statistics are half forgotten, None never forgets
+        """
+        self.weights = np.asarray(weights, dtype=float)
+        self.velocity_per_std = velocity_per_std
+        self.max_velocity = max_velocity
+        self.min_updates = min_updates
+        self.half_life = half_life
+        self.feature_stats = RunningStats(half_life)
+        self.signal_stats = RunningStats(half_life)
+        self.target_stats: Dict[Hashable, RunningStats] = {}
+        # target of the running trial, None between trials, set by the experiment
+        self.target: Union[Hashable, None] = None
+
+    @property
+    def intercept(self) -> float:
+        # copied first, the control thread may add a target while the GUI reads the intercept
+        target_means = [
+            stats.mean for stats in list(self.target_stats.values()) if stats.count > 0
+        ]
+        if not target_means:
+            return self.signal_stats.mean
+        return sum(target_means) / len(target_means)
+
+    @property
+    def gain(self) -> float:
+        std = self.signal_stats.std
+        if not std > 0:
+            return 0.0
+        return self.velocity_per_std / std
+
+    def decode(self, features: NDArray[float]) -> int:
+        """
+        Update the statistics with a new feature vector and map it to a velocity.
+
+        :return: cursor velocity in pixels per second, negative is up
+        """
+        self.feature_stats.update(np.asarray(features, dtype=float))
+        feature_std = self.feature_stats.std
+        if self.feature_stats.count < 2:
+            normalized = np.zeros(len(self.weights))
+        else:
+            normalized = np.divide(
+                features - self.feature_stats.mean,
+                feature_std,
+                out=np.zeros(len(self.weights)),
+                where=feature_std > 0,
+            )
+        control_signal = float(self.weights @ normalized)
+        self.signal_stats.update(control_signal)
+        target = self.target
+        if target is not None:
+            if target not in self.target_stats:
+                self.target_stats[target] = RunningStats(self.half_life)
+            self.target_stats[target].update(control_signal)
+        if self.signal_stats.count < self.min_updates:
+            return 0
+        velocity = self.gain * (control_signal - self.intercept)
+        return int(round(max(-self.max_velocity, min(self.max_velocity, velocity))))
+
+
+class RSquaredMap:
+    """
+    Coefficient of determination between the target and every feature, e.g. every channel and PSD bin, after the r²
+    maps the Wadsworth BCI picks its features from. Only the count, sum and sum of squares of every feature are kept
+    per target, so each update is O(features) and the map can be calculated at any time without any raw history.
+    """
+
+    def __init__(self, shape: Tuple[int, ...]):
+        """
+        :param shape: shape of the feature arrays, e.g. (channels, frequencies)
+        """
+        self.shape = tuple(shape)
+        self.counts: Dict[Hashable, int] = {}
+        self.sums: Dict[Hashable, NDArray[float]] = {}
+        self.sums_of_squares: Dict[Hashable, NDArray[float]] = {}
+
+    def reset(self):
+        self.counts.clear()
+        self.sums.clear()
+        self.sums_of_squares.clear()
+
+    def update(self, target: Hashable, features: NDArray[float]):
+        """
+        :param target: condition the features were recorded under
+        :param features: array of `shape`
+        """
+        if target not in self.counts:
+            self.counts[target] = 0
+            self.sums[target] = np.zeros(self.shape)
+            self.sums_of_squares[target] = np.zeros(self.shape)
+        self.counts[target] += 1
+        self.sums[target] += features
+        self.sums_of_squares[target] += np.square(features)
+
+    def r_squared(self) -> NDArray[float]:
+        """
+        Between-target sum of squares over the total sum of squares, the squared point-biserial correlation for two
+        targets.
+
+        :return: array of `shape`, NaN for features that haven't varied or while fewer than two targets were seen
+        """
+        if len(self.counts) < 2:
+            return np.full(self.shape, np.nan)
+        total_count = sum(self.counts.values())
+        total_sum = sum(self.sums.values())
+        grand_mean = total_sum / total_count
+        total_squares = sum(self.sums_of_squares.values()) - total_sum * grand_mean
+        between_squares = sum(
+            count * np.square(self.sums[target] / count - grand_mean)
+            for target, count in self.counts.items()
+        )
+        return np.divide(
+            between_squares,
+            total_squares,
+            out=np.full(self.shape, np.nan),
+            where=total_squares > 0,
+        )
+
+    def top_features(
+        self, num_features: int = 5, mask: Union[NDArray[bool], None] = None
+    ) -> List[Tuple[Tuple[int, ...], float]]:
+        """
+        :param mask: array of `shape`, True for the features to choose from, e.g. to leave out filtered frequencies
+        :return: index and r² of the features that best separate the targets, best first
+        """
+        r_squared = self.r_squared()
+        if mask is not None:
+            r_squared = np.where(mask, r_squared, np.nan)
+        ranked = np.argsort(np.nan_to_num(r_squared, nan=-1), axis=None)[::-1]
+        return [
+            (
+                tuple(int(i) for i in np.unravel_index(index, self.shape)),
+                float(r_squared.flat[index]),
+            )
+            for index in ranked[:num_features]
+            if not np.isnan(r_squared.flat[index])
+        ]
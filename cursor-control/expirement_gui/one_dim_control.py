@@ -2,13 +2,15 @@ import random
 import time
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Tuple, Union
+from typing import Callable, Tuple, Union
 import logging
 
 import PySimpleGUI as sg
 
 DEFAULT_CURSOR_RADIUS = 10
 DEFAULT_TARGET_SIDE_LENGTH = 100
+DEFAULT_FRAME_RATE_HZ = 60
+DEFAULT_AREA_SIZE = (400, 800)  # width, height of the cursor canvas in pixels
 
 
 @dataclass
@@ -23,13 +25,31 @@ class Point:
 
 
 class Cursor:
-    def __init__(self, canvas: sg.tk.Canvas, radius: int = DEFAULT_CURSOR_RADIUS):
+    """
+    Cursor position within an area of the given size. The position is kept here rather than read back from the canvas,
+    so the cursor works the same without one; with a canvas it is drawn there as well.
+    """
+
+    def __init__(
+        self,
+        canvas: Union[sg.tk.Canvas, None],
+        radius: int = DEFAULT_CURSOR_RADIUS,
+        area_size: Tuple[int, int] = DEFAULT_AREA_SIZE,
+    ):
+        """
+        :param canvas: canvas to draw the cursor on, None to run without drawing
+        :param area_size: width and height of the area the cursor stays within
+        """
         self.canvas = canvas
         self.radius = radius
         self.diameter = radius * 2
-        self.cursor = self.canvas.create_oval(
-            0, 0, self.diameter, self.diameter, fill="white"
-        )
+        self.area_size = area_size
+        self.center = Point(radius, radius)
+        self.cursor = None
+        if self.canvas is not None:
+            self.cursor = self.canvas.create_oval(
+                0, 0, self.diameter, self.diameter, fill="white"
+            )
         # self.move_by(200, 0)
 
     @staticmethod
@@ -38,134 +58,206 @@ class Cursor:
         adjusted = adjusted if adjusted < high_bound else high_bound
         return adjusted
 
+    def _y_bounds(self) -> Tuple[int, int]:
+        return self.radius, self.area_size[1] - self.radius
+
     def move_to(self, point: Point) -> None:
         """
         Move the cursor *center* to the specified point.
         :param point: a None value for x or y means the current value is retained
         """
         # handle None value in point
-        x = point.x if point.x is not None else self.get_center().x
-        y = point.y if point.y is not None else self.get_center().y
-
-        # shift to cursor center
-        x = x - self.radius - 1
-        y = y - self.radius - 1
+        x = point.x if point.x is not None else self.center.x
+        y = point.y if point.y is not None else self.center.y
 
         # prevent going out of bounds
-        x_min, x_max = 0, self.canvas.winfo_width() - (self.radius * 2)
-        y_min, y_max = 0, self.canvas.winfo_height() - (self.radius * 2)
-        x = self._adjust_for_bounds(x, x_min, x_max)
-        y = self._adjust_for_bounds(y, y_min, y_max)
+        x = self._adjust_for_bounds(x, self.radius, self.area_size[0] - self.radius)
+        y = self._adjust_for_bounds(y, *self._y_bounds())
+        self.center = Point(x, y)
 
-        self.canvas.moveto(self.cursor, x, y)
+        if self.canvas is not None:
+            # shift to the upper left corner of the cursor
+            self.canvas.moveto(
+                self.cursor, int(x) - self.radius - 1, int(y) - self.radius - 1
+            )
 
     def move_by(self, x: int = 0, y: int = 0):
-        self.canvas.move(self.cursor, x, y)
+        self.move_to(Point(self.center.x + x, self.center.y + y))
 
     def get_center(self) -> Point:
-        x1, y1, x2, y2 = self.canvas.coords(self.cursor)
-        return Point(x1 + self.radius, y1 + self.radius)
+        return self.center
 
 
 class VelocityCursor(Cursor):
     """
-    Cursor that moves over time according to its velocity in pixels per second. Uses real time (wall-clock time) so that
-    changes in updating rate (framerate) do not affect positional correctness.
+    Cursor that moves over time according to its velocity in pixels per second. Uses a monotonic clock so that changes
+    in updating rate (framerate) do not affect positional correctness. Every velocity change first moves the cursor
+    with the previous velocity up to the present, so the position is exact however rarely the velocity is set.
     """
 
     # TODO support x direction
-    def __init__(self, canvas: sg.tk.Canvas, radius: int = DEFAULT_CURSOR_RADIUS):
-        super().__init__(canvas, radius)
+    def __init__(
+        self,
+        canvas: Union[sg.tk.Canvas, None],
+        radius: int = DEFAULT_CURSOR_RADIUS,
+        area_size: Tuple[int, int] = DEFAULT_AREA_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param clock: source of the current time in seconds, e.g. a `SimulatedClock` to run faster than real time
+        """
+        super().__init__(canvas, radius, area_size)
+        self.clock = clock
         self.y_velocity: int = 0  # pixels per second, negative is up, positive is down
         self.y_center: float = (
             self.get_center().y
         )  # need to keep a high precision location for fractional movements
-        self.last_update_ns: Union[int, None] = None
+        self.last_update_s: Union[float, None] = None
 
-    def update(self):
-        if self.last_update_ns is None:  # first update
-            self.last_update_ns = time.time_ns()
+    def _advance(self):
+        """
+        Move `y_center` by the distance covered since the last update, without drawing.
+        """
+        current_s = self.clock()
+        if self.last_update_s is None:  # first update
+            self.last_update_s = current_s
             return
 
-        current_ns = time.time_ns()
-        time_difference_ns = current_ns - self.last_update_ns
-        time_difference_s = self.nano_to_base(time_difference_ns)
+        time_difference_s = current_s - self.last_update_s
         pixels_to_move = time_difference_s * self.y_velocity
-        self.y_center += pixels_to_move
-        logging.debug(
-            f"CursorUpdate: \n\tVelocity: {self.y_velocity}\n\tTime difference: {time_difference_s} seconds\n"
-            f"\tPixels to move: {pixels_to_move}\n\tNew y-center: {self.y_center}"
+        # the drawn cursor stops at the edges, so must the precise location
+        self.y_center = self._adjust_for_bounds(
+            self.y_center + pixels_to_move, *self._y_bounds()
         )
-        super().move_to(Point(y=int(self.y_center)))
+        if logging.getLogger().isEnabledFor(
+            logging.DEBUG
+        ):  # runs every frame, skip the formatting
+            logging.debug(
+                f"CursorUpdate: \n\tVelocity: {self.y_velocity}\n\tTime difference: {time_difference_s} seconds\n"
+                f"\tPixels to move: {pixels_to_move}\n\tNew y-center: {self.y_center}"
+            )
+        self.last_update_s = current_s
 
-        self.last_update_ns = current_ns
+    def update(self):
+        self._advance()
+        super().move_to(Point(y=self.y_center))
 
     def move_to(self, point: Point) -> None:
-        self.y_center = point.y if point.y is not None else self.get_center().y
         super().move_to(point)
+        self.y_center = self.center.y
 
     def change_velocity_by(self, delta_y_velocity: int):
+        self._advance()
         self.y_velocity += delta_y_velocity
 
     def set_velocity(self, y_velocity: int):
+        self._advance()
         self.y_velocity = y_velocity
 
     @staticmethod
     def nano_to_base(time_ns: int) -> float:
-        return time_ns / 10e8
+        return time_ns / 1e9
 
 
 class SquareTarget:
     def __init__(
         self,
-        canvas: sg.tk.Canvas,
+        canvas: Union[sg.tk.Canvas, None],
         center: Point,
         side_length: int = DEFAULT_TARGET_SIDE_LENGTH,
     ):
+        """
+        :param canvas: canvas to draw the target on, None to run without drawing
+        """
         self.canvas = canvas
         self.side_length = side_length
-        x1, x2 = (
+        self.x1, self.x2 = (
             center.x - side_length / 2,
             center.x + side_length / 2,
         )
-        y1, y2 = (
+        self.y1, self.y2 = (
             center.y - side_length / 2,
             center.y + side_length / 2,
         )
-        self.id = self.canvas.create_rectangle(x1, y1, x2, y2, fill="grey")
+        self.id = None
+        if self.canvas is not None:
+            self.id = self.canvas.create_rectangle(
+                self.x1, self.y1, self.x2, self.y2, fill="grey"
+            )
 
     def target_reached(self, point: Point, green_on_true: bool = True) -> bool:
         """
         Determines whether or not the provided point falls within the target box.
         """
-        x1, y1, x2, y2 = self.canvas.coords(self.id)
-        if x1 < point.x < x2 and y1 < point.y < y2:
-            if green_on_true:
-                self.canvas.itemconfig(self.id, fill="green")
-            return True
-        return False
+        return self.target_crossed(point, point, green_on_true)
+
+    def target_crossed(
+        self, start: Point, end: Point, green_on_true: bool = True
+    ) -> bool:
+        """
+        Determines whether or not a point moving in a straight line from start to end passes through the target box.
+        Unlike checking the end point only, this catches a fast cursor that jumps over the target in a single frame.
+        """
+        # clip the segment against the box one axis at a time, t runs from 0 at start to 1 at end
+        t_enter, t_exit = 0.0, 1.0
+        for position, distance, low, high in (
+            (start.x, end.x - start.x, self.x1, self.x2),
+            (start.y, end.y - start.y, self.y1, self.y2),
+        ):
+            if distance == 0:
+                if not low < position < high:
+                    return False
+                continue
+            t_low, t_high = (low - position) / distance, (high - position) / distance
+            t_enter = max(t_enter, min(t_low, t_high))
+            t_exit = min(t_exit, max(t_low, t_high))
+        if t_enter >= t_exit:
+            return False
+        if green_on_true:
+            self._fill("green")
+        return True
 
     def turn_red(self):
-        self.canvas.itemconfig(self.id, fill="red")
+        self._fill("red")
+
+    def _fill(self, color: str):
+        if self.canvas is not None:
+            self.canvas.itemconfig(self.id, fill=color)
 
     def __del__(self):
-        self.canvas.delete(self.id)
+        if self.canvas is not None:
+            self.canvas.delete(self.id)
 
 
-class OneDimensionControlExperiment:
-    class TargetPos(Enum):
-        TOP = auto()
-        BOTTOM = auto()
+class SimulatedClock:
+    """
+    Clock that only moves when told to, for running the experiment headless faster than real time.
+    """
+
+    def __init__(self, start_s: float = 0.0):
+        self.now_s = start_s
+
+    def __call__(self) -> float:
+        return self.now_s
+
+    def advance(self, seconds: float):
+        self.now_s += seconds
 
-    def __init__(self, num_trials=10):
+
+class ExperimentWindow:
+    """
+    PySimpleGUI window showing the cursor, the score and status text, and a canvas for plots.
+    """
+
+    def __init__(self, area_size: Tuple[int, int] = DEFAULT_AREA_SIZE):
         layout = [
             [sg.Text(size=(100, 1), key="score_text")],
             [sg.Text(size=(100, 1), key="status_text")],
             [
                 sg.Canvas(
-                    size=(400, 800), background_color="black", key="cursor_canvas"
+                    size=area_size, background_color="black", key="cursor_canvas"
                 ),
-                sg.Canvas(size=(400, 800), background_color="white", key="plots"),
+                sg.Canvas(size=area_size, background_color="white", key="plots"),
             ],
         ]
         self.window = sg.Window(
@@ -174,11 +266,89 @@ class OneDimensionControlExperiment:
             finalize=True,
             disable_close=True,
         )
-        self.canvas: sg.tk.Canvas = self.window["cursor_canvas"].TKCanvas
-        self.plots_canvas: sg.tk.Canvas = self.window["plots"].TKCanvas
-        self.cursor = VelocityCursor(self.canvas)
+        self.canvas: Union[sg.tk.Canvas, None] = self.window["cursor_canvas"].TKCanvas
+        self.plots_canvas: Union[sg.tk.Canvas, None] = self.window["plots"].TKCanvas
+
+    def write_score(self, score: str):
+        self.window["score_text"].update(score)
+
+    def write_status(self, status: str):
+        self.window["status_text"].update(status)
+
+    def handle_events(self, timeout_s: float):
+        """
+        Handle Tk events, including timers, for up to `timeout_s` seconds.
+        """
+        self.window.read(timeout=int(timeout_s * 1000))
+
+    def schedule(self, delay_s: float, callback: Callable[[], None]):
+        """
+        :return: id for `cancel`
+        """
+        return self.window.TKroot.after(int(round(delay_s * 1000)), callback)
+
+    def cancel(self, callback_id):
+        self.window.TKroot.after_cancel(callback_id)
+
+    def close(self):
+        self.window.close()
+
+
+class NullExperimentWindow:
+    """
+    Stand-in for `ExperimentWindow` that displays nothing, for running the experiment headless. It has no timers, so
+    the cursor is stepped by `OneDimensionControlExperiment.update` instead.
+    """
+
+    canvas = None
+    plots_canvas = None
+
+    def __init__(self):
+        self.score = ""
+        self.status = ""
+
+    def write_score(self, score: str):
+        self.score = score
+
+    def write_status(self, status: str):
+        self.status = status
+
+    def handle_events(self, timeout_s: float):
+        if timeout_s > 0:
+            time.sleep(timeout_s)
+
+    def close(self):
+        pass
+
+
+class OneDimensionControlExperiment:
+    class TargetPos(Enum):
+        TOP = auto()
+        BOTTOM = auto()
+
+    def __init__(
+        self,
+        num_trials=10,
+        frame_rate_hz: float = DEFAULT_FRAME_RATE_HZ,
+        headless: bool = False,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param frame_rate_hz: rate at which the cursor is animated and checked against the target, independently of
+            how often `update` is called. Headless experiments are stepped by `update` instead.
+        :param headless: run without a window, cursor movement, targets and hits are still tracked
+        :param clock: source of the current time in seconds for the cursor movement
+        """
+        self.display: Union[ExperimentWindow, NullExperimentWindow] = (
+            NullExperimentWindow() if headless else ExperimentWindow()
+        )
+        self.headless = headless
+        self.canvas = self.display.canvas
+        self.plots_canvas = self.display.plots_canvas
+        self.cursor = VelocityCursor(self.canvas, clock=clock)
         self.cursor_starting_point = Point(200, 400)
         self.cursor.move_to(self.cursor_starting_point)
+        self.last_checked_point = self.cursor_starting_point
         self.target_reached = False
         self.trial_iter = 0
         self.top_hit = 0
@@ -194,30 +364,68 @@ class OneDimensionControlExperiment:
 
         self._place_target_random()
 
-    def _place_target_random(self):
+        self.frame_interval_s = 1 / frame_rate_hz
+        self.next_frame_s = time.monotonic()
+        self.frame_callback_id = None
+        if not headless:
+            self._animate()
+
+    def _animate(self):
         """
-        Randomly sets the cursor to the top or bottom of the screen.
+        Tk timer callback moving the cursor one frame. Frames are scheduled against absolute deadlines so the frame
+        rate doesn't drift with the time each frame takes; frames missed while Tk was busy are skipped.
         """
-        self.target_position = self.target_array[self.trial_iter]
-        y_pos = 75 if self.target_position == self.TargetPos.TOP else 725
-        self.target = SquareTarget(self.canvas, Point(200, y_pos))
+        self._step_cursor()
+        now = time.monotonic()
+        self.next_frame_s += self.frame_interval_s
+        if self.next_frame_s < now:
+            self.next_frame_s = now
+        self.frame_callback_id = self.display.schedule(
+            self.next_frame_s - now, self._animate
+        )
 
-    def update(self):
+    def _step_cursor(self):
+        if self.target_reached:
+            return  # the cursor stays in the target until the next trial
         self.cursor.update()
-        if self.target.target_reached(self.cursor.get_center()):
+        current_point = Point(self.cursor.get_center().x, self.cursor.y_center)
+        if self.target.target_crossed(self.last_checked_point, current_point):
             self.cursor.set_velocity(0)
             self.target_reached = True
             if self.target_position == self.TargetPos.TOP:
                 self.top_hit += 1
             else:
                 self.bottom_hit += 1
-        self.window["score_text"].update(
+        self.last_checked_point = current_point
+
+    def _place_target_random(self):
+        """
+        Randomly sets the cursor to the top or bottom of the screen.
+        """
+        self.target_position = self.target_array[self.trial_iter]
+        y_pos = 75 if self.target_position == self.TargetPos.TOP else 725
+        self.target = SquareTarget(self.canvas, Point(200, y_pos))
+
+    def update(self):
+        """
+        Refresh the score and handle pending Tk events. The cursor itself is animated by a Tk timer, which only runs
+        while Tk handles events, so prefer `wait` over sleeping between updates. Headless, this steps the cursor.
+        """
+        if self.headless:
+            self._step_cursor()
+        self.display.write_score(
             f"Successes: {self.top_hit + self.bottom_hit} Failures: {self.failures}"
         )
-        self.window.read(timeout=0)
+        self.display.handle_events(0)
+
+    def wait(self, seconds: float):
+        """
+        Sleep while handling Tk events, keeping the cursor animated.
+        """
+        self.display.handle_events(seconds)
 
     def write_status_text(self, status: str):
-        self.window["status_text"].update(status)
+        self.display.write_status(status)
         self.update()
 
     def notify_target_not_reached(self):
@@ -225,15 +433,48 @@ class OneDimensionControlExperiment:
         self.failures += 1
 
     def reset(self):
-        self.cursor.move_to(self.cursor_starting_point)
         self.cursor.set_velocity(0)
+        self.cursor.move_to(self.cursor_starting_point)
+        self.last_checked_point = self.cursor_starting_point
         del self.target
         self.trial_iter += 1
         self._place_target_random()
         self.target_reached = False
 
     def close(self):
-        self.window.close()
+        if self.frame_callback_id is not None:
+            self.display.cancel(self.frame_callback_id)
+        self.display.close()
+
+
+def simulate_trials(
+    num_trials: int,
+    velocity_policy: Callable[["OneDimensionControlExperiment.TargetPos"], float],
+    trial_length_s: float = 10,
+    frame_rate_hz: float = DEFAULT_FRAME_RATE_HZ,
+) -> OneDimensionControlExperiment:
+    """
+    Run trials headless on a simulated clock, as fast as the model can be stepped.
+
+    :param velocity_policy: cursor velocity to set at every frame, given the target of the trial
+    :return: the finished experiment, holding the hit and failure counts
+    """
+    clock = SimulatedClock()
+    experiment = OneDimensionControlExperiment(
+        num_trials=num_trials, headless=True, clock=clock
+    )
+    frame_interval_s = 1 / frame_rate_hz
+    for trial in range(num_trials):
+        trial_end_s = clock() + trial_length_s
+        while clock() < trial_end_s and not experiment.target_reached:
+            experiment.cursor.set_velocity(velocity_policy(experiment.target_position))
+            clock.advance(frame_interval_s)
+            experiment.update()
+        if not experiment.target_reached:
+            experiment.notify_target_not_reached()
+        if trial != num_trials - 1:
+            experiment.reset()
+    return experiment
 
 
 if __name__ == "__main__":
@@ -242,10 +483,10 @@ if __name__ == "__main__":
     experiment.cursor.change_velocity_by(-60)
     while True:
         try:
-            time.sleep(0.005)
+            experiment.wait(0.005)
             experiment.update()
             if experiment.target_reached:
-                time.sleep(1)
+                experiment.wait(1)
                 experiment.reset()
                 experiment.cursor.set_velocity(-60)
         except KeyboardInterrupt:
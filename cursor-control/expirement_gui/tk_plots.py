@@ -1,20 +1,84 @@
+from __future__ import annotations
+
+import math
 import time
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
 import PySimpleGUI as sg
-import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 import brainflow as bf
 
 
 class TkPlot:
-    def __init__(self, canvas: sg.tk.Canvas):
+    """
+    Matplotlib figure embedded in a Tk canvas. Subclasses create their artists once and update them through blitting:
+    the static parts of the figure are drawn a single time and kept as a background, and every refresh only redraws
+    the animated artists on top of it.
+    """
+
+    def __init__(self, canvas: Union[sg.tk.Canvas, None], max_refresh_hz: float = 30):
+        """
+        :param canvas: Tk canvas to draw in, None draws to an off-screen Agg canvas
+        :param max_refresh_hz: upper limit on how often the display is redrawn, however often the data is updated
+        """
         self.canvas = canvas
-        fig, self.axes = plt.subplots()
-        self.figure = FigureCanvasTkAgg(fig, self.canvas)
+        fig = Figure()
+        self.axes = fig.add_subplot()
+        if self.canvas is not None:
+            self.figure = FigureCanvasTkAgg(fig, self.canvas)
+        else:
+            self.figure = FigureCanvasAgg(fig)
+        self.min_refresh_interval_s = 1 / max_refresh_hz
+        self.last_refresh_s = -math.inf
+        self.refresh_pending = False
+        self.background = None
+        self.animated_artists: List[Artist] = []
+        # a full draw (first show, resize) invalidates the background
+        self.figure.mpl_connect("draw_event", self._on_draw)
         self.figure.draw()
-        self.figure.get_tk_widget().pack(side="top", fill="both", expand=1)
+        if self.canvas is not None:
+            self.figure.get_tk_widget().pack(side="top", fill="both", expand=1)
+
+    def _add_animated(self, artist: Artist) -> Artist:
+        artist.set_animated(True)
+        self.animated_artists.append(artist)
+        return artist
+
+    def _on_draw(self, event):
+        self.background = self.figure.copy_from_bbox(self.axes.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.animated_artists:
+            self.axes.draw_artist(artist)
+
+    def _data_changed(self):
+        self.refresh_pending = True
+        self.refresh()
+
+    def refresh(self):
+        """
+        Redraw the animated artists if their data changed and the refresh interval has passed. Call regularly from the
+        GUI loop so that updates held back by the refresh limit are shown.
+        """
+        now = time.monotonic()
+        if (
+            not self.refresh_pending
+            or now - self.last_refresh_s < self.min_refresh_interval_s
+        ):
+            return
+        if self.background is None:
+            self.figure.draw()
+        else:
+            self.figure.restore_region(self.background)
+            self._draw_animated()
+        self.figure.blit(self.axes.bbox)
+        self.last_refresh_s = now
+        self.refresh_pending = False
 
 
 class LinePlot(TkPlot):
@@ -34,7 +98,7 @@ class LinePlot(TkPlot):
 class PSDPlot(TkPlot):
     def __init__(
         self,
-        canvas: sg.tk.Canvas,
+        canvas: Union[sg.tk.Canvas, None],
         y_label: str = "Power",
         x_label: str = "Frequency (Hz)",
         title: str = "Power Spectral Density",
@@ -43,8 +107,8 @@ class PSDPlot(TkPlot):
         x_min: float = 1,
         x_max: float = 30,
         highlight_region: Tuple[float, float] = (1, 30),
+        max_refresh_hz: float = 30,
     ):
-        super(PSDPlot, self).__init__(canvas)
         self.y_label = y_label
         self.x_label = x_label
         self.title = title
@@ -53,24 +117,27 @@ class PSDPlot(TkPlot):
         self.x_min = x_min
         self.x_max = x_max
         self.highlight_region = highlight_region
-
-    def _set_text(self):
-        self.axes.set_title(self.title)
-        self.axes.set_ylabel(self.y_label)
-        self.axes.set_xlabel(self.x_label)
-
-    def plot_psd(self, psd: Tuple[bf.NDArray[bf.Float64], bf.NDArray[bf.Float64]]):
-        self.axes.cla()
+        super(PSDPlot, self).__init__(canvas, max_refresh_hz)
         self.axes.set_yscale("log")
         self._set_text()
-        self.axes.plot(psd[1], psd[0])
         self.axes.set_ylim([self.y_min, self.y_max])
         self.axes.set_xlim([self.x_min, self.x_max])
         self.axes.axvspan(
             self.highlight_region[0], self.highlight_region[1], color="green", alpha=0.5
         )
+        (line,) = self.axes.plot([], [])
+        self.line = self._add_animated(line)
         self.figure.draw()
 
+    def _set_text(self):
+        self.axes.set_title(self.title)
+        self.axes.set_ylabel(self.y_label)
+        self.axes.set_xlabel(self.x_label)
+
+    def plot_psd(self, psd: Tuple[bf.NDArray[bf.Float64], bf.NDArray[bf.Float64]]):
+        self.line.set_data(psd[1], psd[0])
+        self._data_changed()
+
 
 class BandPowerChart(TkPlot):
     """
@@ -79,20 +146,33 @@ class BandPowerChart(TkPlot):
 
     def __init__(
         self,
-        canvas: sg.tk.Canvas,
+        canvas: Union[sg.tk.Canvas, None],
         y_min: float,
         y_max: float,
         band_labels: List[str],
         y_label: str = "Power spectral density",
         title: str = "Band Power",
+        max_refresh_hz: float = 30,
+        **bar_kwargs,
     ):
-        super(BandPowerChart, self).__init__(canvas)
+        """
+        :param bar_kwargs: passed on to matplotlib's bar when the bars are created
+        """
         self.y_min = y_min
         self.y_max = y_max
         self.band_labels = band_labels
         self.x_locs = np.arange(len(self.band_labels))
         self.y_label = y_label
         self.title = title
+        super(BandPowerChart, self).__init__(canvas, max_refresh_hz)
+        self._set_text()
+        self.axes.set_ylim([self.y_min, self.y_max])
+        self.bars = self.axes.bar(
+            self.x_locs, np.zeros(len(self.band_labels)), **bar_kwargs
+        )
+        for bar in self.bars:
+            self._add_animated(bar)
+        self.figure.draw()
 
     def _set_text(self):
         self.axes.set_title(self.title)
@@ -100,13 +180,11 @@ class BandPowerChart(TkPlot):
         self.axes.set_xticks(self.x_locs)
         self.axes.set_xticklabels(self.band_labels)
 
-    def bar(self, band_values: List[float], *args, **kwargs):
+    def bar(self, band_values: List[float]):
         assert len(band_values) == len(self.band_labels)
-        self.axes.cla()
-        self._set_text()
-        self.axes.bar(self.x_locs, band_values, *args, **kwargs)
-        self.axes.set_ylim([self.y_min, self.y_max])
-        self.figure.draw()
+        for bar, value in zip(self.bars, band_values):
+            bar.set_height(value)
+        self._data_changed()
 
 
 if __name__ == "__main__":
@@ -139,3 +217,4 @@ if __name__ == "__main__":
         bar_heights = np.random.rand(1)
         line_plot.plot_psd((y, x))
         bar_plot.bar(bar_heights)
+        window.read(timeout=0)
@@ -1,4 +1,7 @@
-from typing import Tuple, Union
+from __future__ import annotations
+
+import functools
+from typing import Dict, List, Tuple, Union
 
 import brainflow as bf
 import numpy as np
@@ -12,6 +15,7 @@ class PSDFeatureExtractor:
         overlap_percentage: float = 0.75,
         window_func: bf.WindowFunctions = bf.WindowFunctions.BLACKMAN_HARRIS,
         detrend_operation: bf.DetrendOperations = bf.DetrendOperations.LINEAR,
+        bands: Union[Dict[str, Tuple[float, float]], None] = None,
     ):
         """
         Calculate PSD of the provided data by the Welch method.
@@ -19,7 +23,9 @@ class PSDFeatureExtractor:
         :param sample_rate: sample rate of the board
         :param window_size: number of samples per window, must be power of two
         :param overlap_percentage: overlap between windows, 0.0 through 0.99
-        :param window_func: windowing function to use in PSD calculation"""
+        :param window_func: windowing function to use in PSD calculation
+        :param bands: named (start, end) frequency bands whose powers are calculated along with every PSD, in order,
+            into `band_powers`"""
         self.sample_rate = sample_rate
         self.window_size = window_size
         self.overlap_percentage = overlap_percentage
@@ -30,6 +36,15 @@ class PSDFeatureExtractor:
         self.psd: Union[
             Tuple[bf.NDArray[bf.Float64], bf.NDArray[bf.Float64]], None
         ] = None  # amplitude, frequency pair
+        self.freqs = np.fft.rfftfreq(self.window_size, 1 / self.sample_rate)
+        self.bands = bands if bands is not None else {}
+        self.band_names = list(self.bands)
+        self.band_weights = np.zeros((len(self.freqs), len(self.bands)))
+        for band_index, (freq_start, freq_end) in enumerate(self.bands.values()):
+            self.band_weights[:, band_index] = _band_weights(
+                self.freqs, freq_start, freq_end
+            )
+        self.band_powers: Union[bf.NDArray[bf.Float64], None] = None
 
     def process_data(self, data: bf.NDArray[bf.Float64]):
         """
@@ -41,11 +56,19 @@ class PSDFeatureExtractor:
 
         bf.DataFilter.detrend(self.data, self.detrend_operation)
         self._process_psd()
+        self._process_band_powers()
 
     def get_band_power(self, freq_start: float, freq_end: float):
         assert self.psd is not None
         return bf.DataFilter.get_band_power(self.psd, freq_start, freq_end)
 
+    def _process_band_powers(self):
+        """
+        Calculate the powers of all bands given at construction from the latest PSD in a single product.
+        """
+        assert self.psd is not None
+        self.band_powers = self.psd[0] @ self.band_weights
+
     def _process_psd(self):
         """
         Calculate PSD of the provided data by the Welch method.
@@ -62,3 +85,599 @@ class PSDFeatureExtractor:
             self.sample_rate,
             self.window_func,
         )
+
+
+def _band_weights(
+    freqs: bf.NDArray[bf.Float64], freq_start: float, freq_end: float
+) -> bf.NDArray[bf.Float64]:
+    """
+    Trapezoidal integration weights over the same bins as `DataFilter.get_band_power`, which integrates from the first
+    frequency at or above `freq_start` to the first frequency above `freq_end`.
+
+    :return: weights such that `amplitudes @ weights` is the band power
+    """
+    start_index = np.searchsorted(freqs, freq_start)
+    end_index = min(np.searchsorted(freqs, freq_end, side="right"), len(freqs) - 1)
+    weights = np.zeros(len(freqs))
+    for index in range(start_index, end_index):
+        half_width = (freqs[index + 1] - freqs[index]) / 2
+        weights[index] += half_width
+        weights[index + 1] += half_width
+    return weights
+
+
+def _trend_basis(
+    num_samples: int, detrend_operation: bf.DetrendOperations
+) -> bf.NDArray[bf.Float64]:
+    """
+    :return: orthonormal rows spanning the trend removed by `detrend_operation`, shape (0 to 2, num_samples)
+    """
+    if detrend_operation == bf.DetrendOperations.NONE:
+        return np.empty((0, num_samples))
+    basis = [np.full(num_samples, 1 / np.sqrt(num_samples))]
+    if detrend_operation == bf.DetrendOperations.LINEAR:
+        t = np.arange(num_samples) - (num_samples - 1) / 2
+        basis.append(t / np.linalg.norm(t))
+    return np.stack(basis)
+
+
+def _detrend(
+    data: bf.NDArray[bf.Float64], detrend_operation: bf.DetrendOperations
+) -> bf.NDArray[bf.Float64]:
+    """
+    Remove the mean or least-squares line of every row of `data`.
+
+    :param data: array of shape (..., samples)
+    :return: detrended copy of the data
+    """
+    basis = _trend_basis(data.shape[-1], detrend_operation)
+    return data - (data @ basis.T) @ basis
+
+
+@functools.lru_cache(maxsize=None)
+def _brainflow_trend_coefficients(
+    num_samples: int, detrend_operation: bf.DetrendOperations
+) -> bf.NDArray[bf.Float64]:
+    """
+    The trend `DataFilter.detrend` removes is a line that depends linearly on the data, just not the least-squares
+    line. Detrending every unit vector once gives the trend of each sample, expressed in `_trend_basis`.
+
+    :return: matrix of shape (num_samples, 0 to 2) mapping samples to the coefficients of their trend in the basis
+    """
+    basis = _trend_basis(num_samples, detrend_operation)
+    trends = np.eye(num_samples)
+    for row in trends:
+        bf.DataFilter.detrend(row, detrend_operation)
+    coefficients = (np.eye(num_samples) - trends) @ basis.T
+    # shared by every caller through the cache
+    coefficients.setflags(write=False)
+    return coefficients
+
+
+def _brainflow_detrend(
+    data: bf.NDArray[bf.Float64], detrend_operation: bf.DetrendOperations
+) -> bf.NDArray[bf.Float64]:
+    """
+    Detrend every row of `data` like `DataFilter.detrend`, whose linear trend differs slightly from a least-squares
+    line, for estimates matching `PSDFeatureExtractor`.
+
+    :param data: array of shape (..., samples)
+    :return: detrended copy of the data
+    """
+    num_samples = data.shape[-1]
+    basis = _trend_basis(num_samples, detrend_operation)
+    coefficients = _brainflow_trend_coefficients(num_samples, detrend_operation)
+    return data - (data @ coefficients) @ basis
+
+
+@functools.lru_cache(maxsize=None)
+def _brainflow_line(
+    num_samples: int, detrend_operation: bf.DetrendOperations
+) -> bf.NDArray[bf.Float64]:
+    """
+    `DataFilter.detrend` fits its line from the sum and the index-weighted sum of the samples, so detrending a constant
+    and a ramp is enough to recover it for any data.
+
+    :return: matrix of shape (2, 2) mapping the sums (sum(x), sum(i * x)) of `num_samples` samples to the offset and
+        slope of the line removed from them, the trend of sample i being offset + slope * i
+    """
+    index = np.arange(num_samples, dtype=np.float64)
+    sums = np.empty((2, 2))
+    lines = np.empty((2, 2))
+    for row, samples in enumerate((np.ones(num_samples), index)):
+        sums[row] = samples.sum(), samples @ index
+        detrended = samples.copy()
+        bf.DataFilter.detrend(detrended, detrend_operation)
+        trend = samples - detrended
+        lines[row] = trend[0], trend[1] - trend[0]
+    line = np.linalg.solve(sums, lines)
+    # shared by every caller through the cache
+    line.setflags(write=False)
+    return line
+
+
+def _psd_scale(window_size: int, sample_rate: int) -> bf.NDArray[bf.Float64]:
+    """
+    Per-bin scaling from |FFT|^2 to power, matching `DataFilter.get_psd` so that band powers stay comparable with the
+    values produced by `PSDFeatureExtractor`.
+    """
+    scale = np.full(window_size // 2 + 1, 2.0 / (sample_rate * window_size))
+    scale[0] /= 2
+    scale[-1] *= 4  # BrainFlow weights the Nyquist bin this way, kept for parity
+    return scale
+
+
+class _NumpyWelchExtractor(PSDFeatureExtractor):
+    """
+    Shared set-up for the extractors that compute Welch segments with NumPy instead of `DataFilter.get_psd_welch`.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        window_size: int,
+        overlap_percentage: float,
+        window_func: bf.WindowFunctions,
+        detrend_operation: bf.DetrendOperations,
+        bands: Union[Dict[str, Tuple[float, float]], None],
+        segment_detrend_operation: bf.DetrendOperations,
+    ):
+        super(_NumpyWelchExtractor, self).__init__(
+            sample_rate,
+            window_size,
+            overlap_percentage,
+            window_func,
+            detrend_operation,
+            bands,
+        )
+        self.hop_size = self.window_size - self.overlap_samples
+        self.window = np.asarray(
+            bf.DataFilter.get_window(self.window_func.value, self.window_size)
+        )
+        # detrending and windowing are folded together: w * (x - trend) = w * x - (x @ basis.T) @ (basis * w)
+        self.trend_basis = _trend_basis(self.window_size, segment_detrend_operation)
+        self.windowed_trend_basis = self.trend_basis * self.window
+        self.scale = _psd_scale(self.window_size, self.sample_rate)
+        self.window_offsets = np.arange(self.window_size)
+
+    def _segment(
+        self, samples: bf.NDArray[bf.Float64], first_segment: int, num_segments: int
+    ) -> bf.NDArray[bf.Float64]:
+        """
+        :param samples: array of shape (..., samples)
+        :return: array of shape (..., segments, window size), copied out of `samples`
+        """
+        segment_starts = (
+            np.arange(first_segment, first_segment + num_segments) * self.hop_size
+        )
+        return samples[..., segment_starts[:, np.newaxis] + self.window_offsets]
+
+    def _segment_psds(self, segments: bf.NDArray[bf.Float64]) -> bf.NDArray[bf.Float64]:
+        """
+        :param segments: array of shape (..., window size)
+        :return: power spectrum of each segment, shape (..., number of frequencies)
+        """
+        spectrum = self._segment_spectra(segments)
+        return (spectrum.real**2 + spectrum.imag**2) * self.scale
+
+    def _segment_spectra(
+        self, segments: bf.NDArray[bf.Float64]
+    ) -> bf.NDArray[bf.Complex128]:
+        """
+        :param segments: array of shape (..., window size)
+        :return: FFT of each detrended and windowed segment, shape (..., number of frequencies)
+        """
+        # flattened so the products below are single 2-D BLAS calls
+        flat_segments = segments.reshape(-1, self.window_size)
+        windowed = flat_segments * self.window
+        if len(self.trend_basis) > 0:
+            trend = flat_segments @ self.trend_basis.T
+            windowed -= trend @ self.windowed_trend_basis
+        spectrum = np.fft.rfft(windowed, axis=-1)
+        return spectrum.reshape(segments.shape[:-1] + (len(self.freqs),))
+
+
+class StreamingPSDFeatureExtractor(_NumpyWelchExtractor):
+    """
+    Welch PSD over a sliding analysis window, updated incrementally as new samples arrive.
+
+    The spectrum of each windowed segment is kept in a ring holding one analysis window worth of segments. Only the
+    segments completed by new samples are transformed, so the FFTs of an update depend on the amount of new data and
+    not on the length of the analysis window.
+
+    Like `PSDFeatureExtractor`, the trend of the whole analysis window is removed before segmenting: the spectrum of
+    a line over a segment is a combination of two fixed spectra, so the trend fitted to the latest window is
+    subtracted from the stored spectra on every update. The estimate then matches `PSDFeatureExtractor` on the same
+    window in every band, exactly when the window starts at a segment boundary, i.e. its length minus the window size
+    is a multiple of the hop size, and otherwise up to the choice of the segments within it.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        data_len_s: float = 3,
+        window_size: int = 256,
+        overlap_percentage: float = 0.75,
+        window_func: bf.WindowFunctions = bf.WindowFunctions.BLACKMAN_HARRIS,
+        detrend_operation: bf.DetrendOperations = bf.DetrendOperations.LINEAR,
+        bands: Union[Dict[str, Tuple[float, float]], None] = None,
+        num_channels: Union[int, None] = None,
+    ):
+        """
+        :param sample_rate: sample rate of the board
+        :param data_len_s: length of the analysis window the PSD is averaged over, in seconds
+        :param window_size: number of samples per window, must be power of two
+        :param overlap_percentage: overlap between windows, 0.0 through 0.99
+        :param window_func: windowing function to use in PSD calculation
+        :param detrend_operation: detrending applied to the analysis window before segmenting
+        :param bands: named (start, end) frequency bands whose powers are calculated along with every PSD
+        :param num_channels: number of channels analyzed together, new data then has shape (channels, samples) and
+            the PSD and band powers get a leading channel axis. None analyzes a single channel given as a 1D array.
+        """
+        super(StreamingPSDFeatureExtractor, self).__init__(
+            sample_rate,
+            window_size,
+            overlap_percentage,
+            window_func,
+            detrend_operation,
+            bands,
+            segment_detrend_operation=bf.DetrendOperations.NONE,
+        )
+        self.channel_shape = () if num_channels is None else (num_channels,)
+        self.data_len_s = data_len_s
+        self.data_len = int(data_len_s * self.sample_rate)
+        assert self.data_len >= self.window_size
+        self.num_segments = (self.data_len - self.window_size) // self.hop_size + 1
+        # the windowed spectra of a constant and of a ramp over a segment
+        self.window_spectrum = np.fft.rfft(self.window)
+        self.ramp_spectrum = np.fft.rfft(self.window * self.window_offsets)
+        # sample indices within the analysis window, for the sums `_brainflow_line` takes
+        self.index_basis = np.stack(
+            (np.ones(self.data_len), np.arange(self.data_len, dtype=np.float64)),
+            axis=-1,
+        )
+        self.latest_timestamp: Union[float, None] = None
+        self.reset()
+
+    def reset(self):
+        """
+        Discard all buffered samples and segment spectra.
+        """
+        self.segment_spectra = np.zeros(
+            (self.num_segments,) + self.channel_shape + (len(self.freqs),),
+            dtype=np.complex128,
+        )
+        # index of the first sample of every segment in the ring, counted from the first processed sample
+        self.segment_starts = np.zeros(self.num_segments, dtype=np.int64)
+        self.num_filled = 0
+        self.ring_index = 0
+        self.num_samples = 0
+        # samples not yet covered by a complete segment
+        self.pending = np.empty(self.channel_shape + (0,))
+        # the analysis window, the last `data_len` samples
+        self.recent = np.empty(self.channel_shape + (0,))
+        self.latest_timestamp = None
+        self.psd = None
+
+    def process_data(
+        self,
+        data: bf.NDArray[bf.Float64],
+        timestamps: Union[bf.NDArray[bf.Float64], None] = None,
+    ):
+        """
+        Process the most recent samples of a channel.
+
+        :param data: array of samples, oldest first, shape (channels, samples) for multiple channels
+        :param timestamps: board timestamps of `data`. When provided, samples already seen by a previous call are
+            skipped and only the new ones are processed, otherwise the data is processed from scratch.
+        """
+        if timestamps is None:
+            self.reset()
+        else:
+            if self.latest_timestamp is not None:
+                new_start = np.searchsorted(
+                    timestamps, self.latest_timestamp, side="right"
+                )
+                data = data[..., new_start:]
+            if len(timestamps) > 0:
+                self.latest_timestamp = timestamps[-1]
+        self.process_new_data(data)
+
+    def process_new_data(self, new_samples: bf.NDArray[bf.Float64]):
+        """
+        Append samples that directly follow the previously processed ones and update the PSD.
+
+        :param new_samples: array of samples, oldest first, shape (channels, samples) for multiple channels
+        """
+        samples = np.concatenate((self.pending, new_samples), axis=-1)
+        self.recent = np.concatenate((self.recent, new_samples), axis=-1)[
+            ..., -self.data_len :
+        ]
+        first_sample = self.num_samples - self.pending.shape[-1]
+        self.num_samples += new_samples.shape[-1]
+        num_samples = samples.shape[-1]
+        if num_samples < self.window_size:
+            self.pending = samples
+        else:
+            self._add_segments(samples, first_sample)
+        # the trend of the analysis window moves with every new sample, not only with new segments
+        if self.num_filled > 0:
+            self._process_psd()
+            self._process_band_powers()
+
+    def _add_segments(self, samples: bf.NDArray[bf.Float64], first_sample: int):
+        """
+        Transform the complete segments of `samples` into the ring and keep the rest as pending samples.
+
+        :param samples: pending and new samples, at least one window long
+        :param first_sample: index of the first of `samples`, counted from the first processed sample
+        """
+        num_samples = samples.shape[-1]
+        num_new_segments = (num_samples - self.window_size) // self.hop_size + 1
+        self.pending = samples[..., num_new_segments * self.hop_size :]
+        # older segments would be pushed out of the ring straight away
+        first_segment = max(0, num_new_segments - self.num_segments)
+        segments = self._segment(
+            samples, first_segment, num_new_segments - first_segment
+        )
+        # segments first, then channels if any
+        segment_spectra = np.moveaxis(self._segment_spectra(segments), -2, 0)
+
+        for segment, segment_spectrum in enumerate(segment_spectra, first_segment):
+            self.segment_spectra[self.ring_index] = segment_spectrum
+            self.segment_starts[self.ring_index] = (
+                first_sample + segment * self.hop_size
+            )
+            self.ring_index = (self.ring_index + 1) % self.num_segments
+        self.num_filled = min(self.num_filled + len(segment_spectra), self.num_segments)
+
+    def _process_psd(self):
+        """
+        Average the power of the stored segment spectra, with the trend of the analysis window removed from each.
+        """
+        window_len = self.recent.shape[-1]
+        sums = self.recent @ self.index_basis[:window_len]
+        line = sums @ _brainflow_line(window_len, self.detrend_operation)
+        offset, slope = line[..., :1], line[..., 1:]
+        # the trend over a segment starting at sample `start` of the window is
+        # (offset + slope * start) + slope * (index within the segment)
+        starts = self.segment_starts[: self.num_filled] - (
+            self.num_samples - window_len
+        )
+        starts = starts.reshape((-1,) + (1,) * len(self.channel_shape) + (1,))
+        spectra = (
+            self.segment_spectra[: self.num_filled]
+            - (offset + slope * starts) * self.window_spectrum
+            - slope * self.ramp_spectrum
+        )
+        psds = (spectra.real**2 + spectra.imag**2) * self.scale
+        self.psd = (psds.mean(axis=0), self.freqs)
+
+
+class MultichannelPSDFeatureExtractor(_NumpyWelchExtractor):
+    """
+    Welch PSD of many channels at once. Produces the same estimate as `PSDFeatureExtractor` for every channel, up to
+    floating point rounding. Each channel is detrended by BrainFlow like there, segmenting, windowing and the FFT are
+    batched across channels and segments.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: Union[List[int], None] = None,
+        window_size: int = 256,
+        overlap_percentage: float = 0.75,
+        window_func: bf.WindowFunctions = bf.WindowFunctions.BLACKMAN_HARRIS,
+        detrend_operation: bf.DetrendOperations = bf.DetrendOperations.LINEAR,
+        bands: Union[Dict[str, Tuple[float, float]], None] = None,
+    ):
+        """
+        :param sample_rate: sample rate of the board
+        :param channels: rows of the board data to process, e.g. `BoardReader.get_eeg_channels()`. All rows are
+            processed when None.
+        :param window_size: number of samples per window, must be power of two
+        :param overlap_percentage: overlap between windows, 0.0 through 0.99
+        :param window_func: windowing function to use in PSD calculation
+        :param detrend_operation: detrending applied to each channel's data before the PSD calculation
+        :param bands: named (start, end) frequency bands whose powers are calculated for every channel along with every
+            PSD, `band_powers` then has shape (channels, bands)
+        """
+        super(MultichannelPSDFeatureExtractor, self).__init__(
+            sample_rate,
+            window_size,
+            overlap_percentage,
+            window_func,
+            detrend_operation,
+            bands,
+            segment_detrend_operation=bf.DetrendOperations.NONE,
+        )
+        self.channels = channels
+
+    def process_data(self, data: bf.NDArray[bf.Float64]):
+        """
+        Process new set of sampled data. Length of data should be larger than the window size.
+
+        :param data: array of shape (rows, samples) as returned by `BoardReader.get_board_data`
+        """
+        if self.channels is not None:
+            data = data[self.channels]
+        self.data = _brainflow_detrend(data, self.detrend_operation)
+        self._process_psd()
+        self._process_band_powers()
+
+    def get_band_power(
+        self, freq_start: float, freq_end: float
+    ) -> bf.NDArray[bf.Float64]:
+        """
+        :return: band power of each channel, integrated over the same bins as `DataFilter.get_band_power`
+        """
+        assert self.psd is not None
+        return self.psd[0] @ _band_weights(self.freqs, freq_start, freq_end)
+
+    def _process_psd(self):
+        """
+        Calculate PSD of every channel by the Welch method.
+
+        The resulting amplitudes have shape (channels, number of frequencies).
+        """
+        assert self.data is not None
+        num_segments = (self.data.shape[-1] - self.window_size) // self.hop_size + 1
+        assert num_segments > 0
+        segments = self._segment(self.data, 0, num_segments)
+        self.psd = (self._segment_psds(segments).mean(axis=-2), self.freqs)
+
+
+def _burg(
+    data: bf.NDArray[bf.Float64], order: int
+) -> Tuple[bf.NDArray[bf.Float64], bf.NDArray[bf.Float64]]:
+    """
+    Fit an autoregressive model to every row of `data` by Burg's method.
+
+    :param data: array of shape (channels, samples), samples > order
+    :return: coefficients of shape (channels, order + 1) starting with 1, and the driving noise variance per channel
+    """
+    num_channels = data.shape[0]
+    coeffs = np.ones((num_channels, 1))
+    noise_variance = np.mean(data**2, axis=-1)
+    forward_error = data[:, 1:]
+    backward_error = data[:, :-1]
+    for _ in range(order):
+        numerator = -2 * np.sum(forward_error * backward_error, axis=-1)
+        denominator = np.sum(forward_error**2 + backward_error**2, axis=-1)
+        reflection = np.divide(
+            numerator,
+            denominator,
+            out=np.zeros(num_channels),
+            where=denominator > 0,
+        )[:, np.newaxis]
+        coeffs = np.concatenate((coeffs, np.zeros((num_channels, 1))), axis=-1)
+        coeffs = coeffs + reflection * coeffs[:, ::-1]
+        noise_variance = noise_variance * (1 - reflection[:, 0] ** 2)
+        forward_error, backward_error = (
+            (forward_error + reflection * backward_error)[:, 1:],
+            (backward_error + reflection * forward_error)[:, :-1],
+        )
+    return coeffs, noise_variance
+
+
+class BurgARFeatureExtractor:
+    """
+    Power spectrum from an autoregressive model fitted by Burg's method, as used by the Wadsworth BCI. Resolves spectral
+    peaks from far shorter data than Welch, so the analysis window and with it the feature latency can be much shorter.
+
+    Has the interface of `PSDFeatureExtractor`, plus `process_new_data` and `reset` for use in place of
+    `StreamingPSDFeatureExtractor`. Channels are fitted together. The spectrum is only evaluated on the frequencies the
+    bands need, or on a full grid up to Nyquist when no bands are given. Amplitudes are a one-sided power spectral
+    density, which is not scaled like BrainFlow's Welch estimate, so thresholds tuned on Welch band powers don't carry
+    over.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        order: int = 16,
+        data_len_s: float = 0.5,
+        freq_step: float = 0.5,
+        detrend_operation: bf.DetrendOperations = bf.DetrendOperations.LINEAR,
+        bands: Union[Dict[str, Tuple[float, float]], None] = None,
+        channels: Union[List[int], None] = None,
+    ):
+        """
+        :param sample_rate: sample rate of the board
+        :param order: number of AR coefficients, the Wadsworth BCI uses 16 at 160 Hz
+        :param data_len_s: length of the analysis window `process_new_data` fits the model to, in seconds
+        :param freq_step: spacing of the frequencies the spectrum is evaluated at, in Hz
+        :param detrend_operation: detrending applied to the data before fitting
+        :param bands: named (start, end) frequency bands whose powers are calculated along with every PSD
+        :param channels: rows of 2D board data to process, all rows when None. Ignored for 1D data.
+        """
+        self.sample_rate = sample_rate
+        self.order = order
+        self.data_len_s = data_len_s
+        self.data_len = int(data_len_s * sample_rate)
+        assert self.data_len > order
+        self.detrend_operation = detrend_operation
+        self.channels = channels
+        self.bands = bands if bands is not None else {}
+        self.band_names = list(self.bands)
+
+        nyquist = sample_rate / 2
+        if self.bands:
+            # every bin of each band plus the first one above it, which the band power integration ends on
+            bins = set()
+            for freq_start, freq_end in self.bands.values():
+                first = int(np.ceil(freq_start / freq_step))
+                last = int(np.floor(freq_end / freq_step)) + 1
+                bins.update(range(first, last + 1))
+            self.freqs = np.array(sorted(bins)) * freq_step
+            self.freqs = self.freqs[self.freqs <= nyquist]
+        else:
+            self.freqs = np.arange(0, nyquist + freq_step / 2, freq_step)
+        # e^(-j 2 pi f k / fs) for every evaluated frequency and coefficient
+        self.fourier_basis = np.exp(
+            -2j * np.pi * np.outer(np.arange(order + 1), self.freqs) / self.sample_rate
+        )
+        self.band_weights = np.zeros((len(self.freqs), len(self.bands)))
+        for band_index, (freq_start, freq_end) in enumerate(self.bands.values()):
+            self.band_weights[:, band_index] = _band_weights(
+                self.freqs, freq_start, freq_end
+            )
+
+        self.data: Union[bf.NDArray[bf.Float64], None] = None
+        self.ar_coeffs: Union[bf.NDArray[bf.Float64], None] = None
+        self.psd: Union[
+            Tuple[bf.NDArray[bf.Float64], bf.NDArray[bf.Float64]], None
+        ] = None  # amplitude, frequency pair
+        self.band_powers: Union[bf.NDArray[bf.Float64], None] = None
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the samples buffered by `process_new_data`.
+        """
+        self.recent: Union[bf.NDArray[bf.Float64], None] = None
+        self.psd = None
+
+    def process_data(self, data: bf.NDArray[bf.Float64]):
+        """
+        Fit the model to a set of sampled data and update the PSD. Length of data should be larger than the order.
+
+        :param data: array of shape (samples,), or (rows, samples) to process several channels
+        """
+        is_multichannel = data.ndim == 2
+        if is_multichannel and self.channels is not None:
+            data = data[self.channels]
+        self.data = _detrend(np.atleast_2d(data), self.detrend_operation)
+        self.ar_coeffs, noise_variance = _burg(self.data, self.order)
+        response = self.ar_coeffs @ self.fourier_basis
+        amplitudes = (
+            2
+            * noise_variance[:, np.newaxis]
+            / (self.sample_rate * (response.real**2 + response.imag**2))
+        )
+        self.psd = (amplitudes if is_multichannel else amplitudes[0], self.freqs)
+        self.band_powers = self.psd[0] @ self.band_weights
+
+    def process_new_data(self, new_samples: bf.NDArray[bf.Float64]):
+        """
+        Append samples that directly follow the previously processed ones and refit the model to the most recent
+        `data_len_s` seconds, once that much data has arrived.
+
+        :param new_samples: array of shape (samples,), or (rows, samples), oldest first
+        """
+        if self.recent is None:
+            self.recent = new_samples[..., -self.data_len :]
+        else:
+            self.recent = np.concatenate((self.recent, new_samples), axis=-1)[
+                ..., -self.data_len :
+            ]
+        if self.recent.shape[-1] == self.data_len:
+            self.process_data(self.recent)
+
+    def get_band_power(self, freq_start: float, freq_end: float):
+        """
+        :return: band power, one per channel for multichannel data. The band must lie within the evaluated frequencies.
+        """
+        assert self.psd is not None
+        assert self.freqs[0] <= freq_start and freq_end < self.freqs[-1]
+        return self.psd[0] @ _band_weights(self.freqs, freq_start, freq_end)
@@ -0,0 +1,126 @@
+import json
+import math
+import time
+from typing import Dict, List, Union
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Fixed, log-spaced histogram of durations in seconds. Counts are preallocated, so recording a value is O(1) and
+    allocates nothing. Percentiles are accurate to the bin width, about 6% with the default 40 bins per decade.
+    """
+
+    def __init__(
+        self,
+        min_s: float = 1e-6,
+        max_s: float = 100.0,
+        bins_per_decade: int = 40,
+    ):
+        self.min_s = min_s
+        self.log_min = math.log10(min_s)
+        self.bins_per_decade = bins_per_decade
+        num_bins = int(math.ceil((math.log10(max_s) - self.log_min) * bins_per_decade))
+        # one extra bin on each side for values out of range
+        self.counts = np.zeros(num_bins + 2, dtype=np.int64)
+        self.bin_upper_edges = np.append(
+            10 ** (self.log_min + np.arange(num_bins + 1) / bins_per_decade), math.inf
+        )
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, duration_s: float):
+        if duration_s < self.min_s:
+            bin_index = 0
+        else:
+            bin_index = min(
+                int((math.log10(duration_s) - self.log_min) * self.bins_per_decade) + 1,
+                len(self.counts) - 1,
+            )
+        self.counts[bin_index] += 1
+        self.count += 1
+        self.total_s += duration_s
+        if duration_s > self.max_s:
+            self.max_s = duration_s
+
+    def percentile(self, percent: float) -> float:
+        """
+        :return: upper edge of the bin holding the given percentile, NaN when nothing was recorded
+        """
+        if self.count == 0:
+            return math.nan
+        rank = math.ceil(self.count * percent / 100)
+        bin_index = int(np.searchsorted(np.cumsum(self.counts), max(rank, 1)))
+        return min(float(self.bin_upper_edges[bin_index]), self.max_s)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_s": self.total_s / self.count if self.count else math.nan,
+            "p50_s": self.percentile(50),
+            "p95_s": self.percentile(95),
+            "p99_s": self.percentile(99),
+            "max_s": self.max_s,
+        }
+
+
+class LatencyMonitor:
+    """
+    Named latency histograms for the stages of the control loop. Every histogram should be recorded to from a single
+    thread, which is the case when each stage records its own timings.
+    """
+
+    STAGES: List[str] = [
+        "board_read",  # reading new samples from the board reader's ring buffer
+        "psd",  # PSD and band power calculation
+        "velocity_mapping",  # mapping features to a cursor velocity
+        "gui_update",  # cursor update, hit detection and Tk event processing
+        "sample_age_at_features",  # age of the newest sample when its features are ready
+        "sample_age_at_cursor",  # age of the newest sample when the cursor velocity changes
+    ]
+
+    def __init__(
+        self, track_sample_age: bool = True, stages: Union[List[str], None] = None
+    ):
+        """
+        :param track_sample_age: whether board timestamps are comparable to the wall clock, which isn't the case when
+            replaying a recording
+        :param stages: names of the histograms, defaults to STAGES
+        """
+        self.track_sample_age = track_sample_age
+        self.histograms = {
+            stage: LatencyHistogram()
+            for stage in (stages if stages is not None else self.STAGES)
+        }
+
+    def record(self, stage: str, duration_s: float):
+        self.histograms[stage].record(duration_s)
+
+    def record_sample_age(self, stage: str, board_timestamp: float):
+        """
+        :param board_timestamp: value of the board timestamp channel, in seconds since the epoch
+        """
+        if self.track_sample_age:
+            self.histograms[stage].record(time.time() - board_timestamp)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: histogram.summary() for stage, histogram in self.histograms.items()
+        }
+
+    def export(self, file_name: str):
+        with open(file_name, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def format_summary(self) -> str:
+        lines = []
+        for stage, summary in self.summary().items():
+            lines.append(
+                f"{stage:>24}: n={summary['count']:<6} "
+                f"p50={summary['p50_s'] * 1e3:8.2f} ms  "
+                f"p95={summary['p95_s'] * 1e3:8.2f} ms  "
+                f"p99={summary['p99_s'] * 1e3:8.2f} ms"
+            )
+        return "\n".join(lines)
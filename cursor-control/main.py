@@ -1,114 +1,141 @@
+import argparse
+import os
 import time
-from typing import List, Dict
+from datetime import datetime
+from typing import List, Tuple, Union
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy import stats
+# taken before the imports below so the startup report includes them
+STARTUP_START_S = time.perf_counter()
+
+import numpy as np
 
 import board_reader
+import decoding
 import expirement_gui.one_dim_control as one_dim
 import expirement_gui.tk_plots as tk_plots
 import feature_extraction
+import instrumentation
+import pipeline
+import preprocessing
+import scheduler
+import session_log
+import streaming
 
 channels = {"o1": 1, "c3": 2, "fp2": 3, "fp1": 4, "c4": 5, "cz": 6, "fz": 7, "o2": 8}
-PRE_EXPERIMENT_AVG_TIME_S = 5
 SAMP_RATE = 250
 BAND_FEATURE_LOW_FREQ = 10
 BAND_FEATURE_HIGH_FREQ = 12
 TRIAL_LENGTH_S = 10
 NUM_TRIALS = 20
-
-
-def get_psd_feature(
-    board: board_reader.BoardReader,
-    psd_extractor: feature_extraction.PSDFeatureExtractor,
-    data_len_s: float,
-    channel_id: str = "c3",
-):
-    data = board.get_board_data(int(data_len_s * board.get_sampling_rate()))
-    c3 = data[channels[channel_id]]
-    psd_extractor.process_data(c3)
-    return psd_extractor.get_band_power(BAND_FEATURE_LOW_FREQ, BAND_FEATURE_HIGH_FREQ)
+# before the first trial, the cursor doesn't move until the feature windows hold enough data
+BASELINE_S = 3
+# result shown after every trial
+FEEDBACK_S = 3
+# next target shown before its trial starts
+INTER_TRIAL_S = 1
+FEATURE_INTERVAL_S = 0.1
+RENDER_INTERVAL_S = 0.02
+PLOT_REFRESH_HZ = 10
+LINE_NOISE_FREQ = 60
+BANDPASS_FREQS = (0.5, 45)
+AR_DATA_LEN_S = 0.5
+# primary feature first, then the standard bands shown alongside it
+BANDS = {
+    f"{BAND_FEATURE_LOW_FREQ}-{BAND_FEATURE_HIGH_FREQ} Hz": (
+        BAND_FEATURE_LOW_FREQ,
+        BAND_FEATURE_HIGH_FREQ,
+    ),
+    "Delta": (0.5, 4),
+    "Theta": (4, 7),
+    "Alpha": (8, 15),
+    "Beta": (16, 31),
+}
+# highest frequency shown in the r² map
+MAX_MAP_FREQ = 40
+# weights of the normalized band powers in the control signal, higher primary feature power moves the cursor down
+DECODER_WEIGHTS = [1, 0, 0, 0, 0]
 
 
 def chart_bands(
-    primary_feature,
-    psd_extractor: feature_extraction.PSDFeatureExtractor,
+    band_powers: List[float],
     band_power_chart: tk_plots.BandPowerChart,
 ):
-    standard_bands = [(0.5, 4), (4, 7), (8, 15), (16, 31)]
-    values = [primary_feature]  # start with our primary feature and append others on
-    for band in standard_bands:
-        start_freq, end_freq = band
-        values.append(psd_extractor.get_band_power(start_freq, end_freq))
-    band_power_chart.bar(values)
-
-
-def pre_experiment(
-    board: board_reader.BoardReader,
-    psd_extractor: feature_extraction.PSDFeatureExtractor,
-    band_power_chart,
-    psd_chart: tk_plots.PSDPlot,
-) -> float:
-    """
-    :return: average band power for pre-experiment phase
-    """
-    print(
-        f"Taking PSD baseline before start, will take {PRE_EXPERIMENT_AVG_TIME_S} seconds"
-    )
-    time.sleep(PRE_EXPERIMENT_AVG_TIME_S)  # let the board reader collect data
-    band_power_feature = get_psd_feature(
-        board, psd_extractor, PRE_EXPERIMENT_AVG_TIME_S
-    )
-    chart_bands(band_power_feature, psd_extractor, band_power_chart)
-    psd_chart.plot_psd(psd_extractor.psd)
-    return band_power_feature
+    band_power_chart.bar(band_powers)
 
 
 def run_single_trial(
-    board: board_reader.BoardReader,
-    psd_extractor: feature_extraction.PSDFeatureExtractor,
+    commands: pipeline.DropOldestQueue[pipeline.ControlCommand],
     band_power_chart: tk_plots.BandPowerChart,
     psd_chart: tk_plots.PSDPlot,
     one_dim_experiment: one_dim.OneDimensionControlExperiment,
-    band_power_avg: float,
-) -> List[float]:
-    band_power_values = []
+    decoder: decoding.AdaptiveLinearDecoder,
+    latency_monitor: instrumentation.LatencyMonitor,
+    r_squared_map: decoding.RSquaredMap,
+    log: session_log.SessionLog,
+    session_scheduler: scheduler.SessionScheduler,
+    feature_window_s: float,
+    stream_server: Union[streaming.StreamServer, None] = None,
+):
+    """
+    Run the ticks of the scheduler's current trial phase.
 
+    :param feature_window_s: length of the window the features are calculated over, in seconds
+    """
     print("Starting experiment")
-    time_start = time.time()
-    while (
-        time.time() - time_start < TRIAL_LENGTH_S
-        and not one_dim_experiment.target_reached
-    ):
-        time_remaining = int(time_start + TRIAL_LENGTH_S - time.time())
+    commands.get_all()  # discard commands issued between trials
+    decoder.target = one_dim_experiment.target_position
+    # logged until the first command of the trial arrives
+    board_timestamp = np.nan
+    features = np.full(len(BANDS), np.nan)
+    while session_scheduler.tick():
+        time_remaining = int(session_scheduler.phase_remaining_s())
         one_dim_experiment.write_status_text(
             f"Trial in progress... {time_remaining} seconds remaining"
         )
 
-        time.sleep(0.1)  # let another tenth of a second worth of data accrue
-        band_power_feature = get_psd_feature(board, psd_extractor, data_len_s=3)
-        print(
-            f"Band power {BAND_FEATURE_LOW_FREQ}-{BAND_FEATURE_HIGH_FREQ}Hz for last {3} seconds: {band_power_feature} - compared against average {band_power_avg}"
-        )
-        band_power_values.append(band_power_feature)
-        chart_bands(band_power_feature, psd_extractor, band_power_chart)
-        psd_chart.plot_psd(psd_extractor.psd)
-        velocity = 0
-        if band_power_feature < 1.2:
-            velocity = -150
-        if band_power_feature > 1.8:
-            velocity = 50
-        if band_power_feature > 2.1:
-            velocity = 200
-        if band_power_feature > 4:
-            velocity = 400
-        # if band_power_feature > band_power_avg:
-        #     one_dim_experiment.cursor.set_velocity(150)  # down
-        # else:
-        #     one_dim_experiment.cursor.set_velocity(-150)  # up
-        one_dim_experiment.cursor.set_velocity(velocity)
+        new_commands = commands.get_all()
+        if new_commands:
+            for command in new_commands:
+                if command.feature.channel_psds is not None:
+                    r_squared_map.update(
+                        one_dim_experiment.target_position,
+                        command.feature.channel_psds,
+                    )
+            if stream_server is not None:
+                for command in new_commands:
+                    stream_server.publish_command(command)
+            newest = new_commands[-1]  # older commands are already stale
+            print(
+                f"Band power {BAND_FEATURE_LOW_FREQ}-{BAND_FEATURE_HIGH_FREQ}Hz for last {feature_window_s} seconds: {newest.feature.band_powers[0]} - intercept {decoder.intercept:.3f}, gain {decoder.gain:.1f}"
+            )
+            chart_bands(newest.feature.band_powers, band_power_chart)
+            psd_chart.plot_psd(newest.feature.psd)
+            one_dim_experiment.cursor.set_velocity(newest.velocity)
+            latency_monitor.record_sample_age(
+                "sample_age_at_cursor", newest.feature.timestamp
+            )
+            board_timestamp = newest.feature.timestamp
+            features = newest.feature.band_powers
+        # draws plot updates held back by the refresh limit
+        band_power_chart.refresh()
+        psd_chart.refresh()
+        update_start = time.perf_counter()
         one_dim_experiment.update()
+        update_duration_s = time.perf_counter() - update_start
+        latency_monitor.record("gui_update", update_duration_s)
+        log.record(
+            board_timestamp,
+            features,
+            one_dim_experiment.cursor.y_velocity,
+            one_dim_experiment.cursor.y_center,
+            one_dim_experiment.target_position.value,
+            one_dim_experiment.trial_iter,
+            one_dim_experiment.target_reached,
+            len(new_commands),
+            update_duration_s,
+        )
+        if one_dim_experiment.target_reached:
+            session_scheduler.end_phase()
 
     print(f"Target reached: {one_dim_experiment.target_reached}")
     if not one_dim_experiment.target_reached:
@@ -116,69 +143,267 @@ def run_single_trial(
         one_dim_experiment.update()
 
     one_dim_experiment.cursor.set_velocity(0)
+    decoder.target = None
+
+
+def format_startup_report(phase_ends: List[Tuple[str, float]]) -> str:
+    """
+    :param phase_ends: name of every startup phase with the `time.perf_counter` value at its end, in order
+    """
+    phases = []
+    phase_start = STARTUP_START_S
+    for name, phase_end in phase_ends:
+        phases.append(f"{name} {(phase_end - phase_start) * 1e3:.0f} ms")
+        phase_start = phase_end
+    return f"Startup took {(phase_start - STARTUP_START_S) * 1e3:.0f} ms: " + ", ".join(
+        phases
+    )
 
-    return band_power_values
 
+def format_top_features(
+    r_squared_map: decoding.RSquaredMap, freqs: List[float], num_features: int = 5
+) -> str:
+    channel_names = list(channels)
+    # frequencies above the map's range are mostly filtered out
+    shown = np.broadcast_to(np.asarray(freqs) <= MAX_MAP_FREQ, r_squared_map.shape)
+    return ", ".join(
+        f"{channel_names[channel]} {freqs[freq_index]:.1f} Hz (r² {r_squared:.3f})"
+        for (channel, freq_index), r_squared in r_squared_map.top_features(
+            num_features, shown
+        )
+    )
 
-def main():
-    band_power_values_all_trials: Dict[
-        one_dim.OneDimensionControlExperiment.TargetPos, List[float]
-    ] = {
-        one_dim.OneDimensionControlExperiment.TargetPos.TOP: [],
-        one_dim.OneDimensionControlExperiment.TargetPos.BOTTOM: [],
-    }
 
-    one_dim_experiment = one_dim.OneDimensionControlExperiment(num_trials=NUM_TRIALS)
+def plot_results(r_squared_map: decoding.RSquaredMap, freqs: List[float]):
+    # the analysis stack is only needed once the trials are over, importing it up front slows down startup
+    import matplotlib.pyplot as plt
+
+    plt.close("all")
+    shown = np.asarray(freqs) <= MAX_MAP_FREQ
+    freq_step = freqs[1] - freqs[0]
+    plt.imshow(
+        r_squared_map.r_squared()[:, shown],
+        aspect="auto",
+        origin="lower",
+        interpolation="nearest",
+        extent=(
+            -freq_step / 2,
+            freqs[np.count_nonzero(shown) - 1] + freq_step / 2,
+            -0.5,
+            len(channels) - 0.5,
+        ),
+    )
+    plt.yticks(range(len(channels)), list(channels))
+    plt.colorbar(label="r²")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Channel")
+    plt.title("Top vs. bottom target r²")
+    plt.show()
+
+
+def main(
+    replay_file: Union[str, None] = None,
+    replay_speed: Union[float, None] = 1,
+    spectral_estimator: str = "welch",
+    headless: bool = False,
+    shared_memory_name: Union[str, None] = None,
+    stream_port: Union[int, None] = None,
+):
+    """
+    :param replay_file: recording to play back instead of reading from the Cyton
+    :param replay_speed: playback rate relative to real time, None for as fast as possible. The whole session follows
+        the replay, trials last their length in recorded time and the session ends when the recording does.
+    :param spectral_estimator: "welch" for Welch PSD over 3 seconds, "burg" for an autoregressive spectrum over
+        AR_DATA_LEN_S seconds
+    :param headless: run without the experiment window, plots are drawn off-screen and the result plots are skipped
+    :param shared_memory_name: publish the board's samples to a shared memory ring of this name for other processes
+    :param stream_port: stream the board's samples and the control commands to subscribers on this local port
+    """
+    startup_phase_ends = [("imports", time.perf_counter())]
+    # replays run on the recording's time, advanced as the session waits
+    clock = one_dim.SimulatedClock() if replay_file is not None else time.monotonic
+    one_dim_experiment = one_dim.OneDimensionControlExperiment(
+        num_trials=NUM_TRIALS, headless=headless, clock=clock
+    )
     band_power_chart = tk_plots.BandPowerChart(
         one_dim_experiment.plots_canvas,
         y_min=0,
         y_max=10,
-        band_labels=[
-            f"{BAND_FEATURE_LOW_FREQ}-{BAND_FEATURE_HIGH_FREQ} Hz",
-            "Delta",
-            "Theta",
-            "Alpha",
-            "Beta",
-        ],
+        band_labels=list(BANDS),
+        max_refresh_hz=PLOT_REFRESH_HZ,
     )
     psd_chart = tk_plots.PSDPlot(
         one_dim_experiment.plots_canvas,
         highlight_region=(BAND_FEATURE_LOW_FREQ, BAND_FEATURE_HIGH_FREQ),
+        max_refresh_hz=PLOT_REFRESH_HZ,
+    )
+    startup_phase_ends.append(("experiment window", time.perf_counter()))
+    file_writer = None
+    if replay_file is not None:
+        board = board_reader.ReplayBoardReader(replay_file, clock=clock)
+    else:
+        board = board_reader.BoardReader()  # defaults to Cyton
+        file_writer = board_reader.FileWriter(board)
+    publisher = (
+        board.publish_shared_memory(shared_memory_name)
+        if shared_memory_name is not None
+        else None
+    )
+    stream_server = None
+    if stream_port is not None:
+        stream_server = streaming.StreamServer(
+            port=stream_port,
+            metadata={
+                "sample_rate": board.get_sampling_rate(),
+                "eeg_rows": board.get_eeg_channels(),
+                "timestamp_row": board.get_timestamp_channel(),
+                "bands": list(BANDS),
+            },
+        )
+        stream_server.start()
+        board.add_listener(stream_server.publish_samples)
+    # replayed timestamps come from the recording's clock, not ours
+    latency_monitor = instrumentation.LatencyMonitor(
+        track_sample_age=replay_file is None
+    )
+    if spectral_estimator == "burg":
+        psd_feature_extractor = feature_extraction.BurgARFeatureExtractor(
+            board.get_sampling_rate(), data_len_s=AR_DATA_LEN_S, bands=BANDS
+        )
+    else:
+        psd_feature_extractor = feature_extraction.StreamingPSDFeatureExtractor(
+            board.get_sampling_rate(), data_len_s=3, bands=BANDS
+        )
+    filter_bank = preprocessing.StreamingFilterBank(
+        board.get_sampling_rate(), notch_freq=LINE_NOISE_FREQ, band=BANDPASS_FREQS
+    )
+    decoder = decoding.AdaptiveLinearDecoder(DECODER_WEIGHTS)
+    # PSDs of every channel, compared between the targets to choose the feature
+    map_extractor = feature_extraction.StreamingPSDFeatureExtractor(
+        board.get_sampling_rate(), data_len_s=3, num_channels=len(channels)
     )
-    board = board_reader.BoardReader()  # defaults to Cyton
-    board_reader.FileWriter(board)
-    psd_feature_extractor = feature_extraction.PSDFeatureExtractor(
-        board.get_sampling_rate()
+    map_filter_bank = preprocessing.StreamingFilterBank(
+        board.get_sampling_rate(),
+        notch_freq=LINE_NOISE_FREQ,
+        band=BANDPASS_FREQS,
+        num_channels=len(channels),
     )
+    r_squared_map = decoding.RSquaredMap((len(channels), len(map_extractor.freqs)))
+    data_dir = os.path.join(board_reader.FILE_DIR, "..", "data")
+    os.makedirs(data_dir, exist_ok=True)
+    log = session_log.SessionLog(
+        os.path.join(data_dir, f"session-{datetime.now().isoformat()}.npz"),
+        list(BANDS),
+        {
+            target.value: target.name.lower()
+            for target in one_dim.OneDimensionControlExperiment.TargetPos
+        },
+        clock=clock,
+    )
+    feature_pipeline = pipeline.Pipeline(
+        board,
+        psd_feature_extractor,
+        channels["c3"],
+        lambda feature: decoder.decode(feature.band_powers),
+        feature_period_s=FEATURE_INTERVAL_S,
+        latency_monitor=latency_monitor,
+        filter_bank=filter_bank,
+        map_channels=list(channels.values()),
+        map_extractor=map_extractor,
+        map_filter_bank=map_filter_bank,
+    )
+    startup_phase_ends.append(("board and pipeline setup", time.perf_counter()))
     with board:
-        one_dim_experiment.write_status_text("5 second PSD averaging")
-        # average = pre_experiment(
-        #     board, psd_feature_extractor, band_power_chart, psd_chart
-        # )
-        time.sleep(3)
-        average = 1
-        print(f"Average band power 10-12Hz = {average}")
-        for i in range(0, NUM_TRIALS):
-            band_power_values = run_single_trial(
-                board,
-                psd_feature_extractor,
+        startup_phase_ends.append(("board session", time.perf_counter()))
+        print(format_startup_report(startup_phase_ends))
+        # the decoder's baseline builds up from the first trials, the cursor stays still until it has enough data
+        if replay_file is not None:
+            # the pipeline's stages run on the replay's time as the session waits, instead of on their own threads
+            wait = pipeline.ReplayPacer(
+                feature_pipeline,
+                FEATURE_INTERVAL_S,
+                clock,
+                replay_speed,
+                one_dim_experiment.wait,
+            ).wait
+        else:
+            feature_pipeline.start()
+            wait = one_dim_experiment.wait
+        session_scheduler = scheduler.SessionScheduler(
+            NUM_TRIALS,
+            RENDER_INTERVAL_S,
+            TRIAL_LENGTH_S,
+            baseline_s=BASELINE_S,
+            feedback_s=FEEDBACK_S,
+            inter_trial_s=INTER_TRIAL_S,
+            clock=clock,
+            wait=wait,
+            finished=(lambda: board.finished) if replay_file is not None else None,
+        )
+        session_scheduler.start()
+        while session_scheduler.tick():
+            one_dim_experiment.write_status_text(
+                f"Collecting baseline... {int(session_scheduler.phase_remaining_s())} seconds remaining"
+            )
+        while session_scheduler.phase == scheduler.Phase.TRIAL:
+            run_single_trial(
+                feature_pipeline.commands,
                 band_power_chart,
                 psd_chart,
                 one_dim_experiment,
-                average,
+                decoder,
+                latency_monitor,
+                r_squared_map,
+                log,
+                session_scheduler,
+                psd_feature_extractor.data_len_s,
+                stream_server,
             )
-            band_power_values_all_trials[one_dim_experiment.target_position].extend(
-                band_power_values
+            log.save()
+            print(
+                f"Best features so far: {format_top_features(r_squared_map, map_extractor.freqs)}"
             )
 
-            print("Waiting 3 seconds before next trial")
-            time.sleep(3)
-
-            print("Resetting GUI")
-            if i != NUM_TRIALS - 1:  # don't reset at end of experiment
+            print(f"Waiting {FEEDBACK_S + INTER_TRIAL_S} seconds before next trial")
+            while session_scheduler.tick():
+                one_dim_experiment.update()
+            if session_scheduler.phase == scheduler.Phase.INTER_TRIAL:
+                print("Resetting GUI")
                 one_dim_experiment.reset()
+                while session_scheduler.tick():
+                    one_dim_experiment.update()
 
-        print("Experiment complete")
+        if replay_file is not None and board.finished:
+            print(
+                f"Recording used up during trial {session_scheduler.trial + 1} of {NUM_TRIALS}, ended the session"
+            )
+        feature_pipeline.stop()
+        if file_writer is not None:
+            # writes the last samples while the board session is still open
+            file_writer.close()
+        if publisher is not None:
+            board.stop_publishing(publisher)
+        if stream_server is not None:
+            board.remove_listener(stream_server.publish_samples)
+            stream_server.stop()
+        print(f"Experiment complete, session log saved to {log.file_name}")
+        print(f"Session timing: {session_scheduler.format_summary()}")
+        latency_file = os.path.join(
+            data_dir, f"latency-{datetime.now().isoformat()}.json"
+        )
+        latency_monitor.export(latency_file)
+        r_squared_file = os.path.join(
+            data_dir, f"r-squared-{datetime.now().isoformat()}.npz"
+        )
+        np.savez_compressed(
+            r_squared_file,
+            r_squared=r_squared_map.r_squared(),
+            freqs=map_extractor.freqs,
+            channels=list(channels),
+            rows=list(channels.values()),
+        )
+        print(f"Latency summary, saved to {latency_file}:")
+        print(latency_monitor.format_summary())
         print(
             f"Final results:\n"
             f"\tTop hit: {one_dim_experiment.top_hit}"
@@ -186,39 +411,56 @@ def main():
             f"\tNum top - {NUM_TRIALS / 2}"
             f"\t\tNum bottom - {NUM_TRIALS / 2}"
         )
-
-        plt.close("all")
-        for pos in [
-            one_dim.OneDimensionControlExperiment.TargetPos.TOP,
-            one_dim.OneDimensionControlExperiment.TargetPos.BOTTOM,
-        ]:
-            pos_data = band_power_values_all_trials[pos]
-            ax: plt.Axes = sns.distplot(
-                pos_data,
-                hist=False,
-                kde=True,
-                kde_kws={"shade": True, "linewidth": 3},
-                label=f"{pos} - nobs: {len(pos_data)}",
-            )
-            ax.set_xlim(0, 7.5)
-        plt.xlabel("Power Spectral Density")
-        plt.ylabel("Frequency Density")
-        plt.title("PSD Distribution by Target Position")
-        plt.legend()
-        plt.show()
-        print("Top target band power stats:")
-        print(
-            stats.describe(
-                band_power_values_all_trials[one_dim_experiment.TargetPos.TOP]
-            )
-        )
-        print("Bottom target band power stats:")
         print(
-            stats.describe(
-                band_power_values_all_trials[one_dim_experiment.TargetPos.BOTTOM]
-            )
+            f"Features best separating the targets, r² map saved to {r_squared_file}:\n"
+            f"\t{format_top_features(r_squared_map, map_extractor.freqs)}"
         )
 
+        if not headless:
+            plot_results(r_squared_map, map_extractor.freqs)
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="1D cursor control experiment")
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="play back a recording written by FileWriter instead of using the Cyton",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1,
+        help="playback rate relative to real time, 0 plays back as fast as possible",
+    )
+    parser.add_argument(
+        "--spectral-estimator",
+        choices=["welch", "burg"],
+        default="welch",
+        help="burg fits an autoregressive model to a much shorter window, its band powers are scaled differently",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="run without the experiment window, e.g. on a server with --replay",
+    )
+    parser.add_argument(
+        "--shared-memory",
+        metavar="NAME",
+        help="publish the live samples to a shared memory ring, e.g. for `python shared_ring.py NAME`",
+    )
+    parser.add_argument(
+        "--stream-port",
+        type=int,
+        metavar="PORT",
+        help="stream samples and control commands to local subscribers, e.g. `python streaming.py --port PORT`",
+    )
+    args = parser.parse_args()
+    main(
+        args.replay,
+        args.replay_speed if args.replay_speed > 0 else None,
+        args.spectral_estimator,
+        args.headless,
+        args.shared_memory,
+        args.stream_port,
+    )
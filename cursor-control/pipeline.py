@@ -0,0 +1,413 @@
+from __future__ import annotations
+
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Deque, Generic, List, Tuple, TypeVar, Union
+
+from brainflow.board_shim import BrainFlowError
+from nptyping import NDArray
+
+import board_reader
+import feature_extraction
+import instrumentation
+import preprocessing
+
+T = TypeVar("T")
+
+
+class DropOldestQueue(Generic[T]):
+    """
+    Bounded, thread-safe FIFO. Putting into a full queue discards the oldest item instead of blocking the producer,
+    so a slow consumer always catches up to the newest data.
+    """
+
+    def __init__(self, max_size: int):
+        self.items: Deque[T] = collections.deque(maxlen=max_size)
+        self.condition = threading.Condition()
+        self.num_dropped = 0
+
+    def put(self, item: T):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.num_dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout: Union[float, None] = None) -> Union[T, None]:
+        """
+        :return: the oldest item, or None if nothing arrived within the timeout
+        """
+        with self.condition:
+            if not self.items:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+    def get_all(self) -> List[T]:
+        """
+        :return: every queued item, oldest first, without waiting
+        """
+        with self.condition:
+            items = list(self.items)
+            self.items.clear()
+        return items
+
+
+class PeriodicStage(threading.Thread):
+    """
+    Worker thread calling `step` on a fixed schedule. Deadlines are absolute, so the period doesn't stretch by the
+    time each step takes. When a step overruns, the missed ticks are skipped rather than run back to back.
+    """
+
+    def __init__(self, name: str, period_s: float):
+        super(PeriodicStage, self).__init__(name=name, daemon=True)
+        self.period_s = period_s
+        self.stop_event = threading.Event()
+        self.overruns = 0
+
+    def run(self):
+        next_deadline = time.monotonic()
+        while not self.stop_event.is_set():
+            self.step()
+            next_deadline += self.period_s
+            delay = next_deadline - time.monotonic()
+            if delay < 0:
+                self.overruns += 1
+                next_deadline = time.monotonic()
+                continue
+            self.stop_event.wait(delay)
+
+    def step(self):
+        raise NotImplementedError
+
+    def stop(self):
+        self.stop_event.set()
+
+
+@dataclass
+class FeatureUpdate:
+    timestamp: float  # board timestamp of the newest sample the features include
+    band_powers: NDArray[float]
+    psd: Tuple[NDArray[float], NDArray[float]]  # amplitude, frequency pair
+    # PSD amplitudes of every mapped channel, shape (channels, frequencies), if the pipeline maps channels
+    channel_psds: Union[NDArray[float], None] = None
+
+
+@dataclass
+class ControlCommand:
+    feature: FeatureUpdate
+    velocity: int  # cursor pixels per second, negative is up
+
+
+class AcquisitionStage(PeriodicStage):
+    """
+    Moves new board samples into `output`, one block of shape (rows, samples) per step.
+    """
+
+    def __init__(
+        self,
+        board_data: board_reader.BoardDataConsumer,
+        output: DropOldestQueue[NDArray[float]],
+        period_s: float = 0.02,
+        latency_monitor: Union[instrumentation.LatencyMonitor, None] = None,
+        rows: Union[NDArray[int], None] = None,
+    ):
+        """
+        :param rows: board rows to read as returned by `BoardReader.select_rows`, in this order, all rows if None
+        """
+        super(AcquisitionStage, self).__init__("acquisition", period_s)
+        self.board_data = board_data
+        self.rows = rows
+        self.output = output
+        self.latency_monitor = latency_monitor
+
+    def step(self):
+        start = time.perf_counter()
+        try:
+            if self.rows is None:
+                data = self.board_data.read()
+            else:
+                data = self.board_data.read_rows(self.rows)
+        except BrainFlowError as e:
+            logging.debug(f"Quietly handling BrainFlowError: {e}")
+            return
+        if self.latency_monitor is not None:
+            self.latency_monitor.record("board_read", time.perf_counter() - start)
+        if data.shape[1] > 0:
+            self.output.put(data)
+
+
+class FeatureStage(PeriodicStage):
+    """
+    Feeds the blocks from the acquisition stage, optionally filtered, into a streaming PSD extractor and publishes the
+    band powers on a fixed schedule, however long the consumers of `output` take.
+    """
+
+    def __init__(
+        self,
+        psd_extractor: Union[
+            feature_extraction.StreamingPSDFeatureExtractor,
+            feature_extraction.BurgARFeatureExtractor,
+        ],
+        channel: int,
+        timestamp_channel: int,
+        board_data: DropOldestQueue[NDArray[float]],
+        output: DropOldestQueue[FeatureUpdate],
+        period_s: float = 0.1,
+        latency_monitor: Union[instrumentation.LatencyMonitor, None] = None,
+        filter_bank: Union[preprocessing.StreamingFilterBank, None] = None,
+        map_channels: Union[List[int], None] = None,
+        map_extractor: Union[
+            feature_extraction.StreamingPSDFeatureExtractor, None
+        ] = None,
+        map_filter_bank: Union[preprocessing.StreamingFilterBank, None] = None,
+        board_consumer: Union[board_reader.BoardDataConsumer, None] = None,
+    ):
+        """
+        :param channel: row of the blocks from the acquisition stage the features are calculated from
+        :param timestamp_channel: row of the blocks holding the board timestamps
+        :param filter_bank: filters applied to the new samples of the channel before feature extraction
+        :param map_channels: rows of the blocks whose PSDs are published along with the features, e.g. for an r² map
+        :param map_extractor: multichannel extractor for the rows in `map_channels`
+        :param map_filter_bank: multichannel filters applied to the rows in `map_channels`
+        :param board_consumer: consumer the acquisition stage reads from, samples it loses restart the estimate like
+            blocks dropped from `board_data`
+        """
+        super(FeatureStage, self).__init__("features", period_s)
+        self.latency_monitor = latency_monitor
+        self.filter_bank = filter_bank
+        self.map_channels = map_channels
+        self.map_extractor = map_extractor
+        self.map_filter_bank = map_filter_bank
+        self.psd_extractor = psd_extractor
+        self.channel = channel
+        self.timestamp_channel = timestamp_channel
+        self.board_data = board_data
+        self.output = output
+        self.board_consumer = board_consumer
+        self.num_dropped_seen = 0
+        self.samples_lost_seen = 0
+
+    def step(self):
+        blocks = self.board_data.get_all()
+        samples_lost = (
+            self.board_consumer.samples_lost if self.board_consumer is not None else 0
+        )
+        if (
+            self.board_data.num_dropped != self.num_dropped_seen
+            or samples_lost != self.samples_lost_seen
+        ):
+            # the stream has a gap, segments must not span it
+            logging.warning("Board data has a gap, restarting PSD estimate")
+            self.num_dropped_seen = self.board_data.num_dropped
+            self.samples_lost_seen = samples_lost
+            for resettable in (
+                self.psd_extractor,
+                self.filter_bank,
+                self.map_extractor,
+                self.map_filter_bank,
+            ):
+                if resettable is not None:
+                    resettable.reset()
+        if not blocks:
+            return
+        start = time.perf_counter()
+        for block in blocks:
+            samples = block[self.channel]
+            if self.filter_bank is not None:
+                samples = self.filter_bank.process(samples)
+            self.psd_extractor.process_new_data(samples)
+            if self.map_extractor is not None:
+                map_samples = block[self.map_channels]
+                if self.map_filter_bank is not None:
+                    map_samples = self.map_filter_bank.process(map_samples)
+                self.map_extractor.process_new_data(map_samples)
+        if self.psd_extractor.psd is None:
+            return
+        amplitudes, freqs = self.psd_extractor.psd
+        channel_psds = None
+        if self.map_extractor is not None and self.map_extractor.psd is not None:
+            channel_psds = self.map_extractor.psd[0].copy()
+        timestamp = blocks[-1][self.timestamp_channel][-1]
+        if self.latency_monitor is not None:
+            self.latency_monitor.record("psd", time.perf_counter() - start)
+            self.latency_monitor.record_sample_age("sample_age_at_features", timestamp)
+        self.output.put(
+            FeatureUpdate(
+                timestamp=timestamp,
+                band_powers=self.psd_extractor.band_powers.copy(),
+                psd=(amplitudes.copy(), freqs),
+                channel_psds=channel_psds,
+            )
+        )
+
+
+class ControlStage(threading.Thread):
+    """
+    Maps every feature update to a cursor velocity as soon as it arrives.
+    """
+
+    def __init__(
+        self,
+        velocity_mapping: Callable[[FeatureUpdate], int],
+        features: DropOldestQueue[FeatureUpdate],
+        output: DropOldestQueue[ControlCommand],
+        latency_monitor: Union[instrumentation.LatencyMonitor, None] = None,
+    ):
+        super(ControlStage, self).__init__(name="control", daemon=True)
+        self.velocity_mapping = velocity_mapping
+        self.features = features
+        self.output = output
+        self.latency_monitor = latency_monitor
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            feature = self.features.get(timeout=0.1)
+            if feature is None:
+                continue
+            self.map_feature(feature)
+
+    def map_feature(self, feature: FeatureUpdate):
+        start = time.perf_counter()
+        velocity = self.velocity_mapping(feature)
+        if self.latency_monitor is not None:
+            self.latency_monitor.record("velocity_mapping", time.perf_counter() - start)
+        self.output.put(ControlCommand(feature, velocity))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class Pipeline:
+    """
+    Acquisition, feature extraction and control mapping, each on its own thread and connected by drop-oldest queues.
+    Rendering stays with the caller, which should take the newest command from `commands`. Instead of starting the
+    threads, the caller can also run the stages itself with `step`.
+    """
+
+    def __init__(
+        self,
+        board: board_reader.BoardReader,
+        psd_extractor: Union[
+            feature_extraction.StreamingPSDFeatureExtractor,
+            feature_extraction.BurgARFeatureExtractor,
+        ],
+        channel: int,
+        velocity_mapping: Callable[[FeatureUpdate], int],
+        feature_period_s: float = 0.1,
+        queue_size: int = 50,
+        latency_monitor: Union[instrumentation.LatencyMonitor, None] = None,
+        filter_bank: Union[preprocessing.StreamingFilterBank, None] = None,
+        map_channels: Union[List[int], None] = None,
+        map_extractor: Union[
+            feature_extraction.StreamingPSDFeatureExtractor, None
+        ] = None,
+        map_filter_bank: Union[preprocessing.StreamingFilterBank, None] = None,
+    ):
+        """
+        :param channel: board row the features are calculated from
+        :param velocity_mapping: turns a feature update into a cursor velocity in pixels per second
+        :param latency_monitor: records the duration of every stage step, if given
+        :param filter_bank: filters applied to the channel before feature extraction
+        :param map_channels: board rows whose PSDs are published in `FeatureUpdate.channel_psds`
+        :param map_extractor: multichannel extractor for the rows in `map_channels`
+        :param map_filter_bank: multichannel filters applied to the rows in `map_channels`
+        """
+        self.board_data: DropOldestQueue[NDArray[float]] = DropOldestQueue(queue_size)
+        self.features: DropOldestQueue[FeatureUpdate] = DropOldestQueue(queue_size)
+        self.commands: DropOldestQueue[ControlCommand] = DropOldestQueue(queue_size)
+        # only the rows the features need are read from the board, in this order: the channel, the timestamps and the
+        # map's rows
+        map_channels = map_channels if map_channels is not None else []
+        rows = board.select_rows(
+            [channel, board.get_timestamp_channel()] + list(map_channels)
+        )
+        self.acquisition = AcquisitionStage(
+            board.create_consumer(from_oldest=True),
+            self.board_data,
+            latency_monitor=latency_monitor,
+            rows=rows,
+        )
+        self.feature_stage = FeatureStage(
+            psd_extractor,
+            0,
+            1,
+            self.board_data,
+            self.features,
+            feature_period_s,
+            latency_monitor,
+            filter_bank,
+            list(range(2, len(rows))) if map_channels else None,
+            map_extractor,
+            map_filter_bank,
+            self.acquisition.board_data,
+        )
+        self.control = ControlStage(
+            velocity_mapping, self.features, self.commands, latency_monitor
+        )
+        self.stages = [self.acquisition, self.feature_stage, self.control]
+        self.started = False
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self.started = True
+
+    def step(self):
+        """
+        Run every stage once on the calling thread, e.g. to replay a recording on a simulated clock. Call at the
+        feature period, and don't `start` the threads as well.
+        """
+        self.acquisition.step()
+        self.feature_stage.step()
+        for feature in self.features.get_all():
+            self.control.map_feature(feature)
+
+    def stop(self):
+        if not self.started:
+            return
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join()
+
+
+class ReplayPacer:
+    """
+    Runs a pipeline on simulated time, e.g. to replay a recording faster than real time with the whole session following
+    the recording. Waiting advances the clock the replayed board, the cursor and the session scheduler follow, and runs
+    the pipeline's stages every `period_s` of it.
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        period_s: float,
+        clock,
+        speed: Union[float, None] = 1,
+        real_wait: Callable[[float], None] = time.sleep,
+    ):
+        """
+        :param pipeline: not started, its stages are run by `wait`
+        :param clock: simulated clock with an `advance(seconds)` method, e.g. `one_dim_control.SimulatedClock`
+        :param speed: simulated time per real time, None to not wait in real time at all
+        :param real_wait: waits in real time, e.g. `OneDimensionControlExperiment.wait` to keep the window responsive
+        """
+        self.pipeline = pipeline
+        self.period_s = period_s
+        self.clock = clock
+        self.speed = speed
+        self.real_wait = real_wait
+        self.next_step_s = clock()
+
+    def wait(self, seconds: float):
+        end_s = self.clock() + seconds
+        while self.next_step_s <= end_s:
+            self.clock.advance(self.next_step_s - self.clock())
+            self.pipeline.step()
+            self.next_step_s += self.period_s
+        self.clock.advance(end_s - self.clock())
+        self.real_wait(seconds / self.speed if self.speed is not None else 0)
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from typing import Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+
+class StreamingFilterBank:
+    """
+    Notch and band-pass filtering of a sample stream, applied chunk by chunk. The filter state is carried over between
+    chunks, so filtering a stream in chunks gives the same result as filtering it at once and every sample is filtered
+    exactly once. The most recent filtered samples are kept in a rolling buffer.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        notch_freq: Union[float, None] = 60,
+        band: Union[Tuple[float, float], None] = (0.5, 45),
+        band_order: int = 4,
+        notch_quality: float = 30,
+        num_channels: Union[int, None] = None,
+        buffer_len: Union[int, None] = None,
+    ):
+        """
+        :param sample_rate: sample rate of the board
+        :param notch_freq: line noise frequency to remove, 50 or 60 Hz depending on the mains, None to skip the notch
+        :param band: (low, high) edges of the Butterworth band-pass in Hz, None to skip the band-pass
+        :param band_order: order of the band-pass filter
+        :param notch_quality: quality factor of the notch, higher is narrower
+        :param num_channels: number of channels filtered together, chunks then have shape (channels, samples). None
+            filters a single channel given as a 1D array.
+        :param buffer_len: number of filtered samples kept in `buffer`, defaults to 3 seconds
+        """
+        # importing scipy.signal also loads scipy.stats, which is slow, so it's left until a filter is needed
+        from scipy import signal
+
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.sosfilt = signal.sosfilt
+        sections = []
+        if notch_freq is not None:
+            b, a = signal.iirnotch(notch_freq, notch_quality, fs=sample_rate)
+            sections.append(signal.tf2sos(b, a))
+        if band is not None:
+            sections.append(
+                signal.butter(
+                    band_order, band, btype="bandpass", output="sos", fs=sample_rate
+                )
+            )
+        assert sections, "nothing to filter"
+        self.sos = np.concatenate(sections)
+        # unit step response initial conditions, scaled by the first sample of the stream
+        self.step_zi = signal.sosfilt_zi(self.sos)
+        self.zi: Union[NDArray[float], None] = None
+
+        buffer_len = buffer_len if buffer_len is not None else 3 * sample_rate
+        channel_shape = () if num_channels is None else (num_channels,)
+        self.ring = np.zeros(channel_shape + (buffer_len,))
+        self.samples_filtered = 0
+
+    def reset(self):
+        """
+        Forget the filter state and buffered samples, e.g. after a gap in the stream.
+        """
+        self.zi = None
+        self.ring[...] = 0
+        self.samples_filtered = 0
+
+    def process(self, new_samples: NDArray[float]) -> NDArray[float]:
+        """
+        Filter the samples that directly follow the previously processed ones.
+
+        :param new_samples: array of shape (samples,), or (channels, samples) for multiple channels
+        :return: filtered samples, same shape as `new_samples`
+        """
+        if new_samples.shape[-1] == 0:
+            return np.array(new_samples, dtype=float)
+        if self.zi is None:
+            # start in steady state for the first sample so a DC offset doesn't ring through the filters
+            first = new_samples[..., 0]
+            self.zi = self.step_zi.reshape(
+                (len(self.sos),) + (1,) * np.ndim(first) + (2,)
+            ) * np.expand_dims(first, -1)
+        filtered, self.zi = self.sosfilt(self.sos, new_samples, zi=self.zi)
+        self._append(filtered)
+        return filtered
+
+    def _append(self, filtered: NDArray[float]):
+        buffer_len = self.ring.shape[-1]
+        num_filtered = filtered.shape[-1]
+        # samples older than the buffer would be overwritten straight away
+        kept = filtered[..., -buffer_len:]
+        num_kept = kept.shape[-1]
+        start = (self.samples_filtered + num_filtered - num_kept) % buffer_len
+        first_part = min(num_kept, buffer_len - start)
+        self.ring[..., start : start + first_part] = kept[..., :first_part]
+        self.ring[..., : num_kept - first_part] = kept[..., first_part:]
+        self.samples_filtered += num_filtered
+
+    @property
+    def buffer(self) -> NDArray[float]:
+        """
+        Copy of the most recent filtered samples, oldest first, at most `buffer_len` of them.
+        """
+        buffer_len = self.ring.shape[-1]
+        num_buffered = min(self.samples_filtered, buffer_len)
+        start = self.samples_filtered % buffer_len
+        ordered = np.roll(self.ring, -start, axis=-1)
+        return ordered[..., buffer_len - num_buffered :]
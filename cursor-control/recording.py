@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from enum import Enum, auto
+from typing import BinaryIO, Dict, TextIO, Tuple, Union
+
+import numpy
+from brainflow.board_shim import BoardIds
+from nptyping import NDArray
+
+HEADER_TITLE = "%CursorControl board reader raw EEG data"
+BINARY_HEADER_SIZE = 512  # bytes, samples start at this offset in binary recordings
+BINARY_DTYPE = numpy.dtype("<f8")
+# magic, number of samples and payload size of every compressed chunk
+CHUNK_HEADER = struct.Struct("<4sII")
+CHUNK_MAGIC = b"EEGC"
+COMPRESSION_LEVEL = (
+    1  # zlib's fastest, higher levels barely shrink the encoded samples further
+)
+
+
+class RecordingFormat(Enum):
+    """
+    TEXT: one line of comma separated values per sample
+    BINARY: samples appended as raw little-endian float64 rows, each row holding every board channel
+    COMPRESSED: the binary header followed by independently compressed chunks of samples, lossless
+    """
+
+    TEXT = auto()
+    BINARY = auto()
+    COMPRESSED = auto()
+
+
+FILE_EXTENSIONS = {
+    RecordingFormat.TEXT: ".txt",
+    RecordingFormat.BINARY: ".bin",
+    RecordingFormat.COMPRESSED: ".binz",
+}
+
+
+@dataclass
+class RecordingHeader:
+    """
+    Metadata written at the start of every recording.
+    """
+
+    num_channels: int  # number of EEG channels
+    sample_rate: int
+    board_id: int
+    # number of board channels per sample, needed to read binary recordings
+    num_rows: Union[int, None] = None
+
+    def to_lines(self, include_num_rows: bool = True):
+        lines = [
+            HEADER_TITLE,
+            f"%Number of channels = {self.num_channels}",
+            f"%Sample rate = {self.sample_rate}",
+            f"%Board = {BoardIds(self.board_id).name}",
+        ]
+        if include_num_rows and self.num_rows is not None:
+            lines.append(f"%Number of rows = {self.num_rows}")
+        return lines
+
+    @classmethod
+    def from_lines(cls, lines):
+        fields: Dict[str, str] = {}
+        for line in lines:
+            if line.startswith("%") and " = " in line:
+                key, value = line[1:].split(" = ", 1)
+                fields[key] = value.strip()
+        return cls(
+            num_channels=int(fields["Number of channels"]),
+            sample_rate=int(fields["Sample rate"]),
+            board_id=BoardIds[fields["Board"]].value,
+            num_rows=int(fields["Number of rows"])
+            if "Number of rows" in fields
+            else None,
+        )
+
+
+@dataclass
+class Recording:
+    header: RecordingHeader
+    # shape (rows, samples), a read-only memory-mapped view for binary recordings
+    data: NDArray[float]
+
+
+def write_header(
+    file: Union[TextIO, BinaryIO],
+    recording_format: RecordingFormat,
+    header: RecordingHeader,
+):
+    is_text = recording_format == RecordingFormat.TEXT
+    # text recordings keep their original four line header
+    text = "\n".join(header.to_lines(include_num_rows=not is_text)) + "\n"
+    if is_text:
+        file.write(text)
+        return
+    encoded = text.encode("ascii")
+    assert len(encoded) < BINARY_HEADER_SIZE - 1
+    # pad with a comment line so the samples start at a fixed offset
+    padding = BINARY_HEADER_SIZE - len(encoded) - 1
+    file.write(encoded + b"%" + b" " * (padding - 1) + b"\n")
+
+
+def write_data(
+    file: Union[TextIO, BinaryIO],
+    recording_format: RecordingFormat,
+    data: NDArray[float],
+):
+    """
+    Append a block of samples to a recording.
+
+    :param data: board data of shape (rows, samples)
+    """
+    if recording_format == RecordingFormat.COMPRESSED:
+        file.write(_encode_chunk(data))
+        return
+    if recording_format == RecordingFormat.TEXT:
+        for sample in data.T:
+            file.write(",".join(str(value) for value in sample))
+            file.write("\n")
+        return
+    # sample-major, so consecutive blocks form one contiguous (samples, rows) array on disk
+    file.write(numpy.ascontiguousarray(data.T, dtype=BINARY_DTYPE).tobytes())
+
+
+def read_header(file_name: str) -> Tuple[RecordingFormat, RecordingHeader]:
+    """
+    Read the format and header of a recording without reading its samples.
+    """
+    with open(file_name, "rb") as file:
+        start = file.read(BINARY_HEADER_SIZE)
+    recording_format = next(
+        (
+            recording_format
+            for recording_format, extension in FILE_EXTENSIONS.items()
+            if file_name.endswith(extension)
+        ),
+        RecordingFormat.TEXT,
+    )
+    header_lines = [
+        line
+        for line in start.decode("ascii", errors="replace").splitlines()
+        if line.startswith("%")
+    ]
+    return recording_format, RecordingHeader.from_lines(header_lines)
+
+
+def read_recording(file_name: str) -> Recording:
+    """
+    Read a recording written in any format. Binary recordings are memory-mapped rather than read into memory, and a
+    partially written sample or chunk at the end of the file is ignored.
+    """
+    recording_format, header = read_header(file_name)
+    if recording_format == RecordingFormat.TEXT:
+        data = numpy.loadtxt(file_name, delimiter=",", comments="%", ndmin=2)
+        header.num_rows = data.shape[1]
+        return Recording(header, data.T)
+    if recording_format == RecordingFormat.COMPRESSED:
+        with open(file_name, "rb") as file:
+            file.seek(BINARY_HEADER_SIZE)
+            return Recording(header, _decode_chunks(file.read(), header.num_rows))
+
+    assert header.num_rows is not None
+    sample_size = header.num_rows * BINARY_DTYPE.itemsize
+    num_samples = (os.path.getsize(file_name) - BINARY_HEADER_SIZE) // sample_size
+    if num_samples == 0:
+        return Recording(header, numpy.empty((header.num_rows, 0)))
+    samples = numpy.memmap(
+        file_name,
+        dtype=BINARY_DTYPE,
+        mode="r",
+        offset=BINARY_HEADER_SIZE,
+        shape=(num_samples, header.num_rows),
+    )
+    return Recording(header, samples.T)
+
+
+def _integer_scale(values: NDArray[float]) -> float:
+    """
+    Find a scale that turns the values into integers, e.g. the microvolts per count of the ADC they were read from.
+
+    :return: scale such that `rint(values / scale) * scale` reproduces the values bit for bit, 0 if there is none
+    """
+    if not numpy.isfinite(values).all():
+        return 0.0
+    magnitudes = numpy.unique(numpy.abs(values))
+    magnitudes = magnitudes[magnitudes != 0]
+    scale = 1.0
+    if len(magnitudes) > 0:
+        # Euclid's algorithm, with a tolerance for the rounding of the scaled values
+        step = magnitudes[0]
+        if len(magnitudes) > 1:
+            step = min(step, numpy.diff(magnitudes).min())
+        scale = 0.0
+        for _ in range(32):
+            if step <= magnitudes[-1] / 2**52:
+                break
+            ratios = magnitudes / step
+            multiples = numpy.rint(ratios)
+            off_grid = numpy.abs(ratios - multiples) > 0.1
+            if not off_grid.any():
+                # the largest multiple pins the scale down most precisely
+                scale = magnitudes[-1] / multiples[-1]
+                break
+            step = numpy.abs(magnitudes[off_grid] - multiples[off_grid] * step).min()
+        if scale == 0 or magnitudes[-1] / scale >= 2**62:
+            return 0.0
+    # through the same integers the chunk stores, which e.g. lose the sign of -0.0
+    restored = numpy.rint(values / scale).astype(numpy.int64) * scale
+    if not numpy.array_equal(restored.view(numpy.uint64), values.view(numpy.uint64)):
+        return 0.0
+    return scale
+
+
+def _encode_chunk(data: NDArray[float]) -> bytes:
+    """
+    Rows that are integer multiples of a scale are stored as integers, the others as the bit patterns of their floats.
+    Either way the difference to the previous sample is zigzag encoded, so slowly varying rows and counters become
+    small integers whose high bytes, grouped together by a byte shuffle, compress to almost nothing.
+    """
+    data = numpy.ascontiguousarray(data, dtype=BINARY_DTYPE)
+    num_rows, num_samples = data.shape
+    scales = numpy.array([_integer_scale(row) for row in data])
+    integers = data.view(numpy.int64).copy()
+    scaled = scales != 0
+    integers[scaled] = numpy.rint(data[scaled] / scales[scaled, None])
+    deltas = numpy.diff(integers, axis=1, prepend=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    shuffled = zigzag.astype("<i8").view(numpy.uint8).reshape(num_rows, num_samples, 8)
+    payload = zlib.compress(
+        scales.astype(BINARY_DTYPE).tobytes() + shuffled.transpose(0, 2, 1).tobytes(),
+        COMPRESSION_LEVEL,
+    )
+    return CHUNK_HEADER.pack(CHUNK_MAGIC, num_samples, len(payload)) + payload
+
+
+def _decode_chunk(payload: bytes, num_rows: int, num_samples: int) -> NDArray[float]:
+    raw = numpy.frombuffer(zlib.decompress(payload), dtype=numpy.uint8)
+    scales = raw[: num_rows * 8].view(BINARY_DTYPE)
+    shuffled = raw[num_rows * 8 :].reshape(num_rows, 8, num_samples)
+    zigzag = (
+        numpy.ascontiguousarray(shuffled.transpose(0, 2, 1))
+        .view("<u8")
+        .reshape(num_rows, num_samples)
+    )
+    deltas = (zigzag >> 1).view(numpy.int64) ^ -(zigzag & 1).view(numpy.int64)
+    integers = numpy.cumsum(deltas, axis=1)
+    data = integers.view(numpy.float64).copy()
+    scaled = scales != 0
+    data[scaled] = integers[scaled] * scales[scaled, None]
+    return data
+
+
+def _decode_chunks(buffer: bytes, num_rows: int) -> NDArray[float]:
+    """
+    :return: samples of all complete chunks, shape (rows, samples)
+    """
+    blocks = [numpy.empty((num_rows, 0))]
+    offset = 0
+    while offset + CHUNK_HEADER.size <= len(buffer):
+        magic, num_samples, payload_size = CHUNK_HEADER.unpack_from(buffer, offset)
+        assert magic == CHUNK_MAGIC, f"corrupt chunk at offset {offset}"
+        payload_start = offset + CHUNK_HEADER.size
+        if payload_start + payload_size > len(buffer):
+            break
+        blocks.append(
+            _decode_chunk(
+                buffer[payload_start : payload_start + payload_size],
+                num_rows,
+                num_samples,
+            )
+        )
+        offset = payload_start + payload_size
+    return numpy.concatenate(blocks, axis=1)
@@ -0,0 +1,152 @@
+"""
+Timing of an experiment session: a baseline, then trials each followed by feedback and an inter-trial pause. Phases
+and the ticks within them run on absolute deadlines of a monotonic clock, so processing time doesn't stretch them and
+wall clock changes don't affect them.
+"""
+import math
+import time
+from enum import Enum, auto
+from typing import Callable, Dict, Union
+
+import instrumentation
+
+
+class Phase(Enum):
+    BASELINE = auto()  # before the first trial, while the feature windows fill up
+    TRIAL = auto()
+    FEEDBACK = auto()  # showing whether the target was reached
+    INTER_TRIAL = auto()  # the next target is shown, the cursor doesn't move yet
+    DONE = auto()
+
+
+class SessionScheduler:
+    """
+    State machine stepping through the phases of a session. Each phase runs `tick` in a loop until it returns False:
+
+        scheduler.start()
+        while scheduler.tick():
+            ...  # one tick of the baseline
+        while scheduler.tick():
+            ...  # one tick of the first trial, see `end_phase` to end it early
+
+    Ticks are released every `tick_period_s` from the start of their phase. A tick that starts a whole period or more
+    late is counted as an overrun and the ticks it missed are skipped. Every phase starts at the planned end of the
+    previous one, so late ticks don't shift the rest of the session.
+    """
+
+    def __init__(
+        self,
+        num_trials: int,
+        tick_period_s: float,
+        trial_s: float,
+        baseline_s: float = 0,
+        feedback_s: float = 0,
+        inter_trial_s: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+        wait: Callable[[float], None] = time.sleep,
+        finished: Union[Callable[[], bool], None] = None,
+    ):
+        """
+        :param clock: monotonic time in seconds
+        :param wait: blocks for the given number of seconds, e.g. `OneDimensionControlExperiment.wait` to keep the
+            window responsive. Waking up early is fine, it's called again for the rest of the time.
+        :param finished: ends the session at the next tick once it returns True, e.g. when a replayed recording is
+            used up
+        """
+        self.num_trials = num_trials
+        self.tick_period_s = tick_period_s
+        self.durations_s: Dict[Phase, float] = {
+            Phase.BASELINE: baseline_s,
+            Phase.TRIAL: trial_s,
+            Phase.FEEDBACK: feedback_s,
+            Phase.INTER_TRIAL: inter_trial_s,
+        }
+        self.clock = clock
+        self.wait = wait
+        self.finished = finished
+        self.phase = Phase.BASELINE
+        self.trial = -1  # index of the current or last trial
+        self.phase_start_s = math.nan
+        self.phase_end_s = math.nan
+        self.phase_ticks = 0  # released or skipped in the current phase
+        self.deadline_s = math.nan  # of the next tick
+        self.ticks = 0
+        self.overruns = 0
+        # how late each tick started
+        self.jitter = instrumentation.LatencyHistogram()
+
+    def start(self):
+        self._enter(Phase.BASELINE, self.clock())
+
+    def _enter(self, phase: Phase, start_s: float):
+        if phase == Phase.TRIAL:
+            self.trial += 1
+        self.phase = phase
+        self.phase_start_s = start_s
+        self.phase_end_s = start_s + self.durations_s.get(phase, math.inf)
+        self.phase_ticks = 0
+        self.deadline_s = start_s
+
+    def _next_phase(self) -> Phase:
+        if self.phase == Phase.BASELINE or self.phase == Phase.INTER_TRIAL:
+            return Phase.TRIAL
+        if self.phase == Phase.TRIAL:
+            return Phase.FEEDBACK
+        if self.trial == self.num_trials - 1:
+            return Phase.DONE
+        return Phase.INTER_TRIAL
+
+    def tick(self) -> bool:
+        """
+        Wait for the next tick of the current phase.
+
+        :return: False instead once the phase is over, after moving on to the next phase
+        """
+        if self.finished is not None and self.finished():
+            self.phase = Phase.DONE
+        if self.phase == Phase.DONE:
+            return False
+        # deadlines are computed from the phase start, the tolerance only absorbs rounding
+        if self.deadline_s >= self.phase_end_s - 1e-9:
+            self._enter(self._next_phase(), self.phase_end_s)
+            return False
+        now = self.clock()
+        while now < self.deadline_s:
+            self.wait(self.deadline_s - now)
+            now = self.clock()
+        late_s = now - self.deadline_s
+        missed = int(late_s // self.tick_period_s)
+        if missed:
+            self.overruns += missed
+            late_s -= missed * self.tick_period_s
+        self.jitter.record(late_s)
+        self.ticks += 1
+        self.phase_ticks += missed + 1
+        self.deadline_s = self.phase_start_s + self.phase_ticks * self.tick_period_s
+        return True
+
+    def end_phase(self):
+        """
+        End the current phase early, at the next tick, e.g. when the target is reached.
+        """
+        self.phase_end_s = min(self.phase_end_s, self.deadline_s)
+
+    def phase_remaining_s(self) -> float:
+        return max(0.0, self.phase_end_s - self.clock())
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "jitter_p50_s": self.jitter.percentile(50),
+            "jitter_p99_s": self.jitter.percentile(99),
+            "jitter_max_s": self.jitter.max_s,
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        return (
+            f"{summary['ticks']} ticks, {summary['overruns']} overruns, tick jitter "
+            f"p50 {summary['jitter_p50_s'] * 1e3:.2f} ms, p99 {summary['jitter_p99_s'] * 1e3:.2f} ms, "
+            f"max {summary['jitter_max_s'] * 1e3:.2f} ms"
+        )
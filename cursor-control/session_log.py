@@ -0,0 +1,166 @@
+"""
+Per-tick log of a cursor control session, kept in a preallocated NumPy record array and saved as a single compressed
+.npz file. Load a session for analysis with `load`, or summarize it with
+
+    python session_log.py FILE
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from nptyping import NDArray
+
+# ticks added whenever the log is full, about 80 seconds of a 50 Hz control loop
+CHUNK_TICKS = 4096
+
+
+def tick_dtype(num_features: int) -> np.dtype:
+    """
+    :param num_features: band powers recorded per tick
+    """
+    return np.dtype(
+        [
+            ("time", "<f8"),  # monotonic seconds since the log was created
+            # board timestamp of the newest sample the features include, NaN before the first features arrive
+            ("board_timestamp", "<f8"),
+            ("features", "<f8", (num_features,)),
+            ("velocity", "<i4"),  # commanded cursor pixels per second, negative is up
+            ("cursor_y", "<f4"),
+            ("target", "<i1"),  # value of the trial's target position
+            ("trial", "<i2"),
+            ("hit", "?"),  # whether the target has been reached in this trial
+            ("new_commands", "<i2"),  # control commands received during the tick
+            ("gui_update_s", "<f4"),  # duration of the tick's cursor and Tk update
+        ]
+    )
+
+
+class SessionLog:
+    """
+    Records every tick of the control loop into a typed record array that grows by CHUNK_TICKS, so recording a tick
+    only writes into preallocated memory. `save` writes the whole session so far to one file, meant to be called at
+    trial boundaries where the few milliseconds it takes don't delay the cursor.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        feature_names: List[str],
+        target_names: Dict[int, str],
+        chunk_ticks: int = CHUNK_TICKS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param file_name: .npz file the log is saved to
+        :param feature_names: name of every recorded feature, e.g. the band names
+        :param target_names: name of every value of the target field
+        """
+        self.file_name = file_name
+        self.feature_names = feature_names
+        self.target_names = target_names
+        self.chunk_ticks = chunk_ticks
+        self.clock = clock
+        self.start_s = clock()
+        self.ticks: NDArray = np.zeros(chunk_ticks, tick_dtype(len(feature_names)))
+        self.num_ticks = 0
+        self._update_columns()
+
+    def _update_columns(self):
+        # field views, indexing the record array by field name on every tick would create a new view each time
+        self.columns = {name: self.ticks[name] for name in self.ticks.dtype.names}
+
+    def _grow(self):
+        ticks = np.zeros(len(self.ticks) + self.chunk_ticks, self.ticks.dtype)
+        ticks[: self.num_ticks] = self.ticks[: self.num_ticks]
+        self.ticks = ticks
+        self._update_columns()
+
+    def record(
+        self,
+        board_timestamp: float,
+        features: NDArray[float],
+        velocity: int,
+        cursor_y: float,
+        target: int,
+        trial: int,
+        hit: bool,
+        new_commands: int,
+        gui_update_s: float,
+    ):
+        if self.num_ticks == len(self.ticks):
+            self._grow()
+        tick = self.num_ticks
+        columns = self.columns
+        columns["time"][tick] = self.clock() - self.start_s
+        columns["board_timestamp"][tick] = board_timestamp
+        columns["features"][tick] = features
+        columns["velocity"][tick] = velocity
+        columns["cursor_y"][tick] = cursor_y
+        columns["target"][tick] = target
+        columns["trial"][tick] = trial
+        columns["hit"][tick] = hit
+        columns["new_commands"][tick] = new_commands
+        columns["gui_update_s"][tick] = gui_update_s
+        self.num_ticks += 1
+
+    def save(self):
+        """
+        Write every tick recorded so far. The previous file is only replaced once the new one is complete, so an
+        interrupted session keeps the log up to its last completed save.
+        """
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "wb") as file:
+            np.savez_compressed(
+                file,
+                ticks=self.ticks[: self.num_ticks],
+                feature_names=np.array(self.feature_names),
+                target_values=np.array(list(self.target_names), dtype=np.int8),
+                target_names=np.array(list(self.target_names.values())),
+            )
+        os.replace(temp_file_name, self.file_name)
+
+
+def load(file_name: str) -> Tuple[NDArray, List[str], Dict[int, str]]:
+    """
+    :return: ticks as a record array with the fields of `tick_dtype`, feature names and target names by value
+    """
+    with np.load(file_name) as session:
+        target_names = dict(
+            zip(session["target_values"].tolist(), session["target_names"].tolist())
+        )
+        return (
+            session["ticks"].view(np.recarray),
+            session["feature_names"].tolist(),
+            target_names,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print a summary of every trial of a session log"
+    )
+    parser.add_argument("file", help="session log written by SessionLog")
+    args = parser.parse_args()
+
+    ticks, feature_names, target_names = load(args.file)
+    print(
+        f"{len(ticks)} ticks over {ticks.time[-1]:.1f} seconds, features {feature_names}"
+        if len(ticks)
+        else "No ticks recorded"
+    )
+    for trial in np.unique(ticks.trial):
+        trial_ticks = ticks[ticks.trial == trial]
+        print(
+            f"Trial {trial}: target {target_names[int(trial_ticks.target[0])]}, "
+            f"{'hit' if trial_ticks.hit[-1] else 'missed'} after {trial_ticks.time[-1] - trial_ticks.time[0]:.1f} s, "
+            f"mean velocity {trial_ticks.velocity.mean():.0f}, "
+            f"mean {feature_names[0]} {np.nanmean(trial_ticks.features[:, 0]):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
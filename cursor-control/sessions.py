@@ -0,0 +1,487 @@
+"""
+Several boards, e.g. one per subject, recorded and analyzed concurrently in one process.
+
+A single scheduler thread releases the periodic tasks of every board on absolute deadlines and runs them on shared
+worker pools, so the number of threads doesn't grow with the number of boards. Try it out with synthetic boards:
+
+    python sessions.py --synthetic 8 --duration 30
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy
+from brainflow.board_shim import BoardIds, BoardShim, BrainFlowInputParams
+
+import board_reader
+import feature_extraction
+import instrumentation
+import pipeline
+import preprocessing
+import recording
+
+DEFAULT_BANDS = {
+    "Delta": (0.5, 4),
+    "Theta": (4, 7),
+    "Alpha": (8, 15),
+    "Beta": (16, 31),
+}
+SESSION_STAGES = [
+    "board_read",  # polling BrainFlow into the board reader's ring buffer
+    "recording",  # writing new samples to the recording
+    "psd",  # filtering new samples and updating the PSD
+    "scheduling_delay",  # time from a task's release until a worker starts it
+    "sample_age_at_features",  # age of the newest sample when its features are ready
+]
+
+
+@dataclass
+class TaskMetrics:
+    runs: int = 0
+    # runs that finished after the next release, plus releases skipped because the previous run was still going
+    deadline_misses: int = 0
+    skipped: int = 0
+    errors: int = 0
+
+
+class BoardSession:
+    """
+    One board with its recording and feature extraction. Everything the scheduler runs for the board reads from the
+    board reader's ring buffer through a consumer of its own, so tasks only ever wait on their own board.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        board: board_reader.BoardReader,
+        psd_extractor: feature_extraction.StreamingPSDFeatureExtractor,
+        channel: int,
+        filter_bank: Union[preprocessing.StreamingFilterBank, None] = None,
+        file_writer: Union[board_reader.FileWriter, None] = None,
+        queue_size: int = 50,
+        track_sample_age: bool = True,
+    ):
+        """
+        :param name: identifies the board in logs and metrics
+        :param channel: board row the features are calculated from
+        :param filter_bank: filters applied to the channel before feature extraction
+        :param file_writer: recording of the board, written by the scheduler instead of its own thread
+        :param track_sample_age: whether board timestamps are comparable to the wall clock
+        """
+        self.name = name
+        self.board = board
+        self.psd_extractor = psd_extractor
+        self.channel = channel
+        self.timestamp_channel = board.get_timestamp_channel()
+        self.filter_bank = filter_bank
+        self.file_writer = file_writer
+        self.feature_data = board.create_consumer()
+        self.feature_rows = board.select_rows([channel, self.timestamp_channel])
+        # reused for every read, the channel in the first row and the timestamps in the second
+        self.feature_buffer = numpy.empty((2, board.buffer_capacity))
+        self.features: pipeline.DropOldestQueue[
+            pipeline.FeatureUpdate
+        ] = pipeline.DropOldestQueue(queue_size)
+        self.latency_monitor = instrumentation.LatencyMonitor(
+            track_sample_age, SESSION_STAGES
+        )
+        # every other histogram is recorded by a single task, scheduling delays by all of them on different pools
+        self.scheduling_delay_lock = threading.Lock()
+        self.task_metrics: Dict[str, TaskMetrics] = {}
+        self.started = False
+        self.failed = False  # set once the board is given up on, its tasks are no longer scheduled
+
+    def acquire(self):
+        start = time.perf_counter()
+        self.board.poll()
+        self.latency_monitor.record("board_read", time.perf_counter() - start)
+
+    def record(self):
+        start = time.perf_counter()
+        self.file_writer.write_new_data()
+        self.latency_monitor.record("recording", time.perf_counter() - start)
+
+    def extract_features(self):
+        num_lost = self.feature_data.samples_lost
+        num_samples = self.feature_data.read_into(
+            self.feature_rows, self.feature_buffer
+        )
+        if self.feature_data.samples_lost != num_lost:
+            # the stream has a gap, segments must not span it
+            self.psd_extractor.reset()
+            if self.filter_bank is not None:
+                self.filter_bank.reset()
+        if num_samples == 0:
+            return
+        start = time.perf_counter()
+        samples = self.feature_buffer[0, :num_samples]
+        if self.filter_bank is not None:
+            samples = self.filter_bank.process(samples)
+        self.psd_extractor.process_new_data(samples)
+        if self.psd_extractor.psd is None:
+            return
+        amplitudes, freqs = self.psd_extractor.psd
+        timestamp = self.feature_buffer[1, num_samples - 1]
+        self.latency_monitor.record("psd", time.perf_counter() - start)
+        self.latency_monitor.record_sample_age("sample_age_at_features", timestamp)
+        self.features.put(
+            pipeline.FeatureUpdate(
+                timestamp=timestamp,
+                band_powers=self.psd_extractor.band_powers.copy(),
+                psd=(amplitudes.copy(), freqs),
+            )
+        )
+
+    def metrics(self) -> Dict:
+        return {
+            "samples_received": self.board.samples_received,
+            "samples_lost": self.feature_data.samples_lost
+            + (
+                self.file_writer.consumer.samples_lost
+                if self.file_writer is not None
+                else 0
+            ),
+            "feature_updates": self.latency_monitor.histograms["psd"].count,
+            "failed": self.failed,
+            "tasks": {kind: asdict(task) for kind, task in self.task_metrics.items()},
+            "latency": self.latency_monitor.summary(),
+        }
+
+
+class _PeriodicTask:
+    def __init__(
+        self,
+        session: BoardSession,
+        kind: str,
+        run: Callable[[], None],
+        period_s: float,
+        pool: ThreadPoolExecutor,
+    ):
+        self.session = session
+        self.kind = kind
+        self.run = run
+        self.period_s = period_s
+        self.pool = pool
+        self.metrics = session.task_metrics.setdefault(kind, TaskMetrics())
+        # the metrics are updated by the scheduler thread as well as the worker running the task
+        self.metrics_lock = threading.Lock()
+        self.future: Union[Future, None] = None
+        self.consecutive_errors = 0
+
+
+class SessionManager:
+    """
+    Owns any number of `BoardSession`s and runs their acquisition, recording and feature extraction on shared thread
+    pools. Acquisition and recording mostly wait on BrainFlow and the disk and share one pool, feature extraction
+    runs on a pool sized to the CPU. A task that is still running when it's released again is skipped and counted as
+    a deadline miss, so a slow or broken board falls behind on its own without holding up the others. A board whose
+    task fails `max_consecutive_errors` times in a row is stopped.
+    """
+
+    def __init__(
+        self,
+        acquisition_period_s: float = 0.05,
+        recording_period_s: float = 0.1,
+        feature_period_s: float = 0.1,
+        io_workers: Union[int, None] = None,
+        compute_workers: Union[int, None] = None,
+        max_consecutive_errors: int = 10,
+    ):
+        """
+        :param io_workers: threads for acquisition and recording, defaults to ThreadPoolExecutor's default
+        :param compute_workers: threads for feature extraction, defaults to the number of cores
+        """
+        self.periods_s = {
+            "acquisition": acquisition_period_s,
+            "recording": recording_period_s,
+            "features": feature_period_s,
+        }
+        self.io_workers = io_workers
+        self.compute_workers = compute_workers
+        self.max_consecutive_errors = max_consecutive_errors
+        self.sessions: Dict[str, BoardSession] = {}
+        self.io_pool: Union[ThreadPoolExecutor, None] = None
+        self.compute_pool: Union[ThreadPoolExecutor, None] = None
+        self.scheduler: Union[threading.Thread, None] = None
+        self.stop_event = threading.Event()
+
+    def add_board(
+        self,
+        name: str,
+        board: board_reader.BoardReader,
+        channel: int,
+        bands: Union[Dict[str, Tuple[float, float]], None] = None,
+        data_len_s: float = 3,
+        filter_bank: bool = True,
+        out_dir: Union[str, None] = None,
+        recording_format: recording.RecordingFormat = recording.RecordingFormat.BINARY,
+        track_sample_age: bool = True,
+    ) -> BoardSession:
+        """
+        Add a board before the sessions are started.
+
+        :param name: unique name of the board, also the start of its recording's file name
+        :param channel: board row the features are calculated from
+        :param bands: named (start, end) frequency bands, defaults to DEFAULT_BANDS
+        :param data_len_s: length of the analysis window in seconds
+        :param filter_bank: notch and band-pass filter the channel before feature extraction
+        :param out_dir: directory to record the board to, created if needed, None to not record it
+        """
+        assert self.scheduler is None, "boards must be added before starting"
+        assert name not in self.sessions, f"board {name} was already added"
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        sample_rate = board.get_sampling_rate()
+        session = BoardSession(
+            name,
+            board,
+            feature_extraction.StreamingPSDFeatureExtractor(
+                sample_rate,
+                data_len_s=data_len_s,
+                bands=bands if bands is not None else DEFAULT_BANDS,
+            ),
+            channel,
+            filter_bank=preprocessing.StreamingFilterBank(sample_rate)
+            if filter_bank
+            else None,
+            file_writer=board_reader.FileWriter(
+                board,
+                out_dir,
+                recording_format,
+                start_thread=False,
+                file_prefix=name,
+            )
+            if out_dir is not None
+            else None,
+            track_sample_age=track_sample_age,
+        )
+        self.sessions[name] = session
+        return session
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """
+        Start the streams of all boards and begin scheduling their tasks. A board that fails to start is marked as
+        failed and the others carry on.
+        """
+        self.io_pool = ThreadPoolExecutor(self.io_workers, thread_name_prefix="io")
+        self.compute_pool = ThreadPoolExecutor(
+            self.compute_workers
+            if self.compute_workers is not None
+            else os.cpu_count(),
+            thread_name_prefix="compute",
+        )
+        tasks = []
+        for session in self.sessions.values():
+            try:
+                session.board.__enter__()
+                session.started = True
+                if session.file_writer is not None:
+                    session.file_writer.open()
+            except Exception:
+                logging.exception(f"Board {session.name} failed to start")
+                session.failed = True
+                continue
+            tasks.append(
+                _PeriodicTask(
+                    session,
+                    "acquisition",
+                    session.acquire,
+                    self.periods_s["acquisition"],
+                    self.io_pool,
+                )
+            )
+            if session.file_writer is not None:
+                tasks.append(
+                    _PeriodicTask(
+                        session,
+                        "recording",
+                        session.record,
+                        self.periods_s["recording"],
+                        self.io_pool,
+                    )
+                )
+            tasks.append(
+                _PeriodicTask(
+                    session,
+                    "features",
+                    session.extract_features,
+                    self.periods_s["features"],
+                    self.compute_pool,
+                )
+            )
+        self.stop_event.clear()
+        self.scheduler = threading.Thread(
+            target=self._schedule, args=(tasks,), name="scheduler", daemon=True
+        )
+        self.scheduler.start()
+
+    def _schedule(self, tasks: List[_PeriodicTask]):
+        """
+        Entry-point of the scheduler thread. Releases are absolute, and spread over the first period so the boards
+        don't all hit the pools at the same moment.
+        """
+        start = time.monotonic()
+        sequence = itertools.count()  # breaks ties between equal release times
+        releases = [
+            (start + task.period_s * index / len(tasks), next(sequence), task)
+            for index, task in enumerate(tasks)
+        ]
+        heapq.heapify(releases)
+        while releases and not self.stop_event.is_set():
+            release, _, task = heapq.heappop(releases)
+            delay = release - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            if task.session.failed:
+                continue
+            if task.future is not None and not task.future.done():
+                with task.metrics_lock:
+                    task.metrics.skipped += 1
+                    task.metrics.deadline_misses += 1
+            else:
+                task.future = task.pool.submit(self._run_task, task, release)
+            release += task.period_s
+            now = time.monotonic()
+            if release < now:
+                # the scheduler itself fell behind, drop the missed releases instead of bursting through them
+                release += (now - release) // task.period_s * task.period_s
+            heapq.heappush(releases, (release, next(sequence), task))
+
+    def _run_task(self, task: _PeriodicTask, release: float):
+        session = task.session
+        with session.scheduling_delay_lock:
+            session.latency_monitor.record(
+                "scheduling_delay", time.monotonic() - release
+            )
+        failed = False
+        try:
+            task.run()
+            task.consecutive_errors = 0
+        except Exception:
+            failed = True
+            task.consecutive_errors += 1
+            logging.exception(f"{task.kind} of board {session.name} failed")
+            if task.consecutive_errors >= self.max_consecutive_errors:
+                logging.error(f"Stopping board {session.name} after repeated errors")
+                session.failed = True
+        missed = time.monotonic() > release + task.period_s
+        with task.metrics_lock:
+            task.metrics.runs += 1
+            task.metrics.errors += failed
+            task.metrics.deadline_misses += missed
+
+    def stop(self):
+        """
+        Stop scheduling, wait for running tasks and close every board and recording.
+        """
+        self.stop_event.set()
+        if self.scheduler is not None:
+            self.scheduler.join()
+            self.scheduler = None
+        for pool in (self.io_pool, self.compute_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        for session in self.sessions.values():
+            if not session.started:
+                continue
+            try:
+                if session.file_writer is not None:
+                    # samples that arrived since the last scheduled write
+                    if session.file_writer.file is not None:
+                        session.file_writer.write_new_data()
+                    session.file_writer.close()
+                session.board.__exit__(None, None, None)
+                session.started = False
+            except Exception:
+                logging.exception(f"Board {session.name} failed to stop")
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        :return: metrics of every board by name
+        """
+        return {name: session.metrics() for name, session in self.sessions.items()}
+
+    def export_metrics(self, file_name: str):
+        with open(file_name, "w") as file:
+            json.dump(self.metrics(), file, indent=2)
+
+    def format_metrics(self) -> str:
+        lines = []
+        for name, metrics in self.metrics().items():
+            tasks = ", ".join(
+                f"{kind} {task['runs']} runs {task['deadline_misses']} missed {task['errors']} errors"
+                for kind, task in metrics["tasks"].items()
+            )
+            psd = metrics["latency"]["psd"]
+            lines.append(
+                f"{name}: {metrics['samples_received']} samples, {metrics['samples_lost']} lost, "
+                f"{metrics['feature_updates']} feature updates (p99 {psd['p99_s'] * 1e3:.2f} ms)"
+                f"{', FAILED' if metrics['failed'] else ''}\n    {tasks}"
+            )
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    boards = parser.add_mutually_exclusive_group(required=True)
+    boards.add_argument(
+        "--synthetic", type=int, metavar="N", help="run N synthetic boards"
+    )
+    boards.add_argument(
+        "--cyton", nargs="+", metavar="PORT", help="serial port of every Cyton"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--channel", type=int, default=2, help="board row of C3")
+    parser.add_argument("--out-dir", help="record every board to this directory")
+    parser.add_argument("--metrics", metavar="FILE", help="save the metrics as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    manager = SessionManager()
+    if args.synthetic is not None:
+        for index in range(args.synthetic):
+            # BrainFlow allows one session per board id and parameters, tell the boards apart by other_info
+            params = BrainFlowInputParams()
+            params.other_info = f"synthetic-{index}"
+            board = board_reader.BoardReader(
+                BoardIds.SYNTHETIC_BOARD, params, enable_dev_logger=False
+            )
+            manager.add_board(
+                f"synthetic-{index}", board, args.channel, out_dir=args.out_dir
+            )
+    else:
+        for index, port in enumerate(args.cyton):
+            board = board_reader.BoardReader(
+                board_params=board_reader.cyton_params(port), enable_dev_logger=False
+            )
+            manager.add_board(
+                f"cyton-{index}", board, args.channel, out_dir=args.out_dir
+            )
+    BoardShim.disable_board_logger()
+
+    with manager:
+        time.sleep(args.duration)
+    print(manager.format_metrics())
+    if args.metrics is not None:
+        manager.export_metrics(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Shared-memory ring buffer carrying a board's live samples to other processes on the same machine.
+
+The board reader's process publishes with `BoardReader.publish_shared_memory`, and any number of processes attach with
+`SharedRingReader` and read the samples in place, e.g. the monitor below:
+
+    python shared_ring.py NAME
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Union
+
+import numpy as np
+from nptyping import NDArray
+
+# magic, version, board id, sample rate, rows, capacity, timestamp row, number of EEG rows
+HEADER = struct.Struct("<4sIiIIIiI")
+MAGIC = b"EEGR"
+VERSION = 1
+MAX_EEG_ROWS = 64
+EEG_ROWS_OFFSET = HEADER.size
+# sequence numbers of the end of the samples being written and of the samples completely written
+INDEX_OFFSET = 192
+HEADER_SIZE = 256  # samples start here, as float64 of shape (rows, capacity)
+
+
+# rings created by this process, which its resource tracker has to keep track of
+_published_names = set()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    block = shared_memory.SharedMemory(name)
+    if os.name == "posix" and block.name not in _published_names:
+        # attaching registers the block with this process's resource tracker, which would unlink it on exit
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+class SharedRingPublisher:
+    """
+    Writes samples into the ring. Sample data is written before the write index moves past it, and the index of the
+    samples about to be overwritten is announced beforehand, so readers can tell whether what they read was intact.
+    Writing never waits for readers, a reader that falls a whole ring behind loses samples.
+    """
+
+    def __init__(
+        self,
+        name: Union[str, None],
+        board_id: int,
+        sample_rate: int,
+        num_rows: int,
+        capacity: int,
+        eeg_rows: List[int],
+        timestamp_row: int,
+    ):
+        """
+        :param name: name of the shared memory block, random if None
+        :param num_rows: board rows of every sample
+        :param capacity: number of samples the ring holds
+        """
+        assert len(eeg_rows) <= MAX_EEG_ROWS
+        self.block = shared_memory.SharedMemory(
+            name, create=True, size=HEADER_SIZE + num_rows * capacity * 8
+        )
+        _published_names.add(self.block.name)
+        self.capacity = capacity
+        self.block.buf[: HEADER.size] = HEADER.pack(
+            MAGIC,
+            VERSION,
+            board_id,
+            sample_rate,
+            num_rows,
+            capacity,
+            timestamp_row,
+            len(eeg_rows),
+        )
+        np.ndarray((len(eeg_rows),), np.uint16, self.block.buf, EEG_ROWS_OFFSET)[
+            :
+        ] = eeg_rows
+        self.indices = np.ndarray((2,), np.uint64, self.block.buf, INDEX_OFFSET)
+        self.indices[:] = 0
+        self.data = np.ndarray(
+            (num_rows, capacity), np.float64, self.block.buf, HEADER_SIZE
+        )
+
+    @property
+    def name(self) -> str:
+        return self.block.name
+
+    def publish(self, new_data: NDArray[float]):
+        """
+        :param new_data: new samples of shape (rows, samples), oldest first
+        """
+        write_index = int(self.indices[1])
+        num_new = new_data.shape[1]
+        self.indices[0] = write_index + num_new
+        kept = new_data[:, -self.capacity :]
+        start = (write_index + num_new - kept.shape[1]) % self.capacity
+        first_part = min(kept.shape[1], self.capacity - start)
+        self.data[:, start : start + first_part] = kept[:, :first_part]
+        self.data[:, : kept.shape[1] - first_part] = kept[:, first_part:]
+        self.indices[1] = write_index + num_new
+
+    def close(self):
+        """
+        Remove the shared memory block. Attached readers keep their mapping until they close.
+        """
+        del self.indices, self.data
+        self.block.close()
+        self.block.unlink()
+        _published_names.discard(self.block.name)
+
+
+class SharedRingReader:
+    """
+    Attaches to a ring published by another process and reads every new sample once, in order, like
+    `board_reader.BoardDataConsumer`. Samples are returned as views of the shared memory, which stay valid until the
+    publisher wraps around and overwrites them, check with `still_valid` after processing them.
+    """
+
+    def __init__(self, name: str, from_oldest: bool = False):
+        """
+        :param name: name the publisher was created with
+        :param from_oldest: start with the oldest samples still in the ring instead of with samples arriving from now on
+        """
+        self.block = _attach(name)
+        (
+            magic,
+            version,
+            self.board_id,
+            self.sample_rate,
+            num_rows,
+            self.capacity,
+            self.timestamp_row,
+            num_eeg_rows,
+        ) = HEADER.unpack_from(self.block.buf)
+        assert magic == MAGIC and version == VERSION, f"{name} isn't a sample ring"
+        self.eeg_rows = np.ndarray(
+            (num_eeg_rows,), np.uint16, self.block.buf, EEG_ROWS_OFFSET
+        ).tolist()
+        self.indices = np.ndarray((2,), np.uint64, self.block.buf, INDEX_OFFSET)
+        self.data = np.ndarray(
+            (num_rows, self.capacity), np.float64, self.block.buf, HEADER_SIZE
+        )
+        write_index = self.write_index
+        self.next_sample = (
+            max(0, write_index - self.capacity) if from_oldest else write_index
+        )
+        self.last_read_start = self.next_sample
+        self.samples_lost = 0
+
+    @property
+    def write_index(self) -> int:
+        """
+        Sequence number of the next sample to be published.
+        """
+        return int(self.indices[1])
+
+    def _views(self, first_sample: int, end_sample: int) -> List[NDArray[float]]:
+        start = first_sample % self.capacity
+        end = start + end_sample - first_sample
+        if end <= self.capacity:
+            return [self.data[:, start:end]]
+        return [self.data[:, start:], self.data[:, : end - self.capacity]]
+
+    def read(self) -> List[NDArray[float]]:
+        """
+        :return: samples published since the previous read, as one or, where the ring wraps, two views of shape
+            (rows, samples), oldest first
+        """
+        write_index = self.write_index
+        oldest_available = int(self.indices[0]) - self.capacity
+        if self.next_sample < oldest_available:
+            self.samples_lost += oldest_available - self.next_sample
+            self.next_sample = oldest_available
+        self.last_read_start = self.next_sample
+        views = self._views(self.next_sample, max(self.next_sample, write_index))
+        self.next_sample = max(self.next_sample, write_index)
+        return views
+
+    def read_copy(self) -> NDArray[float]:
+        """
+        :return: copy of the samples published since the previous read, shape (rows, samples)
+        """
+        while True:
+            data = np.concatenate(self.read(), axis=1)
+            oldest_available = int(self.indices[0]) - self.capacity
+            if self.last_read_start >= oldest_available:
+                return data
+            # the oldest samples were overwritten while copying, only those are lost, the rest is copied again
+            self.samples_lost += oldest_available - self.last_read_start
+            self.next_sample = oldest_available
+
+    def still_valid(self) -> bool:
+        """
+        :return: whether none of the samples returned by the last read have been overwritten since
+        """
+        return self.last_read_start >= int(self.indices[0]) - self.capacity
+
+    def latest(self, num_samples: int) -> NDArray[float]:
+        """
+        :return: copy of the newest samples, up to `num_samples`, oldest first. Doesn't affect `read`.
+        """
+        while True:
+            write_index = self.write_index
+            first = max(0, write_index - min(num_samples, self.capacity))
+            data = np.concatenate(self._views(first, write_index), axis=1)
+            if first >= int(self.indices[0]) - self.capacity:
+                return data
+
+    def close(self):
+        """
+        Detach from the ring, views returned by `read` must not be used afterwards.
+        """
+        del self.indices, self.data
+        self.block.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Attach to a published board stream and print its statistics once a second"
+    )
+    parser.add_argument("name", help="name of the shared memory block")
+    args = parser.parse_args()
+
+    reader = SharedRingReader(args.name)
+    print(
+        f"Attached to board {reader.board_id} at {reader.sample_rate} Hz, EEG rows {reader.eeg_rows}"
+    )
+    try:
+        while True:
+            time.sleep(1)
+            data = reader.read_copy()
+            if data.shape[1] == 0:
+                print("No new samples")
+                continue
+            age_s = time.time() - data[reader.timestamp_row, -1]
+            eeg = data[reader.eeg_rows]
+            print(
+                f"{data.shape[1]} samples, {reader.samples_lost} lost in total, newest {age_s * 1e3:.0f} ms old, "
+                f"EEG standard deviation {np.round(eeg.std(axis=1), 1).tolist()}"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
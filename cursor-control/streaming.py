@@ -0,0 +1,315 @@
+"""
+Local streaming of raw samples and control commands to other programs, e.g. the wheelchair controller stand-in or a
+monitoring dashboard, over TCP on the loopback interface.
+
+Every message is a frame of a fixed header followed by a binary payload, see `FRAME_HEADER`. Each subscriber gets its
+own bounded queue and sender thread, which sends everything queued since its last send in one batch. A subscriber that
+can't keep up loses its oldest frames, and sees the gap in the sequence numbers, instead of slowing down the publisher
+or the other subscribers. Watch a stream with
+
+    python streaming.py --port 8765
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, Iterator, List, Union
+
+import numpy as np
+from nptyping import NDArray
+
+import pipeline
+
+DEFAULT_PORT = 8765
+# message type, sequence number and payload size of every frame
+FRAME_HEADER = struct.Struct("<BII")
+# rows and samples, followed by the samples as float64 of shape (rows, samples)
+SAMPLES_HEADER = struct.Struct("<HI")
+# board timestamp, velocity and number of bands, followed by the band powers as float64
+CONTROL_HEADER = struct.Struct("<diH")
+
+
+class MessageType(Enum):
+    HELLO = 1  # JSON metadata of the stream, the first message to every subscriber
+    SAMPLES = 2  # a block of raw board samples
+    CONTROL = 3  # band powers and the cursor velocity decoded from them
+
+
+@dataclass
+class Message:
+    type: MessageType
+    sequence: int
+    metadata: Union[Dict, None] = None  # HELLO
+    samples: Union[NDArray[float], None] = None  # SAMPLES, shape (rows, samples)
+    # CONTROL, board timestamp of the newest sample
+    timestamp: Union[float, None] = None
+    velocity: Union[int, None] = None  # CONTROL, pixels per second, negative is up
+    band_powers: Union[NDArray[float], None] = None  # CONTROL
+
+
+class _Subscriber(threading.Thread):
+    def __init__(self, connection: socket.socket, address, queue_size: int):
+        super(_Subscriber, self).__init__(name=f"subscriber {address}", daemon=True)
+        self.connection = connection
+        self.address = address
+        self.frames: pipeline.DropOldestQueue[bytes] = pipeline.DropOldestQueue(
+            queue_size
+        )
+        self.stop_event = threading.Event()
+        self.frames_sent = 0
+        self.batches_sent = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                first = self.frames.get(timeout=0.1)
+                if first is None:
+                    continue
+                batch = [first] + self.frames.get_all()
+                self.connection.sendall(b"".join(batch))
+                self.frames_sent += len(batch)
+                self.batches_sent += 1
+        except OSError as e:
+            logging.info(f"Subscriber {self.address} disconnected: {e}")
+        finally:
+            self.stop_event.set()
+            self.connection.close()
+
+    def stop(self):
+        """
+        Stop sending, also when blocked in a send to a client that stopped reading.
+        """
+        self.stop_event.set()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already disconnected
+
+
+class StreamServer:
+    """
+    Accepts subscribers on a local TCP port and sends every published message to all of them. Publishing only encodes
+    the message once and queues it, so it's cheap enough to do from the board reader's polling or the control loop.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        metadata: Union[Dict, None] = None,
+        queue_size: int = 1000,
+    ):
+        """
+        :param port: 0 picks a free port, see `address`
+        :param metadata: sent to every subscriber when it connects, e.g. the sample rate and band names
+        :param queue_size: frames queued per subscriber before its oldest ones are dropped
+        """
+        self.metadata = metadata if metadata is not None else {}
+        self.queue_size = queue_size
+        self.listener = socket.create_server((host, port))
+        self.address = self.listener.getsockname()
+        self.subscribers: List[_Subscriber] = []
+        self.sequence = 0  # of the next published message
+        # held while numbering and queueing a message, and while adding a subscriber
+        self.publish_lock = threading.Lock()
+        self.acceptor = threading.Thread(
+            target=self._accept, name="stream server", daemon=True
+        )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.acceptor.start()
+
+    def _accept(self):
+        """
+        Entry-point for the acceptor thread.
+        """
+        while True:
+            try:
+                connection, address = self.listener.accept()
+            except OSError:
+                return  # listener closed
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = _Subscriber(connection, address, self.queue_size)
+            payload = json.dumps(self.metadata).encode()
+            with self.publish_lock:
+                # numbered like the message that follows it, so the subscriber's sequence starts without a gap
+                subscriber.frames.put(
+                    FRAME_HEADER.pack(
+                        MessageType.HELLO.value, self.sequence, len(payload)
+                    )
+                    + payload
+                )
+                self.subscribers = [
+                    s for s in self.subscribers if not s.stop_event.is_set()
+                ] + [subscriber]
+            subscriber.start()
+            logging.info(f"Subscriber {address} connected")
+
+    def _publish(self, message_type: MessageType, payload: bytes):
+        if not self.subscribers:
+            return
+        with self.publish_lock:
+            frame = (
+                FRAME_HEADER.pack(message_type.value, self.sequence, len(payload))
+                + payload
+            )
+            self.sequence += 1
+            for subscriber in self.subscribers:
+                if not subscriber.stop_event.is_set():
+                    subscriber.frames.put(frame)
+
+    def publish_samples(self, data: NDArray[float]):
+        """
+        :param data: board samples of shape (rows, samples), e.g. from a `board_reader.BoardReader` listener
+        """
+        if not self.subscribers:
+            return
+        self._publish(
+            MessageType.SAMPLES,
+            SAMPLES_HEADER.pack(*data.shape)
+            + np.ascontiguousarray(data, dtype="<f8").tobytes(),
+        )
+
+    def publish_command(self, command: pipeline.ControlCommand):
+        band_powers = np.asarray(command.feature.band_powers, dtype="<f8")
+        self._publish(
+            MessageType.CONTROL,
+            CONTROL_HEADER.pack(
+                command.feature.timestamp, command.velocity, len(band_powers)
+            )
+            + band_powers.tobytes(),
+        )
+
+    def metrics(self) -> List[Dict]:
+        """
+        :return: frames sent, batches sent and frames dropped of every connected subscriber
+        """
+        return [
+            {
+                "address": f"{subscriber.address[0]}:{subscriber.address[1]}",
+                "frames_sent": subscriber.frames_sent,
+                "batches_sent": subscriber.batches_sent,
+                "frames_dropped": subscriber.frames.num_dropped,
+            }
+            for subscriber in self.subscribers
+            if not subscriber.stop_event.is_set()
+        ]
+
+    def stop(self):
+        self.listener.close()
+        for subscriber in self.subscribers:
+            subscriber.stop()
+        for subscriber in self.subscribers:
+            subscriber.join()
+        self.subscribers = []
+
+
+class StreamClient:
+    """
+    Subscribes to a `StreamServer` and decodes its messages. Messages dropped for this subscriber are counted in
+    `messages_lost`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.connection = socket.create_connection((host, port))
+        self.file = self.connection.makefile("rb")
+        self.next_sequence: Union[int, None] = None
+        self.messages_lost = 0
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self.file.read(size)
+        if len(data) < size:
+            raise EOFError("stream closed")
+        return data
+
+    def read(self) -> Message:
+        """
+        Block until the next message arrives.
+
+        :raises EOFError: when the server closes the stream
+        """
+        message_type, sequence, size = FRAME_HEADER.unpack(
+            self._read_exactly(FRAME_HEADER.size)
+        )
+        payload = self._read_exactly(size)
+        message = Message(MessageType(message_type), sequence)
+        if self.next_sequence is not None:
+            self.messages_lost += sequence - self.next_sequence
+        # hello shares its number with the message after it
+        self.next_sequence = sequence + (message.type != MessageType.HELLO)
+        if message.type == MessageType.HELLO:
+            message.metadata = json.loads(payload)
+        elif message.type == MessageType.SAMPLES:
+            num_rows, num_samples = SAMPLES_HEADER.unpack_from(payload)
+            message.samples = np.frombuffer(
+                payload, dtype="<f8", offset=SAMPLES_HEADER.size
+            ).reshape(num_rows, num_samples)
+        else:
+            message.timestamp, message.velocity, num_bands = CONTROL_HEADER.unpack_from(
+                payload
+            )
+            message.band_powers = np.frombuffer(
+                payload, dtype="<f8", count=num_bands, offset=CONTROL_HEADER.size
+            )
+        return message
+
+    def __iter__(self) -> Iterator[Message]:
+        try:
+            while True:
+                yield self.read()
+        except EOFError:
+            return
+
+    def close(self):
+        self.file.close()
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Subscribe to a stream and print what arrives once a second"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    client = StreamClient(args.host, args.port)
+    num_samples = 0
+    num_commands = 0
+    last_command: Union[Message, None] = None
+    report_time = time.monotonic() + 1
+    for message in client:
+        if message.type == MessageType.HELLO:
+            print(f"Connected, stream metadata: {message.metadata}")
+        elif message.type == MessageType.SAMPLES:
+            num_samples += message.samples.shape[1]
+        else:
+            num_commands += 1
+            last_command = message
+        if time.monotonic() >= report_time:
+            velocity = last_command.velocity if last_command is not None else None
+            print(
+                f"{num_samples} samples, {num_commands} commands, last velocity {velocity}, "
+                f"{client.messages_lost} messages lost in total"
+            )
+            num_samples = num_commands = 0
+            report_time += 1
+    print("Stream closed")
+
+
+if __name__ == "__main__":
+    main()